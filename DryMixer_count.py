@@ -1,78 +1,114 @@
 # Dry Mixer — легкий міксер відео (tkinter/ttk)
 # by kremsalkin
 
-import json, os, sys, random, shutil, subprocess, threading, time
+import os, sys, random, subprocess, threading, time
 from pathlib import Path
-from queue import Queue, Empty
 
 import tkinter as tk
-from tkinter import filedialog, messagebox, ttk
+from tkinter import filedialog, messagebox, ttk, font as tkfont
 
-DEFAULT_DURATION = "01:00:00"
-DEFAULT_CRF = 18
-DEFAULT_ABR = "160k"
-LOG_POLL_MS = 80
+from drymixer_engine import (DEFAULT_DURATION, DEFAULT_CRF, DEFAULT_ABR, ClipModel, Engine, JobSpec, LogPipe, compat_result,
+                             estimate_text, fmt_hhmmss, have_ffmpeg, infer_block_size, progress_text, session_log)
 
-# ---------- Утиліти ----------
-def have_ffmpeg():
-    try:
-        subprocess.run(["ffmpeg","-version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        subprocess.run(["ffprobe","-version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        return True
-    except Exception:
-        return False
-
-def parse_duration(s: str) -> int:
-    s = (s or "").strip()
-    if not s: return 0
-    p = [int(x) for x in s.split(":")]
-    if   len(p)==1: h,m,sec = 0,0,p[0]
-    elif len(p)==2: h,m,sec = 0,p[0],p[1]
-    else:           h,m,sec = p[-3],p[-2],p[-1]
-    return h*3600 + m*60 + sec
-
-def ffprobe_duration(p: Path) -> float:
-    try:
-        out = subprocess.check_output(
-            ["ffprobe","-v","error","-show_entries","format=duration",
-             "-of","default=nokey=1:noprint_wrappers=1", str(p)], text=True)
-        return float(out.strip())
-    except Exception:
-        return 0.0
-
-# ---------- Шафл ----------
-def shuffle_full(items):
-    items=list(items); random.shuffle(items); return items
-
-def infer_block_size(items):
-    n=len(items)
-    if n==0: return 0
-    for k in range(1, min(n,500)+1):
-        if n%k==0 and items[:k]*(n//k)==items: return k
-    seen=set()
-    for i,x in enumerate(items,1):
-        if x in seen: return i-1 if i>1 else n
-        seen.add(x)
-    return n
-
-def shuffle_blockwise_no_seam(items, bsz):
-    if bsz<=0: return shuffle_full(items)
-    out=[]; prev=None
-    for i in range(0,len(items),bsz):
-        block=items[i:i+bsz]; random.shuffle(block)
-        if prev is not None and block and block[0]==prev:
-            for j in range(1,len(block)):
-                if block[j]!=prev: block[0],block[j]=block[j],block[0]; break
-        out.extend(block); prev = block[-1] if block else None
-    return out
-
-def enforce_no_adjacent_duplicates(seq):
-    seq=list(seq); n=len(seq)
-    for i in range(1,n):
-        if seq[i]==seq[i-1]:
-            for j in range(i+1,n):
-                if seq[j]!=seq[i-1]: seq[i],seq[j]=seq[j],seq[i]; break
-    return seq
+LOG_POLL_MS = 80
+LOG_TICK_LINES = 2000    # не більше рядків за один тік (решта сплеску — лише у файлі)
+LOG_MAX_LINES = 5000     # скільки рядків тримає віджет логу
+CODEC_IDS = {"Без перекодування (copy)":"copy","x264 (CPU)":"x264","NVENC (NVIDIA)":"nvenc",
+             "QSV (Intel)":"qsv","AMF (AMD)":"amf"}
+
+# ---------- Віртуальний список ----------
+# Listbox містить лише видимі рядки ClipModel; прокрутка, виділення й перетягування
+# ведуться в індексах моделі, тож вартість перемальовування не залежить від довжини списку.
+class VirtualList:
+    def __init__(self, master, model: ClipModel, width=58, height=28, on_change=None):
+        self.model=model; self.top=0; self.rows=height; self.sel=set(); self.anchor=None
+        self.on_change=on_change or (lambda: None); self._drag=None; self._moved=False
+        self.lb=tk.Listbox(master, selectmode=tk.EXTENDED, width=width, height=height, activestyle="none",
+                           exportselection=False)
+        self.sb=ttk.Scrollbar(master, orient=tk.VERTICAL, command=self._yview)
+        for ev,fn in (("<ButtonPress-1>",self._press),("<Shift-ButtonPress-1>",self._shift_press),
+                      ("<Control-ButtonPress-1>",self._ctrl_press),("<B1-Motion>",self._motion),
+                      ("<ButtonRelease-1>",self._release),("<MouseWheel>",self._wheel),
+                      ("<Button-4>",self._wheel),("<Button-5>",self._wheel),("<Configure>",self._configure),
+                      ("<Control-a>",self._select_all)):
+            self.lb.bind(ev,fn)
+
+    def selection(self) -> list: return sorted(self.sel)
+
+    def clear_selection(self): self.sel.clear(); self.anchor=None
+
+    def refresh(self):
+        n=len(self.model); self.top=max(0,min(self.top,n-self.rows))
+        rows=self.model.slice(self.top,self.top+self.rows)
+        self.lb.delete(0,tk.END)
+        if rows: self.lb.insert(tk.END,*rows)
+        for i in range(len(rows)):
+            if self.top+i in self.sel: self.lb.selection_set(i)
+        self.sb.set(*((self.top/n, min(1.0,(self.top+self.rows)/n)) if n else (0.0,1.0)))
+
+    def _yview(self, *args):
+        if args[0]=="moveto": self.top=int(float(args[1])*len(self.model))
+        elif args[0]=="scroll": self.top+=int(args[1])*(self.rows if args[2]=="pages" else 1)
+        self.refresh()
+
+    def _row(self, e):
+        i=self.lb.nearest(e.y)
+        return self.top+i if 0<=i and self.top+i<len(self.model) else None
+
+    def _press(self, e):
+        self.lb.focus_set(); i=self._row(e)
+        if i is None: return "break"
+        if i not in self.sel: self.sel={i}
+        self.anchor=i; self._drag=i; self._moved=False; self.refresh()
+        return "break"
+
+    def _shift_press(self, e):
+        i=self._row(e)
+        if i is not None:
+            a=i if self.anchor is None else self.anchor
+            self.sel=set(range(min(a,i),max(a,i)+1)); self.refresh()
+        return "break"
+
+    def _ctrl_press(self, e):
+        i=self._row(e)
+        if i is not None:
+            self.sel^={i}; self.anchor=i; self.refresh()
+        return "break"
+
+    def _select_all(self, e=None):
+        self.sel=set(range(len(self.model))); self.refresh()
+        return "break"
+
+    def _motion(self, e):
+        if self._drag is None or not self.sel: return "break"
+        if e.y<0: self.top=max(0,self.top-1)
+        elif e.y>self.lb.winfo_height(): self.top+=1
+        to=self.top+max(0,self.lb.nearest(e.y))
+        if to==self._drag: return "break"
+        sel=self.selection()
+        start=self.model.move(sel, to); self.sel=set(range(start,start+len(sel)))
+        self._drag=start; self._moved=True; self.refresh()
+        return "break"
+
+    def _release(self, e):
+        if self._drag is not None and not self._moved:
+            i=self._row(e)
+            if i is not None and len(self.sel)>1: self.sel={i}; self.refresh()
+        if self._moved: self.on_change()
+        self._drag=None; self._moved=False
+        return "break"
+
+    def _wheel(self, e):
+        up=e.num==4 or getattr(e,"delta",0)>0
+        self.top+=-3 if up else 3; self.refresh()
+        return "break"
+
+    def _configure(self, e):
+        # Скільки рядків вміщується: висота рядка Listbox = linespace + 1 + 2·selectborderwidth
+        pitch=tkfont.Font(font=self.lb.cget("font")).metrics("linespace")+1+2*int(self.lb.cget("selectborderwidth"))
+        inner=e.height-2*(int(self.lb.cget("borderwidth"))+int(self.lb.cget("highlightthickness")))
+        rows=max(1,inner//max(1,pitch))
+        if rows!=self.rows: self.rows=rows; self.refresh()
 
 # ---------- Додаток ----------
 class App:
@@ -88,8 +124,8 @@ class App:
         style.configure("Border.TButton", padding=6, relief="raised", borderwidth=2)
         style.map("Border.TButton", relief=[("pressed","sunken")], background=[("active","#e0e4ff")])
 
-        self.log_q=Queue(); self.worker=None; self.block_size=None
-        self.stop_flag=threading.Event(); self.current_proc=None
+        self.log_q=LogPipe(session_log()); self.worker=None; self.block_size=None
+        self.engine=Engine(log=self.log_q.put, status=self._job_status)
         self.running=False; self.start_ts=None
 
         # ------- Ліва (фіксована) -------
@@ -97,18 +133,12 @@ class App:
 
         lf=ttk.LabelFrame(left, text="Вхідні кліпи"); lf.pack(fill=tk.Y)
         cont=ttk.Frame(lf, padding=6); cont.pack(fill=tk.BOTH, expand=True)
-        self.listbox=tk.Listbox(cont, selectmode=tk.EXTENDED, width=58, height=28, activestyle="none")
-        sb=ttk.Scrollbar(cont, orient=tk.VERTICAL, command=self.listbox.yview)
-        self.listbox.configure(yscrollcommand=sb.set)
-        self.listbox.grid(row=0,column=0,sticky="nsew"); sb.grid(row=0,column=1,sticky="ns")
+        # Модель списку + віртуальний вид (Drag&Drop, Shift/Ctrl-виділення — у VirtualList)
+        self.clips=ClipModel()
+        self.clip_view=VirtualList(cont, self.clips, width=58, height=28, on_change=self.update_block_label)
+        self.clip_view.lb.grid(row=0,column=0,sticky="nsew"); self.clip_view.sb.grid(row=0,column=1,sticky="ns")
         cont.columnconfigure(0,weight=1); cont.rowconfigure(0,weight=1)
 
-        # Drag&Drop reorder
-        self._drag_data={"idx":None}
-        self.listbox.bind("<ButtonPress-1>", self._on_lb_press)
-        self.listbox.bind("<B1-Motion>", self._on_lb_motion)
-        self.listbox.bind("<ButtonRelease-1>", self._on_lb_release)
-
         r=ttk.Frame(left,padding=(0,6)); r.pack(fill=tk.X)
         ttk.Button(r,text="➕ Додати файли",style="Border.TButton",command=self.add_files).pack(side=tk.LEFT)
         ttk.Button(r,text="🗑 Видалити",style="Border.TButton",command=self.remove_sel).pack(side=tk.LEFT,padx=6)
@@ -133,11 +163,21 @@ class App:
         ttk.Radiobutton(modef,text="Повний рандом",variable=self.shuffle_mode,value="full").pack(anchor='w')
         ttk.Radiobutton(modef,text="Рандом блоками (з антишовом)",variable=self.shuffle_mode,value="block").pack(anchor='w')
         self.block_lbl=ttk.Label(modef,text="Розмір блока: (авто)"); self.block_lbl.pack(anchor='w',pady=(4,6))
+        r=ttk.Frame(modef); r.pack(anchor='w',pady=(0,6))
+        ttk.Label(r,text="Без повтору в межах:").pack(side=tk.LEFT)
+        self.min_gap=ttk.Spinbox(r,from_=0,to=1000,width=5); self.min_gap.delete(0,tk.END); self.min_gap.insert(0,"1")
+        self.min_gap.pack(side=tk.LEFT,padx=4)
+        ttk.Label(r,text="Seed:").pack(side=tk.LEFT,padx=(8,0))
+        self.seed_entry=ttk.Entry(r,width=10); self.seed_entry.pack(side=tk.LEFT,padx=4)
         ttk.Button(modef,text="Перемішати зараз",style="Border.TButton",command=self.do_shuffle_now).pack(anchor='w')
 
         self.autofill=tk.IntVar(value=1)
         ttk.Checkbutton(left,text="Автозаповнення списку до цільової тривалості",variable=self.autofill)\
-            .pack(anchor='w',pady=8)
+            .pack(anchor='w',pady=(8,2))
+        r=ttk.Frame(left); r.pack(anchor='w',pady=(0,8))
+        ttk.Label(r,text="Допуск, с:").pack(side=tk.LEFT)
+        self.tolerance=ttk.Spinbox(r,from_=0,to=60,increment=0.5,width=5)
+        self.tolerance.delete(0,tk.END); self.tolerance.insert(0,"2"); self.tolerance.pack(side=tk.LEFT,padx=4)
 
         # ------- Права (скрол) -------
         right_canvas = tk.Canvas(root, highlightthickness=0)
@@ -196,6 +236,14 @@ class App:
         self.batch_shuffle=tk.IntVar(value=1)
         ttk.Checkbutton(batchf,text="Перемішувати перед кожною",variable=self.batch_shuffle)\
             .pack(side=tk.LEFT)
+        ttk.Label(batchf,text="Паралельно:").pack(side=tk.LEFT,padx=(12,4))
+        self.batch_par=ttk.Spinbox(batchf,from_=1,to=16,width=4)
+        self.batch_par.delete(0,tk.END); self.batch_par.insert(0,"1")
+        self.batch_par.pack(side=tk.LEFT,pady=4)
+        self.jobs_view=ttk.Treeview(right,columns=("st","out"),show="headings",height=4)
+        self.jobs_view.heading("st",text="Статус"); self.jobs_view.heading("out",text="Файл")
+        self.jobs_view.column("st",width=160,stretch=False); self.jobs_view.column("out",width=360)
+        self.jobs_view.pack(fill=tk.X,pady=(0,6))
 
         simplef=ttk.Frame(right); simplef.pack(fill=tk.X,pady=4)
         self.same_params=tk.IntVar(value=0)
@@ -225,6 +273,9 @@ class App:
         ttk.OptionMenu(rc,self.codec_choice,"x264 (CPU)",
                        "Без перекодування (copy)","x264 (CPU)","NVENC (NVIDIA)","QSV (Intel)","AMF (AMD)")\
                        .pack(side=tk.LEFT,padx=6)
+        self.hw_fallback=tk.IntVar(value=1)
+        ttk.Checkbutton(self.codec_f,text="Якщо GPU-кодер недоступний — кодувати x264",variable=self.hw_fallback)\
+            .pack(anchor='w',padx=6,pady=(0,6))
 
         self.mode_enc=ttk.LabelFrame(right,text="Режим виходу"); self.mode_enc.pack(fill=tk.X,pady=6)
         self.out_mode=tk.StringVar(value="copy")
@@ -232,6 +283,15 @@ class App:
                         variable=self.out_mode,value="copy").pack(anchor='w')
         ttk.Radiobutton(self.mode_enc,text="Нормалізувати кожен (→ швидкий конкат)",
                         variable=self.out_mode,value="norm").pack(anchor='w')
+        self.chunked=tk.IntVar(value=0)
+        ttk.Checkbutton(self.mode_enc,text="Кодувати фінал частинами паралельно",variable=self.chunked)\
+            .pack(anchor='w',pady=(4,0))
+        self.stream=tk.IntVar(value=0)
+        ttk.Checkbutton(self.mode_enc,text="Нормалізувати потоком у фінал (без проміжних файлів)",variable=self.stream)\
+            .pack(anchor='w')
+        self.smart_trim=tk.IntVar(value=1)
+        ttk.Checkbutton(self.mode_enc,text="Точна тривалість без перекодування (лише хвіст)",variable=self.smart_trim)\
+            .pack(anchor='w')
         ttk.Button(self.mode_enc,text="Перевірити сумісність",style="Border.TButton",
                    command=self.check_and_recommend).pack(side=tk.RIGHT,padx=8,pady=4)
 
@@ -243,6 +303,10 @@ class App:
         ttk.Label(rq1,text="Аудіо бітрейт:").pack(side=tk.LEFT)
         self.abr=tk.StringVar(value=DEFAULT_ABR)
         ttk.OptionMenu(rq1,self.abr,"160k","128k","160k","192k","224k","256k").pack(side=tk.LEFT,padx=6)
+        ttk.Label(rq1,text="Гучність, LUFS (0 — як є):").pack(side=tk.LEFT,padx=(10,0))
+        # Ті самі межі, що й у JobSpec.validate: 0 або від -70 до -5
+        self.lufs=ttk.Spinbox(rq1,values=tuple(range(-70,-4))+(0,),width=4)
+        self.lufs.delete(0,tk.END); self.lufs.insert(0,"0"); self.lufs.pack(side=tk.LEFT,padx=4)
         rq2=ttk.Frame(qf); rq2.pack(fill=tk.X,padx=6,pady=(2,6))
         ttk.Label(rq2,text="Зовнішній аудіо-файл:").pack(side=tk.LEFT)
         self.audio_entry=ttk.Entry(rq2,width=54); self.audio_entry.pack(side=tk.LEFT,padx=6)
@@ -259,9 +323,13 @@ class App:
 
         bottom=ttk.Frame(right); bottom.pack(fill=tk.X,pady=(6,0))
         ttk.Button(bottom,text="▶️ Старт",style="Border.TButton",command=self.start_clicked).pack(side=tk.LEFT)
+        ttk.Button(bottom,text="⏯ Продовжити",style="Border.TButton",
+                   command=lambda: self.start_clicked(resume=True)).pack(side=tk.LEFT,padx=(6,0))
+        ttk.Button(bottom,text="📋 План",style="Border.TButton",command=self.on_plan).pack(side=tk.LEFT,padx=(6,0))
         ttk.Button(bottom,text="⏹ Стоп",style="Border.TButton",command=self.on_stop).pack(side=tk.LEFT,padx=6)
         ttk.Button(bottom,text="🗑 Очистити логи",style="Border.TButton",command=self.clear_logs).pack(side=tk.LEFT)
-        self.progress=ttk.Progressbar(bottom,mode="indeterminate",length=120); self.progress.pack(side=tk.LEFT,padx=10)
+        ttk.Button(bottom,text="📄 Лог-файли",style="Border.TButton",command=self.open_log_folder).pack(side=tk.LEFT,padx=6)
+        self.progress=ttk.Progressbar(bottom,mode="determinate",maximum=100,length=120); self.progress.pack(side=tk.LEFT,padx=10)
         self.status=ttk.Label(bottom,text="Готово",anchor="w"); self.status.pack(side=tk.LEFT,padx=8)
         self.elapsed_var=tk.StringVar(value="00:00")
         ttk.Label(bottom,text="⏱").pack(side=tk.LEFT,padx=(12,2))
@@ -281,6 +349,7 @@ class App:
 ------------------------------------------------------------
 """
         self.log_write(banner + "\n")
+        self.log_write(f"[ЛОГ] Повний лог: {self.log_q.disk.path}\n")
 
         def _init_scroll():
             right.update_idletasks()
@@ -292,23 +361,34 @@ class App:
         self.root.after(LOG_POLL_MS,self.flush_log)
 
     # ---------- Допоміжні ----------
-    def _fmt_hhmmss(self, secs:int)->str:
-        h=secs//3600; m=(secs%3600)//60; s=secs%60
-        return f"{h:02d}:{m:02d}:{s:02d}" if h else f"{m:02d}:{s:02d}"
+    def _fmt_hhmmss(self, secs:int)->str: return fmt_hhmmss(secs)
 
     def _tick_elapsed(self):
         if not getattr(self,"start_ts",None): return
         if self.running:
             self.elapsed_var.set(self._fmt_hhmmss(int(time.time()-self.start_ts)))
+            self._show_progress()
             self.root.after(500,self._tick_elapsed)
 
-    def log_write(self,s:str): self.log.insert(tk.END,s); self.log.see(tk.END)
+    def _show_progress(self):
+        snap=self.engine.tracker.snapshot()
+        self.progress.configure(value=round(snap["fraction"]*100,1))
+        self.status.configure(text=progress_text(snap, self.engine.tracker.jobs))
+
+    def log_write(self,s:str):
+        # Одна вставка за тік; віджет тримає лише останні LOG_MAX_LINES рядків.
+        # Автопрокрутка — лише якщо користувач і так унизу
+        at_end=self.log.yview()[1]>=0.999
+        self.log.insert(tk.END,s)
+        extra=int(self.log.index("end-1c").split(".")[0])-LOG_MAX_LINES
+        if extra>0: self.log.delete("1.0",f"{extra+1}.0")
+        if at_end: self.log.see(tk.END)
 
     def flush_log(self):
         try:
-            while True: self.log_write(self.log_q.get_nowait())
-        except Empty:
-            pass
+            lines,dropped=self.log_q.drain(LOG_TICK_LINES)
+            if dropped: lines.insert(0,f"[ЛОГ] … {dropped} рядків пропущено у вікні (є у файлі).\n")
+            if lines: self.log_write("".join(lines))
         finally:
             self.root.after(LOG_POLL_MS,self.flush_log)
 
@@ -316,89 +396,51 @@ class App:
         self.running=val
         if val:
             self.status.configure(text="Виконується…")
-            self.start_ts=time.time(); self.elapsed_var.set("00:00"); self._tick_elapsed()
-            try: self.progress.start(80)
-            except: pass
+            self.start_ts=time.time(); self.elapsed_var.set("00:00")
+            self.progress.configure(value=0); self._tick_elapsed()
         else:
             self.status.configure(text="Готово")
             self.start_ts=None; self.elapsed_var.set("00:00")
-            try: self.progress.stop()
-            except: pass
-
-    def _numbered_out(self, base: Path, idx: int) -> Path:
-        stem, suf = base.stem, base.suffix or ".mp4"
-        return base.with_name(f"{stem}_{idx}{suf}")
-
-    # ---------- Drag&Drop ----------
-    def _on_lb_press(self,e): 
-        idx=self.listbox.nearest(e.y)
-        if idx>=0: self._drag_data["idx"]=idx
-    def _on_lb_motion(self,e):
-        fr=self._drag_data.get("idx")
-        if fr is None: return
-        to=self.listbox.nearest(e.y)
-        if to==fr or to<0: return
-        sel=list(self.listbox.curselection())
-        if fr not in sel:
-            it=self.listbox.get(fr); self.listbox.delete(fr)
-            self.listbox.insert(to,it); self.listbox.selection_clear(0,tk.END)
-            self.listbox.selection_set(to); self._drag_data["idx"]=to
-        else:
-            items=[self.listbox.get(i) for i in sel]
-            for i in reversed(sel): self.listbox.delete(i)
-            ins=self.listbox.nearest(e.y)
-            for k,it in enumerate(items): self.listbox.insert(ins+k,it)
-            self.listbox.selection_clear(0,tk.END)
-            for k in range(len(items)): self.listbox.selection_set(ins+k)
-            self._drag_data["idx"]=ins
-    def _on_lb_release(self,e): self._drag_data["idx"]=None; self.update_block_label()
+            self.progress.configure(value=0)
 
     # ---------- Операції зі списком ----------
     def add_files(self):
         files=filedialog.askopenfilenames(title="Виберіть відео",
               filetypes=[("MP4","*.mp4"),("Усі файли","*.*")])
-        for f in files: self.listbox.insert(tk.END,f)
+        self.clips.extend(files); self.clip_view.refresh()
         self.update_block_label()
 
     def remove_sel(self):
-        for i in reversed(self.listbox.curselection()): self.listbox.delete(i)
+        self.clips.delete(self.clip_view.selection()); self.clip_view.clear_selection(); self.clip_view.refresh()
         self.update_block_label()
 
     def clear_all(self):
-        self.listbox.delete(0,tk.END); self.block_size=None; self.update_block_label()
+        self.clips.clear(); self.clip_view.clear_selection(); self.clip_view.refresh()
+        self.block_size=None; self.update_block_label()
 
     def duplicate_selected(self):
-        sel=list(self.listbox.curselection())
+        sel=self.clip_view.selection()
         if not sel: messagebox.showerror("Помилка","Вибери хоча б один елемент"); return
-        n=int(self.dup_sel.get()); items=[self.listbox.get(i) for i in sel]
-        for _ in range(n-1):
-            for p in items: self.listbox.insert(tk.END,p)
+        self.clips.duplicate(sel, int(self.dup_sel.get())); self.clip_view.refresh()
         self.update_block_label()
 
     def duplicate_all(self):
-        n=int(self.dup_all.get()); base=self.listbox.size()
-        items=[self.listbox.get(i) for i in range(base)]
-        for _ in range(n-1):
-            for p in items: self.listbox.insert(tk.END,p)
+        base=len(self.clips); self.clips.duplicate_all(int(self.dup_all.get())); self.clip_view.refresh()
         self.block_size=base; self.update_block_label()
 
     def update_block_label(self):
-        items=[self.listbox.get(i) for i in range(self.listbox.size())]
         if self.block_size: self.block_lbl.config(text=f"Розмір блока: {self.block_size}")
         else:
-            auto=infer_block_size(items) if items else 0
+            auto=infer_block_size(self.clips.ids) if len(self.clips) else 0
             self.block_lbl.config(text=f"Розмір блока: (авто={auto})")
 
     def do_shuffle_now(self):
-        items=[self.listbox.get(i) for i in range(self.listbox.size())]
-        if not items: return
-        if self.shuffle_mode.get()=="block":
-            bsz=self.block_size or infer_block_size(items)
-            items=shuffle_blockwise_no_seam(items,bsz)
-            items=enforce_no_adjacent_duplicates(items)
-        else: items=shuffle_full(items)
-        self.listbox.delete(0,tk.END)
-        for it in items: self.listbox.insert(tk.END,it)
+        if not len(self.clips): return
+        try: seed=self._seed(); gap=int(self.min_gap.get() or "0")
+        except ValueError as e: messagebox.showerror("Помилка",str(e)); return
+        self.clips.shuffle(self.shuffle_mode.get(), self.block_size or 0, gap,
+                           random.Random(seed) if seed is not None else None)
+        self.clip_view.clear_selection(); self.clip_view.refresh()
 
     # ---------- Файли/вихід/аудіо ----------
     def pick_outfile(self):
@@ -411,6 +453,12 @@ class App:
         try: folder=Path(path_str).expanduser().resolve().parent
         except Exception as e:
             messagebox.showerror("Відкрити папку",f"Некоректний шлях: {e}"); return
+        self._open_folder(folder)
+
+    def open_log_folder(self):
+        self._open_folder(self.log_q.disk.path.parent)
+
+    def _open_folder(self, folder:Path):
         try: folder.mkdir(parents=True,exist_ok=True)
         except: pass
         try:
@@ -425,7 +473,7 @@ class App:
         if p: self.audio_entry.delete(0,tk.END); self.audio_entry.insert(0,p)
     def clear_logs(self):
         self.log.delete("1.0",tk.END)
-        with self.log_q.mutex: self.log_q.queue.clear()
+        self.log_q.clear()
         self.status.configure(text="Логи очищено")
 
     def toggle_video_params(self):
@@ -435,48 +483,29 @@ class App:
             if not self.vidf.winfo_manager(): self.vidf.pack(before=self.mode_enc,fill=tk.X,pady=6)
 
     # ---------- Перевірка сумісності ----------
-    def _probe_signature(self, path:str):
-        try:
-            out=subprocess.check_output(
-                ["ffprobe","-v","error",
-                 "-select_streams","v:0,a:0",
-                 "-show_entries","stream=codec_type,codec_name,width,height,pix_fmt,avg_frame_rate,channels,sample_rate",
-                 "-of","json", path], text=True)
-            data=json.loads(out)
-            vcodec=width=height=pix=fps=None; acodec=ch=sr=None
-            for s in data.get("streams",[]):
-                t=s.get("codec_type")
-                if t=="video":
-                    vcodec=s.get("codec_name"); width=s.get("width"); height=s.get("height"); pix=s.get("pix_fmt")
-                    afr=s.get("avg_frame_rate") or "0/0"
-                    if "/" in afr and afr!="0/0":
-                        num,den=afr.split("/")
-                        try: fps=round(float(num)/float(den),3)
-                        except: fps=afr
-                    else: fps=afr
-                elif t=="audio":
-                    acodec=s.get("codec_name"); ch=s.get("channels"); sr=s.get("sample_rate")
-            return (vcodec,width,height,pix,fps,acodec,ch,sr)
-        except Exception:
-            return None
-
-    def _compat_result(self, files):
-        sig0=None; bad=[]
-        for p in files:
-            sig=self._probe_signature(p)
-            if sig is None:
-                bad.append(f"{Path(p).name}: не вдалося прочитати"); continue
-            if sig0 is None: sig0=sig
-            elif sig!=sig0:
-                labels=["vcodec","width","height","pix_fmt","fps","acodec","channels","sample_rate"]
-                dif=[f"{labels[i]}: {sig[i]} ≠ {sig0[i]}" for i in range(len(sig)) if sig[i]!=sig0[i]]
-                bad.append(f"{Path(p).name}: "+("; ".join(dif) if dif else "відмінності"))
-        return (not bad and sig0 is not None), ("\n".join(bad) if bad else "Немає даних")
-
     def check_and_recommend(self):
-        files=[self.listbox.get(i) for i in range(self.listbox.size())]
+        files=self.clips.unique()
         if not files: messagebox.showerror("Перевірка","Список порожній."); return
-        ok, info = self._compat_result(files)
+        if getattr(self,"_checking",False):
+            self.log_q.put("[ІНФО] Перевірка вже виконується.\n"); return
+        self._checking=True; self.status.configure(text="Перевірка сумісності…")
+        last=[0.0]
+
+        def progress(done,total):
+            now=time.time()
+            if done==total or now-last[0]>=0.2:
+                last[0]=now
+                self.root.after(0, lambda: self.status.configure(text=f"Перевірка: {done}/{total}"))
+
+        def work():
+            try: ok, info = compat_result(files, progress)
+            except Exception as e: ok, info = False, str(e)
+            self.root.after(0, lambda: self._show_compat(ok, info))
+
+        threading.Thread(target=work,daemon=True).start()
+
+    def _show_compat(self, ok, info):
+        self._checking=False; self.status.configure(text="Готово")
         if ok:
             self.same_params.set(1); self.toggle_video_params(); self.out_mode.set("copy")
             self.log_q.put("[ІНФО] Усі кліпи сумісні. Рекомендовано: «Склеїти як є».\n")
@@ -484,238 +513,111 @@ class App:
         else:
             self.same_params.set(0); self.toggle_video_params(); self.out_mode.set("norm")
             self.log_q.put("[ПОПЕРЕДЖЕННЯ] Кліпи відрізняються — рекомендую «Нормалізувати кожен».\n")
+            if len(info)>4000: info=info[:4000]+"\n…"
             messagebox.showwarning("Перевірка сумісності","❌ Є відмінності.\nРежим: «Нормалізувати кожен».\n\n"+info)
 
-    # ---------- Побудова/фільтри/кодек ----------
-    def build_concat(self, files, path:Path):
-        with open(path,"w",encoding="utf-8") as f:
-            for p in files: f.write(f"file '{Path(p).resolve().as_posix()}'\n")
-
-    def video_filters_and_rate(self):
-        if self.same_params.get()==1: return None,[]
-        vf=[]; preset=self.res_preset.get()
-        if preset!="Оригінал":
-            w=preset.split("x")[0]; vf.append(f"scale={w}:-2")
-        fps=self.fps_choice.get(); rate=[]
-        if fps!="Оригінал":
-            vf.append(f"fps={fps}"); rate=["-r",fps,"-vsync","cfr"]
-        return (",".join(vf) if vf else None), rate
-
-    def expand_to_duration(self, files, target_s):
-        if not files: return []
-        durs=[]
-        for p in files:
-            try:
-                out=subprocess.check_output(
-                    ["ffprobe","-v","error","-show_entries","format=duration",
-                     "-of","default=nokey=1:noprint_wrappers=1",str(p)], text=True)
-                durs.append(float(out.strip()))
-            except Exception: durs.append(0.0)
-        out=[]; tot=0.0; i=0
-        if all(d<=0 for d in durs):
-            while tot<target_s: out+=files; tot+=60
-            return out
-        while tot<target_s:
-            out.append(files[i%len(files)]); tot+=durs[i%len(files)] or 1.0; i+=1
-        return out
-
-    def choose_encoder_args(self, vf, rate):
-        want_copy=(self.quick_copy.get()==1) or (self.codec_choice.get()=="Без перекодування (copy)")
-        if want_copy and not vf and not rate: return ["-c:v","copy"], True
-        if want_copy and (vf or rate):
-            self.log_q.put("[ПОВІДОМЛЕННЯ] Неможливо 'copy': змінюється роздільна або FPS.\n")
-        c=self.codec_choice.get()
-        if c=="NVENC (NVIDIA)": return ["-c:v","h264_nvenc","-preset","fast","-b:v","5M"], False
-        if c=="QSV (Intel)":   return ["-c:v","h264_qsv","-preset","fast","-b:v","5M"], False
-        if c=="AMF (AMD)":     return ["-c:v","h264_amf","-quality","speed","-b:v","5M"], False
-        return ["-c:v","libx264","-preset","veryfast","-crf",str(int(self.crf.get()))], False
-
-    # ---------- Процеси ----------
-    def run_cmd(self, cmd):
-        self.log_q.put("$ "+" ".join(cmd)+"\n")
-        p=subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
-        self.current_proc=p
-        try:
-            for line in p.stdout:  # type: ignore
-                if self.stop_flag.is_set():
-                    try: p.terminate()
-                    except: pass
-                    try: p.kill()
-                    except: pass
-                    self.log_q.put("[СТОП] Процес перервано користувачем.\n")
-                    break
-                self.log_q.put(line)
-        finally:
-            p.wait(); self.current_proc=None
-        return p.returncode
+    # ---------- Завдання ----------
+    def _seed(self):
+        s=self.seed_entry.get().strip()
+        try: return int(s) if s else None
+        except ValueError: raise ValueError("Seed: очікується ціле число") from None
+
+    def current_spec(self) -> JobSpec:
+        # Знімок віджетів у специфікацію для рушія (читається лише в потоці Tk)
+        res=self.res_preset.get(); fps=self.fps_choice.get()
+        spec=JobSpec(files=self.clips.files(),
+                     out=self.out_entry.get(), duration=self.dur_entry.get(),
+                     fixed_duration=self.fixed_duration.get()==1, autofill=self.autofill.get()==1,
+                     tolerance=float(self.tolerance.get() or "0"),
+                     shuffle_mode=self.shuffle_mode.get(), block_size=self.block_size or 0,
+                     min_gap=int(self.min_gap.get() or "0"), seed=self._seed(),
+                     batch=int(self.batch_spin.get() or "1"), batch_shuffle=self.batch_shuffle.get()==1,
+                     parallel=int(self.batch_par.get() or "1"), same_params=self.same_params.get()==1,
+                     resolution="" if res=="Оригінал" else res, fps="" if fps=="Оригінал" else fps,
+                     quick_copy=self.quick_copy.get()==1, codec=CODEC_IDS.get(self.codec_choice.get(),"x264"),
+                     out_mode=self.out_mode.get(), chunked=self.chunked.get()==1,
+                     stream=self.stream.get()==1, smart_trim=self.smart_trim.get()==1,
+                     hw_fallback=self.hw_fallback.get()==1,
+                     crf=int(self.crf.get()), abr=self.abr.get(),
+                     audio=self.audio_entry.get().strip(), trim_to_audio=self.trim_to_audio.get()==1,
+                     lufs=float(self.lufs.get() or "0"))
+        spec.validate()
+        return spec
 
     def on_stop(self):
-        self.stop_flag.set()
-        if self.current_proc is not None:
-            try: self.current_proc.terminate()
-            except: pass
-            try: self.current_proc.kill()
-            except: pass
+        self.engine.stop()
         self.status.configure(text="Зупинено користувачем")
 
     # ---------- Старт ----------
-    def start_clicked(self):
+    def start_clicked(self, resume=False):
         try:
-            self.log_q.put(">> START CLICK\n"); self.on_start()
+            self.log_q.put(">> RESUME CLICK\n" if resume else ">> START CLICK\n"); self.on_start(resume)
         except Exception as e:
             self.log_q.put(f"[ПОМИЛКА on_start] {e}\n")
-            self.set_running(False); self.worker=None; self.stop_flag.clear()
+            self.set_running(False); self.worker=None
 
-    def on_start(self):
+    def on_start(self, resume=False):
         if self.worker and not self.worker.is_alive():
-            self.worker=None; self.stop_flag.clear(); self.set_running(False)
+            self.worker=None; self.set_running(False)
         if self.running or (self.worker and self.worker.is_alive()):
             self.log_q.put("[ІНФО] Вже виконується — другий старт ігнорую.\n"); return
-        if not have_ffmpeg():
+        if not have_ffmpeg(scan=False):     # повна перевірка можливостей — у prepare() воркера
             messagebox.showerror("FFmpeg","Не знайдено ffmpeg/ffprobe у PATH."); self.set_running(False); return
-
-        files=[self.listbox.get(i) for i in range(self.listbox.size())]
-        if not files:
+        if not len(self.clips):
             messagebox.showerror("Список порожній","Додай відео у список."); self.set_running(False); return
 
-        target=parse_duration(self.dur_entry.get()) or 3600
-        out_file=Path(self.out_entry.get()).expanduser().resolve(); out_file.parent.mkdir(parents=True,exist_ok=True)
-
-        # Перша підготовка (порядок/аудіо/час)
-        audio_path=self.audio_entry.get().strip()
-        use_audio=len(audio_path)>0 and Path(audio_path).exists()
-        audio_dur=ffprobe_duration(Path(audio_path)) if use_audio else 0.0
-        fixed=self.fixed_duration.get()==1; trim=self.trim_to_audio.get()==1
-
-        t_args=[]
-        if not fixed and trim and audio_dur>0: t_args=["-t",str(int(audio_dur))]
-        elif fixed and trim and audio_dur>0:    t_args=["-t",str(min(target,int(audio_dur)))]
-        elif fixed:                              t_args=["-t",str(target)]
-        add_shortest=(use_audio and trim and audio_dur>0)
-        if use_audio and trim and audio_dur==0:
-            self.log_q.put("[ПОПЕРЕДЖЕННЯ] Аудіо 0с/недоступне — ігнорую обрізання.\n")
-
-        vf, rate = self.video_filters_and_rate()
-        vcodec_args, is_copy = self.choose_encoder_args(vf, rate)
-
-        self.stop_flag.clear(); self.set_running(True)
+        try:
+            spec=self.current_spec(); spec.resume=resume
+        except ValueError as e:
+            messagebox.showerror("Помилка",str(e)); self.set_running(False); return
+        self.set_running(True)
 
         def worker():
             try:
-                total_jobs = int(self.batch_spin.get() or "1")
-                if total_jobs < 1: total_jobs = 1
-                base_files = list(files)
-
-                for job_idx in range(1, total_jobs + 1):
-                    if self.stop_flag.is_set(): raise RuntimeError("Зупинено")
-
-                    self.log_q.put(f"\n=== Компіляція {job_idx}/{total_jobs} ===\n")
-
-                    # Перемішування
-                    if self.batch_shuffle.get() == 1:
-                        if self.shuffle_mode.get()=="block":
-                            bsz=self.block_size or infer_block_size(base_files)
-                            job_files=shuffle_blockwise_no_seam(base_files, bsz)
-                            job_files=enforce_no_adjacent_duplicates(job_files)
-                        else:
-                            job_files=shuffle_full(base_files)
-                    else:
-                        job_files=list(base_files)
-
-                    # Автозаповнення
-                    job_target=target
-                    if self.autofill.get()==1:
-                        fill=int(t_args[1]) if t_args else job_target
-                        job_files=self.expand_to_duration(job_files, fill)
-
-                    # Робочий каталог
-                    out_file_n = self._numbered_out(out_file, job_idx) if total_jobs>1 else out_file
-                    work=out_file_n.parent/"_vmix_work"; work.mkdir(exist_ok=True)
-                    concat=work/"concat.txt"; self.build_concat(job_files, concat)
-
-                    # Нормалізація (якщо обрано)
-                    if self.out_mode.get()=="norm" and not is_copy:
-                        norm=work/"_norm"; norm.mkdir(exist_ok=True)
-                        for i,src in enumerate(job_files,1):
-                            if self.stop_flag.is_set(): raise RuntimeError("Зупинено")
-                            outp=norm/f"clip_{i:03d}.mp4"
-                            if not outp.exists():
-                                cmd=["ffmpeg","-y","-hide_banner","-loglevel","warning",
-                                     "-fflags","+genpts","-avoid_negative_ts","make_zero","-i",src]
-                                if vf: cmd+=["-vf",vf]
-                                cmd+=rate
-                                enc,_=self.choose_encoder_args(vf,rate); cmd+=enc
-                                if enc[:2]==["-c:v","libx264"]:
-                                    cmd+=["-g","60","-sc_threshold","0","-pix_fmt","yuv420p"]
-                                else:
-                                    cmd+=["-g","60","-pix_fmt","yuv420p"]
-                                cmd+=["-c:a","aac","-b:a",self.abr.get(),"-ar","48000","-ac","2",
-                                      "-movflags","+faststart", str(outp)]
-                                rc=self.run_cmd(cmd)
-                                if rc!=0 or self.stop_flag.is_set():
-                                    raise RuntimeError("Зупинено або помилка нормалізації")
-                        job_files_norm=[str((work/"_norm")/f"clip_{i:03d}.mp4") for i in range(1,len(job_files)+1)]
-                        self.build_concat(job_files_norm, concat)
-
-                    # Фінальна команда
-                    cmd=["ffmpeg","-y","-hide_banner","-loglevel","warning",
-                         "-fflags","+genpts","-avoid_negative_ts","make_zero",
-                         "-f","concat","-safe","0","-i",str(concat)]
-                    if use_audio: cmd+=["-i",audio_path]
-                    if vf: cmd+=["-vf",vf]
-                    cmd+=rate
-                    if use_audio:
-                        cmd+=["-map","0:v:0?","-map","1:a:0?"]
-                    cmd+=vcodec_args
-                    if not is_copy:
-                        if vcodec_args[:2]==["-c:v","libx264"]:
-                            cmd+=["-g","60","-sc_threshold","0","-pix_fmt","yuv420p"]
-                        else:
-                            cmd+=["-g","60","-pix_fmt","yuv420p"]
-                    cmd+=["-c:a","aac","-b:a",self.abr.get(),"-ar","48000","-ac","2","-movflags","+faststart"]
-                    cmd+=t_args
-                    if add_shortest: cmd+=["-shortest"]
-                    cmd+=[str(out_file_n)]
-
-                    rc=self.run_cmd(cmd)
-
-                    # Ретрай без -map
-                    if rc!=0 and use_audio and not self.stop_flag.is_set():
-                        self.log_q.put("[INFO] Повтор без явного -map (сумісність).\n")
-                        cmd_nomap=[]; skip=False
-                        for tok in cmd:
-                            if skip: skip=False; continue
-                            if tok=="-map": skip=True; continue
-                            cmd_nomap.append(tok)
-                        rc=self.run_cmd(cmd_nomap)
-
-                    if self.stop_flag.is_set():
-                        self.log_q.put("[СТОП] Перервано користувачем.\n")
-                        break
-                    elif rc!=0:
-                        raise RuntimeError("Помилка фінального збирання")
-
-                    self.log_q.put(f"ГОТОВО → {out_file_n}\n")
-
-                    # чистимо робочу папку після кожної збірки
-                    try:
-                        if work.exists(): shutil.rmtree(work, ignore_errors=True)
-                        self.log_q.put("[ІНФО] Тимчасова папка _vmix_work видалена.\n")
-                    except Exception as e:
-                        self.log_q.put(f"[ПОПЕРЕДЖЕННЯ] Не вдалося видалити _vmix_work: {e}\n")
-
+                # prepare() у фоні: скан можливостей ffmpeg і перевірка кодерів (smoke-тест)
+                # можуть тривати десятки секунд
+                try: ctx=self.engine.prepare(spec)
+                except ValueError as e:
+                    msg=str(e)
+                    self.root.after(0, lambda: messagebox.showerror("Помилка", msg)); return
+                self.root.after(0, lambda: self._init_jobs_view(ctx))
+                self.engine.run_prepared(ctx)
                 self.root.after(0, lambda: (messagebox.showinfo("Готово","Пакетна збірка виконана."),
                                             self.status.configure(text="Готово")))
             except Exception as e:
                 if str(e)!="Зупинено":
-                    self.log_q.put("[ПОМИЛКА] "+str(e)+"\n")
+                    msg=str(e)
+                    self.log_q.put("[ПОМИЛКА] "+msg+"\n")
                     self.root.after(0, lambda: self.status.configure(text="Помилка"))
-                    self.root.after(0, lambda: messagebox.showerror("Помилка", str(e)))
+                    self.root.after(0, lambda: messagebox.showerror("Помилка", msg))
             finally:
-                self.set_running(False); self.worker=None; self.stop_flag.clear()
+                self.set_running(False); self.worker=None
 
         self.worker=threading.Thread(target=worker,daemon=True); self.worker.start()
 
+    def on_plan(self):
+        # План без запуску ffmpeg-кодування: окремий рушій, щоб не чіпати стоп-прапорець поточної збірки
+        if not len(self.clips):
+            messagebox.showerror("Список порожній","Додай відео у список."); return
+        try: spec=self.current_spec()
+        except ValueError as e:
+            messagebox.showerror("Помилка",str(e)); return
+        self.log_q.put(">> PLAN CLICK\n")
+
+        def work():
+            try: self.log_q.put(estimate_text(Engine(log=self.log_q.put).estimate(spec)))
+            except Exception as e: self.log_q.put(f"[ПОМИЛКА] План: {e}\n")
+        threading.Thread(target=work,daemon=True).start()
+
+    # ---------- Компіляції ----------
+    def _init_jobs_view(self, ctx):
+        self.jobs_view.delete(*self.jobs_view.get_children())
+        for i in range(1, ctx["total_jobs"]+1):
+            self.jobs_view.insert("",tk.END,iid=str(i),values=("очікує",self.engine.job_out(ctx,i).name))
+
+    def _job_status(self, job_idx, text):
+        self.root.after(0, lambda: self.jobs_view.exists(str(job_idx)) and self.jobs_view.set(str(job_idx),"st",text))
+
 # ---------- main ----------
 if __name__=="__main__":
     root=tk.Tk()
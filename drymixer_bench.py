@@ -0,0 +1,192 @@
+# Dry Mixer — відтворюваний бенчмарк: синтетичні кліпи lavfi, наскрізні прогони copy/norm/x264,
+# пропускна здатність ffprobe, шафл і автозаповнення. Результат — JSON, порівняння з базовим.
+#   python drymixer_bench.py                                  # усі групи, таблиця + bench.json
+#   python drymixer_bench.py --only shuffle --sizes 10000,100000,1000000
+#   python drymixer_bench.py --save-baseline                  # зберегти як базовий
+#   python drymixer_bench.py --baseline base.json --threshold 0.2   # код 1 при регресії
+
+import argparse, json, os, platform, random, shutil, statistics, subprocess, sys, tempfile, time
+from pathlib import Path
+
+import drymixer_engine as eng
+from drymixer_engine import (Engine, JobSpec, NormCache, ProbeCache, ThroughputStats, enforce_no_adjacent_duplicates,
+                             gap_violations, infer_block_size, intern_ids, plan_duration, probe_many, shuffle_ids)
+
+BENCH_DIR = eng.CACHE_DIR/"bench"
+GROUPS = ("shuffle","autofill","probe","copy","norm","x264")
+
+# Набір кліпів: (назва, ширина, висота, fps, канали, частота, тривалість с)
+CLIPS = [("a1",640,360,30,2,48000,4), ("a2",640,360,30,2,48000,4), ("a3",640,360,30,2,48000,4),
+         ("b1",1280,720,25,1,44100,4), ("b2",1280,720,25,1,44100,4), ("c1",854,480,24,6,48000,4)]
+
+def best_of(fn, repeat) -> float:
+    best=float("inf")
+    for _ in range(max(1,repeat)):
+        t=time.perf_counter(); fn(); best=min(best,time.perf_counter()-t)
+    return best
+
+def timed(fn, repeat) -> list:
+    runs=[]
+    for _ in range(max(1,repeat)):
+        t=time.perf_counter(); fn(); runs.append(time.perf_counter()-t)
+    return runs
+
+# ---------- Синтетичні кліпи ----------
+def make_clips(root: Path) -> dict:
+    # Детерміновані кліпи (testsrc2 + sine, bitexact); створюються один раз і перевикористовуються
+    root.mkdir(parents=True,exist_ok=True); out={}
+    for name,w,h,fps,ch,sr,dur in CLIPS:
+        p=root/f"{name}_{w}x{h}_{fps}_{ch}ch.mp4"; out[name]=p
+        if p.exists() and p.stat().st_size>0: continue
+        freq=220*(1+CLIPS.index((name,w,h,fps,ch,sr,dur)))
+        layout={1:"mono",2:"stereo",6:"5.1"}[ch]
+        cmd=["ffmpeg","-y","-hide_banner","-loglevel","error",
+             "-f","lavfi","-i",f"testsrc2=size={w}x{h}:rate={fps}:duration={dur}",
+             "-f","lavfi","-i",f"sine=frequency={freq}:sample_rate={sr}:duration={dur}",
+             "-af",f"aformat=channel_layouts={layout}","-fflags","+bitexact","-flags","+bitexact",
+             "-c:v","libx264","-preset","ultrafast","-pix_fmt","yuv420p","-g",str(fps),
+             "-c:a","aac","-b:a","128k","-shortest",str(p)]
+        subprocess.run(cmd,check=True)
+    return out
+
+# ---------- Групи ----------
+def bench_shuffle(sizes, clips=100, gap=3, seed=1) -> dict:
+    # Список як після «Дублювати ВЕСЬ список»: clips унікальних шляхів, повторених до n
+    res={}
+    for n in sizes:
+        items=[f"/clips/c{i%clips:04d}.mp4" for i in range(n)]
+        ids,_=intern_ids(items); worst=sorted(ids); repeat=3 if n<=100_000 else 1
+        cases=[("intern_ids",lambda: intern_ids(items)),
+               ("infer_block_size",lambda: infer_block_size(ids)),
+               ("enforce_no_adjacent",lambda: enforce_no_adjacent_duplicates(worst)),
+               ("full.K1",lambda: shuffle_ids(ids,"full",0,1,random.Random(seed))),
+               (f"full.K{gap}",lambda: shuffle_ids(ids,"full",0,gap,random.Random(seed))),
+               (f"block.K{gap}",lambda: shuffle_ids(ids,"block",clips,gap,random.Random(seed)))]
+        for name,fn in cases: res[f"shuffle.{name}.n{n}"]={"seconds":best_of(fn,repeat)}
+        bad=gap_violations(shuffle_ids(ids,"full",0,gap,random.Random(seed)),gap)
+        res[f"shuffle.violations.K{gap}.n{n}"]={"value":bad}
+    return res
+
+def bench_autofill(repeat, seed=1) -> dict:
+    r=random.Random(seed); durs=[r.uniform(5,240) for _ in range(1000)]
+    res={}
+    for hours in (1,10):
+        target=hours*3600
+        runs=timed(lambda: plan_duration(list(range(len(durs))),durs,target,2.0,3,random.Random(seed)),repeat)
+        out,total=plan_duration(list(range(len(durs))),durs,target,2.0,3,random.Random(seed))
+        res[f"autofill.plan.{hours}h"]={"seconds":statistics.median(runs),"runs":runs,"overshoot":round(total-target,3)}
+    return res
+
+def bench_probe(clips: dict, repeat, tmp: Path) -> dict:
+    # Холодний кеш: кожен прогін — новий файл кешу й нові копії (інший шлях → промах)
+    src=list(clips.values()); runs=[]; n=0
+    for k in range(max(1,repeat)):
+        d=tmp/f"probe_{k}"; d.mkdir()
+        files=[]
+        for i in range(4):
+            for p in src:
+                q=d/f"{i}_{p.name}"; os.link(p,q) if hasattr(os,"link") else shutil.copy(p,q); files.append(q)
+        eng.PROBE_CACHE=ProbeCache(d/"probe_cache.json"); n=len(files)
+        t=time.perf_counter(); probe_many(files); runs.append(time.perf_counter()-t)
+    med=statistics.median(runs)
+    return {"probe.cold":{"seconds":med,"runs":runs,"files":n,"files_per_s":round(n/med,1)}}
+
+def run_engine(spec: JobSpec, tmp: Path) -> float:
+    # Наскрізний прогін із холодним кешем нормалізації; лог — у список
+    eng.NORM_CACHE=NormCache(tmp/f"norm_{time.monotonic_ns()}", 10*1024**3)
+    lines=[]; e=Engine(log=lines.append)
+    t=time.perf_counter(); e.run(spec); return time.perf_counter()-t
+
+def bench_e2e(name, clips: dict, repeat, tmp: Path) -> dict:
+    files=[str(p) for p in clips.values()]; same=[str(clips[k]) for k in ("a1","a2","a3")]
+    base=dict(duration="00:00:30", seed=1, tolerance=0.0)
+    spec={"copy": dict(files=same, codec="copy"),
+          "norm": dict(files=files, out_mode="norm", codec="x264", resolution="640x360", fps="25"),
+          "x264": dict(files=same, codec="x264", resolution="320x180")}[name]
+    runs=[]
+    for k in range(max(1,repeat)):
+        runs.append(run_engine(JobSpec(out=str(tmp/f"{name}_{k}.mp4"), **base, **spec), tmp))
+    return {f"e2e.{name}":{"seconds":statistics.median(runs),"runs":runs}}
+
+# ---------- Звіт ----------
+def meta() -> dict:
+    try: ff=subprocess.run(["ffmpeg","-version"],capture_output=True,text=True).stdout.splitlines()[0]
+    except (OSError,IndexError): ff=None
+    return {"time":time.strftime("%Y-%m-%dT%H:%M:%S"),"python":platform.python_version(),
+            "platform":platform.platform(),"cpu_count":os.cpu_count(),"ffmpeg":ff}
+
+def compare(results: dict, baseline: dict, threshold: float, min_seconds: float) -> list:
+    # [(метрика, база, зараз, відношення)] для метрик, що повільніші за базу більш ніж на threshold
+    bad=[]
+    for k,b in baseline.get("results",{}).items():
+        cur=results.get(k)
+        if not cur or "seconds" not in cur or "seconds" not in b: continue
+        if b["seconds"]<min_seconds: continue
+        ratio=cur["seconds"]/b["seconds"]
+        if ratio>1+threshold: bad.append((k,b["seconds"],cur["seconds"],ratio))
+    return bad
+
+def main(argv=None) -> int:
+    ap=argparse.ArgumentParser(description="Бенчмарк Dry Mixer на синтетичних кліпах lavfi.")
+    ap.add_argument("--only",default=",".join(GROUPS),help="групи через кому: "+", ".join(GROUPS))
+    ap.add_argument("--sizes",default="10000,100000",help="розміри списків для шафлу")
+    ap.add_argument("--clips",type=int,default=100,help="унікальних кліпів у списку шафлу")
+    ap.add_argument("--gap",type=int,default=3,help="мінімальна відстань повтору K")
+    ap.add_argument("--repeat",type=int,default=3,help="повторів кожного наскрізного прогону")
+    ap.add_argument("--workdir",default=str(BENCH_DIR),help="де зберігати синтетичні кліпи")
+    ap.add_argument("--json",default="bench.json",help="куди записати результат")
+    ap.add_argument("--baseline",help=f"базовий JSON для порівняння (типово {BENCH_DIR/'baseline.json'}, якщо є)")
+    ap.add_argument("--save-baseline",action="store_true",help="записати результат як базовий")
+    ap.add_argument("--threshold",type=float,default=0.20,help="допустиме сповільнення (0.2 = +20%%)")
+    ap.add_argument("--min-seconds",type=float,default=0.005,help="метрики, швидші за це в базі, не порівнюються")
+    args=ap.parse_args(argv)
+    groups=[g.strip() for g in args.only.split(",") if g.strip()]
+    unknown=set(groups)-set(GROUPS)
+    if unknown: ap.error("невідомі групи: "+", ".join(sorted(unknown)))
+
+    results={}
+    if "shuffle" in groups:
+        results.update(bench_shuffle([int(x) for x in args.sizes.split(",") if x.strip()],args.clips,args.gap))
+    if "autofill" in groups: results.update(bench_autofill(args.repeat))
+    media=[g for g in groups if g in ("probe","copy","norm","x264")]
+    if media:
+        if not eng.have_ffmpeg():
+            print("[ПОМИЛКА] Не знайдено ffmpeg/ffprobe у PATH.",file=sys.stderr); return 2
+        clips=make_clips(Path(args.workdir).expanduser()/"clips")
+        # Кеші, історія швидкості й траси — тимчасові: синтетичні кліпи не мають потрапити в оцінки користувача
+        saved=eng.PROBE_CACHE,eng.NORM_CACHE,eng.THROUGHPUT,eng.TRACE_DIR
+        tmp=Path(tempfile.mkdtemp(prefix="drymixer_bench_"))
+        eng.THROUGHPUT=ThroughputStats(tmp/"throughput.json"); eng.TRACE_DIR=tmp/"traces"
+        try:
+            if "probe" in media: results.update(bench_probe(clips,args.repeat,tmp))
+            # Кліпи пробуються один раз в окремий кеш — наскрізні прогони міряють саме збірку
+            eng.PROBE_CACHE=ProbeCache(tmp/"probe_cache.json")
+            for g in ("copy","norm","x264"):
+                if g in media: results.update(bench_e2e(g,clips,args.repeat,tmp))
+        finally:
+            eng.PROBE_CACHE,eng.NORM_CACHE,eng.THROUGHPUT,eng.TRACE_DIR=saved
+            shutil.rmtree(tmp,ignore_errors=True)
+
+    for k,r in results.items():
+        val=f"{r['seconds']*1000:10.1f} мс" if "seconds" in r else f"{r['value']:10d}"
+        print(f"{k:<40}{val}")
+    report={"meta":meta(),"results":results}
+    Path(args.json).write_text(json.dumps(report,ensure_ascii=False,indent=2),encoding="utf-8")
+    if args.save_baseline:
+        base=BENCH_DIR/"baseline.json" if not args.baseline else Path(args.baseline)
+        base.parent.mkdir(parents=True,exist_ok=True)
+        base.write_text(json.dumps(report,ensure_ascii=False,indent=2),encoding="utf-8")
+        print(f"Базовий результат: {base}"); return 0
+
+    base_path=Path(args.baseline) if args.baseline else BENCH_DIR/"baseline.json"
+    if not base_path.exists():
+        if args.baseline: print(f"[ПОМИЛКА] Немає базового файлу {base_path}",file=sys.stderr); return 2
+        return 0
+    bad=compare(results, json.loads(base_path.read_text(encoding="utf-8")), args.threshold, args.min_seconds)
+    for k,b,c,ratio in bad:
+        print(f"[РЕГРЕСІЯ] {k}: {b*1000:.1f} → {c*1000:.1f} мс (×{ratio:.2f})")
+    if not bad: print(f"Без регресій відносно {base_path} (поріг +{args.threshold*100:.0f}%).")
+    return 1 if bad else 0
+
+if __name__=="__main__":
+    raise SystemExit(main())
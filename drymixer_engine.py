@@ -0,0 +1,2514 @@
+# Dry Mixer — рушій збірки без GUI: пробування, кеші, шафл, нормалізація, фінальне кодування.
+# Імпортується інтерфейсом (DryMixer_count.py) і запускається напряму:
+#   python -m drymixer_engine job.json [job2.json ...]
+
+import argparse, atexit, collections, contextlib, hashlib, io, json, math, os, queue, re, sys, random, shutil, signal, subprocess, threading, time
+from array import array
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field, fields, asdict
+from pathlib import Path
+
+DEFAULT_DURATION = "01:00:00"
+DEFAULT_CRF = 18
+DEFAULT_ABR = "160k"
+PROBE_WORKERS = max(2, min(16, 2*(os.cpu_count() or 1)))
+CACHE_DIR = Path(os.environ.get("DRYMIXER_CACHE") or (Path.home()/".drymixer"))
+NORM_CACHE_DIR = Path(os.environ.get("DRYMIXER_NORM_CACHE") or (CACHE_DIR/"norm"))
+NORM_CACHE_GB = float(os.environ.get("DRYMIXER_NORM_CACHE_GB") or 20)
+LOG_DIR = Path(os.environ.get("DRYMIXER_LOG_DIR") or (CACHE_DIR/"logs"))
+LOG_FILE_MB = float(os.environ.get("DRYMIXER_LOG_MB") or 10)
+LOG_BACKUPS = 5
+STREAM_FORMAT = "mpegts"        # контейнер каналу нормалізація → фінал (склеюється простим дописуванням)
+STREAM_CHUNK = 256*1024
+STREAM_BUFFER_MB = float(os.environ.get("DRYMIXER_STREAM_BUFFER_MB") or 32)  # на кліп, закодований наперед
+
+# ---------- Утиліти ----------
+def have_ffmpeg(scan=True):
+    # Можливості ffmpeg кешуються на бінарник — повторний старт не запускає процесів;
+    # scan=False — лише наявність ffmpeg/ffprobe у PATH, без жодного запуску
+    return ffmpeg_caps() is not None if scan else _binary_id() is not None
+
+def parse_duration(s) -> int:
+    if isinstance(s,(int,float)): return int(s)
+    s = (s or "").strip()
+    if not s: return 0
+    p = [int(x) for x in s.split(":")]
+    if   len(p)==1: h,m,sec = 0,0,p[0]
+    elif len(p)==2: h,m,sec = 0,p[0],p[1]
+    else:           h,m,sec = p[-3],p[-2],p[-1]
+    return h*3600 + m*60 + sec
+
+def fmt_hhmmss(secs:int)->str:
+    h=secs//3600; m=(secs%3600)//60; s=secs%60
+    return f"{h:02d}:{m:02d}:{s:02d}" if h else f"{m:02d}:{s:02d}"
+
+def fmt_size(n) -> str:
+    return f"{n/1024**3:.2f} ГБ" if n>=1024**3 else f"{n/1024**2:.0f} МБ"
+
+def rate_bytes(s) -> float:
+    # "160k" / "5M" → байт/с
+    s=str(s or "").strip(); mul={"k":1e3,"K":1e3,"m":1e6,"M":1e6}.get(s[-1:],1)
+    try: return float(s.rstrip("kKmM"))*mul/8
+    except ValueError: return 0.0
+
+def numbered_out(base: Path, idx: int) -> Path:
+    stem, suf = base.stem, base.suffix or ".mp4"
+    return base.with_name(f"{stem}_{idx}{suf}")
+
+def build_concat(files, path:Path):
+    with open(path,"w",encoding="utf-8") as f:
+        for p in files: f.write(f"file '{Path(p).resolve().as_posix()}'\n")
+
+# ---------- Лог ----------
+# Повний лог іде у файли з ротацією (drymixer.log, .1 … .N); інтерфейсу дістається
+# обмежена черга, яку він забирає пачками — сплески ffmpeg не ростять пам'ять.
+class RotatingLog:
+    def __init__(self, path: Path, max_bytes: int, backups=LOG_BACKUPS):
+        self.path=path; self.max=max(1024,max_bytes); self.backups=max(1,backups)
+        self.lock=threading.Lock(); self.f=None; self.bol=True
+
+    def _open(self):
+        try:
+            self.path.parent.mkdir(parents=True,exist_ok=True)
+            self.f=open(self.path,"a",encoding="utf-8")
+        except OSError:
+            self.f=False  # диск недоступний — лог лише у вікні
+
+    def _rotate(self):
+        self.f.close()
+        try:
+            for i in range(self.backups-1,0,-1):
+                src=self.path.with_name(f"{self.path.name}.{i}")
+                if src.exists(): os.replace(src,self.path.with_name(f"{self.path.name}.{i+1}"))
+            os.replace(self.path,self.path.with_name(f"{self.path.name}.1"))
+        finally:
+            self._open()
+
+    def write(self, s: str):
+        with self.lock:
+            if self.f is None: self._open()
+            if not self.f: return
+            try:
+                # Мітка часу на початку кожного рядка
+                stamp=time.strftime("[%H:%M:%S] ")
+                lines=s.splitlines(keepends=True)
+                out="".join(stamp+ln if k or self.bol else ln for k,ln in enumerate(lines))
+                if lines: self.bol=lines[-1].endswith("\n")
+                self.f.write(out); self.f.flush()
+                if self.f.tell()>=self.max: self._rotate()
+            except (OSError,ValueError):
+                pass
+
+    def close(self):
+        with self.lock:
+            if self.f: self.f.close()
+            self.f=None
+
+class LogPipe:
+    # put(s) — з будь-якого потоку; drain(limit) — з потоку інтерфейсу
+    def __init__(self, disk: RotatingLog | None = None, keep=20000):
+        self.disk=disk; self.q=collections.deque(); self.keep=keep; self.dropped=0; self.lock=threading.Lock()
+
+    def put(self, s: str):
+        if self.disk is not None: self.disk.write(s)
+        with self.lock:
+            if len(self.q)>=self.keep: self.q.popleft(); self.dropped+=1
+            self.q.append(s)
+
+    def drain(self, limit) -> tuple:
+        # (найсвіжіші ≤limit рядків, скільки пропущено з минулого разу): під час сплеску
+        # старші рядки у вікно не потрапляють — вони вже є у файлі
+        with self.lock:
+            while len(self.q)>limit: self.q.popleft(); self.dropped+=1
+            out=list(self.q); self.q.clear()
+            dropped=self.dropped; self.dropped=0
+        return out, dropped
+
+    def pending(self) -> int:
+        return len(self.q)
+
+    def clear(self):
+        with self.lock: self.q.clear(); self.dropped=0
+
+def session_log(name="drymixer.log") -> RotatingLog:
+    log=RotatingLog(LOG_DIR/name, int(LOG_FILE_MB*1024**2))
+    atexit.register(log.close)
+    log.write(f"===== Сесія {time.strftime('%Y-%m-%d %H:%M:%S')}, pid {os.getpid()} =====\n")
+    return log
+
+# ---------- Кеш ffprobe ----------
+# Один виклик ffprobe на файл заповнює і тривалість, і сигнатуру потоків.
+# Ключ — абсолютний шлях; запис дійсний, поки збігаються розмір і mtime.
+PROBE_ENTRIES = "format=duration:stream=codec_type,codec_name,width,height,pix_fmt,avg_frame_rate,channels,sample_rate"
+
+def _parse_fps(afr):
+    afr=afr or "0/0"
+    if "/" in afr and afr!="0/0":
+        num,den=afr.split("/")
+        try: return round(float(num)/float(den),3)
+        except: return afr
+    return afr
+
+def fps_float(v, default=25.0) -> float:
+    # FPS із сигнатури: число, "30000/1001" або "0/0" (невідомо) → float; невідоме/нуль — default
+    try:
+        if isinstance(v,str) and "/" in v:
+            num,den=v.split("/"); v=float(num)/float(den)
+        v=float(v)
+    except (TypeError,ValueError,ZeroDivisionError):
+        return default
+    return v if v>0 and math.isfinite(v) else default
+
+def ffprobe_info(p) -> dict | None:
+    try:
+        out=subprocess.check_output(["ffprobe","-v","error","-show_entries",PROBE_ENTRIES,
+                                     "-of","json",str(p)], text=True)
+        data=json.loads(out)
+    except Exception:
+        return None
+    vcodec=width=height=pix=fps=None; acodec=ch=sr=None
+    for s in data.get("streams",[]):
+        t=s.get("codec_type")
+        if t=="video" and vcodec is None:
+            vcodec=s.get("codec_name"); width=s.get("width"); height=s.get("height"); pix=s.get("pix_fmt")
+            fps=_parse_fps(s.get("avg_frame_rate"))
+        elif t=="audio" and acodec is None:
+            acodec=s.get("codec_name"); ch=s.get("channels"); sr=s.get("sample_rate")
+    try: dur=float(data.get("format",{}).get("duration") or 0.0)
+    except (TypeError,ValueError): dur=0.0
+    return {"duration":dur, "sig":[vcodec,width,height,pix,fps,acodec,ch,sr]}
+
+class ProbeCache:
+    def __init__(self, path: Path):
+        self.path=path; self.data=None; self.dirty=False; self.lock=threading.Lock()
+
+    def _load(self):
+        if self.data is None:
+            try: self.data=json.loads(self.path.read_text(encoding="utf-8"))
+            except Exception: self.data={}
+        return self.data
+
+    def peek(self, p) -> dict | None:
+        # Лише дійсний запис кешу, без запуску ffprobe
+        try:
+            key=str(Path(p).resolve()); st=os.stat(key)
+        except OSError:
+            return None
+        with self.lock:
+            e=self._load().get(key)
+            return e if e and e.get("size")==st.st_size and e.get("mtime")==st.st_mtime_ns else None
+
+    def get(self, p) -> dict | None:
+        e=self.peek(p)
+        if e is not None: return e
+        try:
+            key=str(Path(p).resolve()); st=os.stat(key)
+        except OSError:
+            return None
+        e=ffprobe_info(key)
+        if e is None: return None
+        e.update(size=st.st_size, mtime=st.st_mtime_ns)
+        with self.lock: self._load()[key]=e; self.dirty=True
+        return e
+
+    def loudness(self, p) -> dict | None:
+        # Вимір EBU R128 зберігається в записі ffprobe і скидається разом із ним при зміні файлу
+        e=self.get(p)
+        if e is None: return None
+        if "loud" not in e:
+            loud=measure_loudness(Path(p).resolve())
+            with self.lock: e["loud"]=loud; self.dirty=True
+        return e["loud"] or None
+
+    def save(self):
+        with self.lock:
+            if not self.dirty: return
+            try:
+                self.path.parent.mkdir(parents=True,exist_ok=True)
+                tmp=self.path.with_suffix(".tmp")
+                tmp.write_text(json.dumps(self.data,ensure_ascii=False),encoding="utf-8")
+                os.replace(tmp,self.path); self.dirty=False
+            except OSError:
+                pass
+
+PROBE_CACHE=ProbeCache(CACHE_DIR/"probe_cache.json")
+atexit.register(PROBE_CACHE.save)
+
+# ---------- Гучність (EBU R128) ----------
+# Аналіз — один прохід loudnorm на унікальне джерело, результат у кеші ffprobe; під час кодування
+# застосовується лише лінійне підсилення volume, тож дублікати й наступні пакети не аналізуються.
+LOUD_TP_CEIL = -1.0             # дБTP: підсилення не піднімає true peak вище
+LOUD_MAX_GAIN = 30.0
+LOUD_WORKERS = max(1, min(4, os.cpu_count() or 1))
+
+def measure_loudness(p) -> dict:
+    # {"i": LUFS, "tp": дБTP, "lra": LU}; {} — немає аудіо або аналіз не вдався
+    cmd=["ffmpeg","-hide_banner","-nostats","-i",str(p),"-map","0:a:0","-vn","-af","loudnorm=print_format=json","-f","null","-"]
+    try: err=subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors="replace").stderr
+    except OSError: return {}
+    try:
+        d=json.loads(err[err.rindex("{"):err.rindex("}")+1])
+        return {"i":float(d["input_i"]), "tp":float(d["input_tp"]), "lra":float(d["input_lra"])}
+    except (ValueError,KeyError):
+        return {}
+
+def loudness_gain(loud, target) -> float:
+    # Лінійне підсилення, дБ: до цілі LUFS, але не вище стелі true peak
+    if not loud or not math.isfinite(loud.get("i",math.nan)): return 0.0
+    g=target-loud["i"]
+    if math.isfinite(loud.get("tp",math.nan)): g=min(g, LOUD_TP_CEIL-loud["tp"])
+    return round(max(-LOUD_MAX_GAIN,min(LOUD_MAX_GAIN,g)),2)
+
+def loudness_many(paths, stop=None, workers=LOUD_WORKERS) -> dict:
+    uniq=list(dict.fromkeys(str(p) for p in paths)); res={}
+    if not uniq: return res
+    ex=ThreadPoolExecutor(max_workers=min(workers,len(uniq)))
+    try:
+        futs={ex.submit(PROBE_CACHE.loudness,p):p for p in uniq}
+        for f in as_completed(futs):
+            res[futs[f]]=f.result()
+            if stop is not None and stop.is_set(): break
+    finally:
+        ex.shutdown(wait=True,cancel_futures=True); PROBE_CACHE.save()
+    return res
+
+def probe_many(paths, progress=None, stop=None, workers=PROBE_WORKERS) -> dict:
+    # Пул потоків над ffprobe: кожен унікальний шлях пробується один раз,
+    # progress(done,total) викликається з потоків пулу
+    uniq=list(dict.fromkeys(str(p) for p in paths)); res={}
+    if not uniq: return res
+    ex=ThreadPoolExecutor(max_workers=min(workers,len(uniq)))
+    try:
+        futs={ex.submit(PROBE_CACHE.get,p):p for p in uniq}
+        for done,f in enumerate(as_completed(futs),1):
+            res[futs[f]]=f.result()
+            if progress: progress(done,len(uniq))
+            if stop is not None and stop.is_set(): break
+    finally:
+        ex.shutdown(wait=True,cancel_futures=True); PROBE_CACHE.save()
+    return res
+
+def ffprobe_duration(p: Path) -> float:
+    e=PROBE_CACHE.get(p)
+    return e["duration"] if e else 0.0
+
+def ffprobe_signature(p):
+    e=PROBE_CACHE.get(p)
+    return tuple(e["sig"]) if e else None
+
+KEYFRAME_WINDOW = 30.0          # скільки секунд до точки різу читати в пошуках ключового кадру
+
+def keyframe_before(p, t: float) -> dict | None:
+    # Останній ключовий кадр відео не пізніше t (секунди від початку файлу) і параметри потоку
+    # для кодування хвоста: {"key", "profile", "level", "timescale"}; None — ffprobe не впорався
+    def scan(window):
+        cmd=["ffprobe","-v","error","-select_streams","v:0"]
+        if window: cmd+=["-read_intervals",f"{max(0.0,t-window):.3f}%{t+0.5:.3f}"]
+        cmd+=["-show_entries","packet=pts_time,flags:stream=profile,level,time_base,start_time","-of","json",str(p)]
+        return json.loads(subprocess.check_output(cmd, text=True, stderr=subprocess.DEVNULL))
+    try:
+        data=scan(KEYFRAME_WINDOW)
+        st=(data.get("streams") or [{}])[0]; t0=float(st.get("start_time") or 0.0)
+        keys=[float(k["pts_time"])-t0 for k in data.get("packets",[]) if "K" in k.get("flags","") and k.get("pts_time")]
+        if not any(k<=t+1e-3 for k in keys):
+            data=scan(0); keys=[float(k["pts_time"])-t0 for k in data.get("packets",[])
+                                if "K" in k.get("flags","") and k.get("pts_time")]
+    except (OSError,subprocess.SubprocessError,ValueError,KeyError):
+        return None
+    keys=[k for k in keys if k<=t+1e-3]
+    if not keys: return None
+    tb=str(st.get("time_base") or "")
+    return {"key":max(0.0,max(keys)), "profile":st.get("profile"), "level":st.get("level"),
+            "timescale":int(tb.split("/")[1]) if tb.startswith("1/") else None}
+
+# ключі SEI libx264, від яких залежать SPS/PPS; chroma_qp_offset у SEI уже з поправкою psy-rd,
+# тому не передається — libx264 виведе його сам із psy_rd і subme
+X264_TAIL_KEYS = ("cabac","ref","8x8dct","bframes","b_pyramid","weightb","weightp","constrained_intra","keyint",
+                  "open_gop","bluray_compat","crf","trellis","psy","psy_rd","subme")
+
+def x264_options(p, limit=16<<20) -> dict | None:
+    # Параметри libx264 із SEI джерела ("options: cabac=1 ref=3 ..."); None — файл не від libx264
+    try:
+        with open(p,"rb") as f: m=re.search(rb"x264 - core \d+.*?options: ([ -~]+)", f.read(limit))
+    except OSError:
+        return None
+    if not m: return None
+    return dict(kv.split("=",1) for kv in m.group(1).decode("ascii").split() if "=" in kv)
+
+def x264_tail_params(opts) -> str | None:
+    # -x264-params хвоста, з якими libx264 дає ті самі SPS/PPS, що й у джерела; None — джерело не CRF
+    if not opts or opts.get("rc")!="crf" or "crf" not in opts: return None
+    return ":".join(f"{k.replace('_','-')}={opts[k].replace(':',',')}" for k in X264_TAIL_KEYS if k in opts)
+
+def parse_hexdump(text) -> bytes:
+    # Рядки ffprobe -show_data: "00000000: 0164 000d ffe1 0019 ...  .d......"
+    return bytes.fromhex("".join(l.split(": ",1)[1][:39] for l in text.splitlines() if ": " in l).replace(" ",""))
+
+def h264_extradata(p) -> bytes | None:
+    # avcC відеопотоку (SPS/PPS), з яким декодується копія; None — ffprobe не впорався
+    try:
+        out=subprocess.check_output(["ffprobe","-v","error","-select_streams","v:0","-show_data",
+                                     "-show_entries","stream=extradata","-of","csv=p=0",str(p)],
+                                    text=True, stderr=subprocess.DEVNULL)
+    except (OSError,subprocess.SubprocessError):
+        return None
+    try: return parse_hexdump(out) or None
+    except ValueError: return None
+
+SIG_LABELS = ["vcodec","width","height","pix_fmt","fps","acodec","channels","sample_rate"]
+
+def compat_result(files, progress=None):
+    # (усі сигнатури однакові?, текст відмінностей)
+    probed=probe_many(files, progress)
+    sig0=None; bad=[]
+    for p in dict.fromkeys(str(f) for f in files):
+        e=probed.get(p); sig=tuple(e["sig"]) if e else None
+        if sig is None:
+            bad.append(f"{Path(p).name}: не вдалося прочитати"); continue
+        if sig0 is None: sig0=sig
+        elif sig!=sig0:
+            dif=[f"{SIG_LABELS[i]}: {sig[i]} ≠ {sig0[i]}" for i in range(len(sig)) if sig[i]!=sig0[i]]
+            bad.append(f"{Path(p).name}: "+("; ".join(dif) if dif else "відмінності"))
+    return (not bad and sig0 is not None), ("\n".join(bad) if bad else "Немає даних")
+
+# ---------- Кеш нормалізованих кліпів ----------
+# Ключ — ідентичність джерела (шлях, розмір, mtime) + ефективні фільтри/кодек,
+# тож кожен унікальний кліп кодується один раз на всі дублікати, компіляції й запуски.
+# Витіснення LRU за mtime (оновлюється при кожному попаданні) у межах бюджету.
+class NormCache:
+    def __init__(self, root: Path, limit_bytes: int):
+        self.root=root; self.limit=limit_bytes; self.lock=threading.Lock(); self.pins={}
+        self.inflight={}        # ключ → Event: файл саме кодується в цьому процесі
+
+    def pin(self, paths):
+        # Закріплені файли використовуються поточними компіляціями і не витісняються
+        with self.lock:
+            for p in paths: self.pins[str(p)]=self.pins.get(str(p),0)+1
+
+    def unpin(self, paths):
+        with self.lock:
+            for p in paths:
+                n=self.pins.get(str(p),0)-1
+                if n>0: self.pins[str(p)]=n
+                else: self.pins.pop(str(p),None)
+
+    def key(self, src, params) -> str | None:
+        try:
+            src=Path(src).resolve(); st=os.stat(src)
+        except OSError:
+            return None
+        ident=[str(src), st.st_size, st.st_mtime_ns, params]
+        return hashlib.sha1(json.dumps(ident,ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def path(self, key) -> Path: return self.root/f"{key}.mp4"
+
+    def lookup(self, key) -> Path | None:
+        p=self.path(key)
+        try: os.utime(p); return p
+        except OSError: return None
+
+    def claim(self, key, stopped=lambda: False) -> Path | None:
+        # Закріплений файл кешу або None — тоді кодує викликач і потім кличе release(key).
+        # Паралельні пакети з тим самим джерелом чекають на перший і беруть його результат;
+        # якщо той не вдався — кодує наступний
+        while True:
+            with self.lock:
+                hit=self.lookup(key)
+                if hit:
+                    self.pins[str(hit)]=self.pins.get(str(hit),0)+1; return hit
+                ev=self.inflight.get(key)
+                if ev is None: self.inflight[key]=threading.Event(); return None
+            while not ev.wait(0.25):
+                if stopped(): raise RuntimeError("Зупинено")
+
+    def release(self, key):
+        with self.lock: ev=self.inflight.pop(key,None)
+        if ev: ev.set()
+
+    def temp_path(self, key) -> Path:
+        self.root.mkdir(parents=True,exist_ok=True)
+        return self.root/f"{key}.{os.getpid()}.{threading.get_ident()}.part"
+
+    def commit(self, key, tmp: Path) -> Path:
+        p=self.path(key); os.replace(tmp,p); return p
+
+    def evict(self, keep=()) -> int:
+        # Повертає кількість звільнених байтів
+        with self.lock:
+            try: entries=list(os.scandir(self.root))
+            except OSError: return 0
+            now=time.time(); files=[]; total=0; freed=0
+            for e in entries:
+                try: st=e.stat()
+                except OSError: continue
+                if e.name.endswith(".part"):
+                    if now-st.st_mtime>6*3600:
+                        try: os.remove(e.path)
+                        except OSError: pass
+                    continue
+                if not e.name.endswith(".mp4"): continue
+                files.append((st.st_mtime,st.st_size,e.path)); total+=st.st_size
+            keep={str(k) for k in keep}|set(self.pins)
+            for _,size,path in sorted(files):
+                if total<=self.limit: break
+                if path in keep: continue
+                try: os.remove(path); total-=size; freed+=size
+                except OSError: pass
+            return freed
+
+NORM_CACHE=NormCache(NORM_CACHE_DIR, int(NORM_CACHE_GB*1024**3))
+
+def norm_params(spec, vf, rate, enc) -> tuple:
+    # (ключові параметри кешу, відео-аргументи, аудіо-аргументи) нормалізації одного кліпу
+    venc=["-g","60","-sc_threshold","0","-pix_fmt","yuv420p"] if enc[:2]==["-c:v","libx264"] \
+         else ["-g","60","-pix_fmt","yuv420p"]
+    aenc=["-c:a","aac","-b:a",spec.abr,"-ar","48000","-ac","2"]
+    return [vf, rate, enc+venc, aenc]+([["lufs",float(spec.lufs)]] if spec.lufs else []), venc, aenc
+
+# ---------- Ліміти паралельного кодування ----------
+# libx264 ділить ядра за бюджетом потоків; апаратні кодери обмежені кількістю сесій.
+X264_THREADS = int(os.environ.get("DRYMIXER_X264_THREADS") or 4)
+HW_SESSIONS = {"nvenc":3, "qsv":4, "amf":2}
+
+def encoder_family(enc_args) -> str:
+    c=enc_args[enc_args.index("-c:v")+1] if "-c:v" in enc_args else "libx264"
+    return {"h264_nvenc":"nvenc","h264_qsv":"qsv","h264_amf":"amf","copy":"copy"}.get(c,"x264")
+
+def encoder_concurrency(family):
+    # (скільки процесів одночасно, додаткові аргументи кожного процесу)
+    if family=="x264":
+        cpu=os.cpu_count() or 1; thr=max(1,min(X264_THREADS,cpu))
+        return max(1,cpu//thr), ["-threads",str(thr)]
+    return HW_SESSIONS.get(family,1), []
+
+# Глобальна межа на всі ffmpeg-процеси застосунку (паралельні компіляції, нормалізація)
+class ProcessBudget:
+    def __init__(self, max_procs: int, max_threads: int):
+        self.max_procs=max(1,max_procs); self.max_threads=max(1,max_threads)
+        self.procs=0; self.threads=0; self.cond=threading.Condition()
+
+    def acquire(self, threads: int, stop=None) -> bool:
+        threads=max(1,min(threads,self.max_threads))
+        with self.cond:
+            while self.procs>=self.max_procs or self.threads+threads>self.max_threads:
+                if stop is not None and stop.is_set(): return False
+                self.cond.wait(0.25)
+            self.procs+=1; self.threads+=threads
+        return True
+
+    def release(self, threads: int):
+        threads=max(1,min(threads,self.max_threads))
+        with self.cond:
+            self.procs-=1; self.threads-=threads; self.cond.notify_all()
+
+def cmd_threads(cmd) -> int:
+    # Оцінка кількості потоків, які займе ffmpeg-команда
+    if "-threads" in cmd:
+        try: return int(cmd[len(cmd)-1-cmd[::-1].index("-threads")+1])
+        except (ValueError,IndexError): pass
+    if "libx264" in cmd: return os.cpu_count() or 1
+    if "copy" in cmd and not any(c in cmd for c in ("h264_nvenc","h264_qsv","h264_amf")): return 1
+    return 2
+
+PROC_BUDGET=ProcessBudget(int(os.environ.get("DRYMIXER_MAX_PROCS") or max(2,os.cpu_count() or 1)),
+                          int(os.environ.get("DRYMIXER_MAX_THREADS") or (os.cpu_count() or 1)))
+
+# ---------- Нагляд за процесами ----------
+# Політика для кожного ffmpeg: зависання (out_time з -progress не рухається stall_s секунд),
+# ліміт часу, повтори з затримкою після зависання/ліміту, пріоритет CPU/IO і прив'язка до ядер.
+def parse_cpus(spec: str) -> set:
+    # "0-3,6" → {0,1,2,3,6}
+    cpus=set()
+    for part in (spec or "").split(","):
+        part=part.strip()
+        if not part: continue
+        a,_,b=part.partition("-"); cpus.update(range(int(a),int(b or a)+1))
+    return cpus
+
+@dataclass
+class ProcPolicy:
+    stall_s: float = 120.0            # 0 — без контролю зависання
+    timeout_s: float = 0.0            # ліміт часу на один процес; 0 — без ліміту
+    retries: int = 2                  # повтори після зависання або ліміту (не після звичайної помилки)
+    nice: int = 0                     # 0…19: нижчий пріоритет CPU для кодерів
+    ionice: str = ""                  # "idle" | "be:0…7" — пріоритет диска (Linux)
+    affinity: str = ""                # ядра для кодерів: "0-3,6"
+
+    @classmethod
+    def from_env(cls) -> "ProcPolicy":
+        env=os.environ.get
+        return cls(stall_s=float(env("DRYMIXER_STALL_S") or 120), timeout_s=float(env("DRYMIXER_TIMEOUT_S") or 0),
+                   retries=int(env("DRYMIXER_RETRIES") or 2), nice=int(env("DRYMIXER_NICE") or 0),
+                   ionice=env("DRYMIXER_IONICE") or "", affinity=env("DRYMIXER_AFFINITY") or "")
+
+    def wrap(self, cmd) -> list:
+        # POSIX: префікс nice/ionice/taskset (exec — pid лишається за ffmpeg); чого немає — apply()
+        if os.name!="posix" or cmd[:1]!=["ffmpeg"]: return cmd
+        pre=[]
+        if self.nice and shutil.which("nice"): pre+=["nice","-n",str(self.nice)]
+        if self.ionice and shutil.which("ionice"):
+            cls,_,lvl=self.ionice.partition(":")
+            pre+=["ionice","-c",{"idle":"3","be":"2","rt":"1"}.get(cls,"2")]+(["-n",lvl] if lvl else [])
+        if self.affinity and shutil.which("taskset"): pre+=["taskset","-c",self.affinity]
+        return pre+list(cmd)
+
+    def popen_kwargs(self) -> dict:
+        # Windows: клас пріоритету процесу замість nice
+        if os.name=="nt" and self.nice>0:
+            return {"creationflags":subprocess.IDLE_PRIORITY_CLASS if self.nice>=15 else subprocess.BELOW_NORMAL_PRIORITY_CLASS}
+        return {}
+
+    def apply(self, pid):
+        # Запасний шлях без утиліт: одразу після запуску
+        if os.name!="posix": return
+        try:
+            if self.nice and not shutil.which("nice"): os.setpriority(os.PRIO_PROCESS, pid, self.nice)
+            if self.affinity and not shutil.which("taskset") and hasattr(os,"sched_setaffinity"):
+                os.sched_setaffinity(pid, parse_cpus(self.affinity))
+        except (OSError,ValueError):
+            pass
+
+def cmd_expected(cmd) -> float:
+    # Запланована тривалість виходу ffmpeg-команди, с (0 — невідома): -t або єдиний вхідний файл
+    if "-t" in cmd:
+        try: return float(cmd[len(cmd)-1-cmd[::-1].index("-t")+1])
+        except (ValueError,IndexError): pass
+    ins=[cmd[i+1] for i,a in enumerate(cmd[:-1]) if a=="-i"]
+    e=PROBE_CACHE.peek(ins[0]) if len(ins)==1 else None
+    return float(e["duration"]) if e else 0.0
+
+_ENCODER_SLOTS={}; _slots_lock=threading.Lock(); _nullslot=contextlib.nullcontext()
+def encoder_slots(family) -> threading.BoundedSemaphore:
+    with _slots_lock:
+        if family not in _ENCODER_SLOTS:
+            _ENCODER_SLOTS[family]=threading.BoundedSemaphore(encoder_concurrency(family)[0])
+        return _ENCODER_SLOTS[family]
+
+# ---------- Можливості ffmpeg ----------
+# Кодери, hwaccel і фільтри зчитуються один раз на бінарник ffmpeg (шлях, розмір, mtime) і
+# зберігаються в кеші; апаратний кодер перевіряється пробним кодуванням кількох кадрів.
+CAPS_FILE = CACHE_DIR/"ffmpeg_caps.json"
+CAPS_RETRY_S = 24*3600          # невдалу пробу апаратного кодера повторюємо не частіше
+HW_ENCODERS = {"nvenc":"h264_nvenc", "qsv":"h264_qsv", "amf":"h264_amf"}
+
+def _ff_run(args, timeout=30) -> str:
+    return subprocess.run(["ffmpeg","-hide_banner",*args], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                          text=True, timeout=timeout, check=True).stdout
+
+def _ff_names(text) -> list:
+    # Рядки « V....D libx264  опис» / « TSC scale  V->V  опис»; легенда має «=» другим словом
+    out=[]
+    for line in text.splitlines():
+        p=line.split()
+        if len(p)>=2 and p[1]!="=" and set(p[0])<=set("VASFXBDTCN|."): out.append(p[1])
+    return sorted(set(out))
+
+def _scan_ffmpeg() -> dict:
+    ver=_ff_run(["-version"]).split("\n",1)[0].strip()
+    hw=[l.strip() for l in _ff_run(["-hwaccels"]).splitlines()[1:] if l.strip()]
+    return {"version":ver, "encoders":_ff_names(_ff_run(["-encoders"])), "filters":_ff_names(_ff_run(["-filters"])),
+            "hwaccels":hw, "tested":{}}
+
+def _smoke_encoder(enc_args) -> tuple:
+    # Кілька кадрів тими самими аргументами, що й у справжньому кодуванні → (ok, причина)
+    cmd=["ffmpeg","-hide_banner","-loglevel","error","-f","lavfi","-i","color=black:s=256x256:r=25:d=0.2",
+         *enc_args,"-f","null","-"]
+    try: r=subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, timeout=30)
+    except subprocess.TimeoutExpired: return False,"пробне кодування зависло"
+    except OSError as e: return False,str(e)
+    if r.returncode==0: return True,""
+    lines=[l.strip() for l in r.stderr.splitlines() if l.strip()]
+    return False,(lines[-1] if lines else f"код {r.returncode}")[:200]
+
+def _binary_id() -> str | None:
+    ff,fp=shutil.which("ffmpeg"),shutil.which("ffprobe")
+    if not ff or not fp: return None
+    try: st=os.stat(ff)
+    except OSError: return None
+    return f"{os.path.realpath(ff)}|{st.st_size}|{st.st_mtime_ns}"
+
+def _store_caps(ident, data):
+    try: cache=json.loads(CAPS_FILE.read_text(encoding="utf-8"))
+    except Exception: cache={}
+    cache.pop(ident,None); cache[ident]=data
+    try:
+        CAPS_FILE.parent.mkdir(parents=True,exist_ok=True); tmp=CAPS_FILE.with_suffix(".tmp")
+        tmp.write_text(json.dumps(dict(list(cache.items())[-4:]),ensure_ascii=False),encoding="utf-8")
+        os.replace(tmp,CAPS_FILE)
+    except OSError:
+        pass
+
+class FFmpegCaps:
+    def __init__(self, ident: str, data: dict):
+        self.ident=ident; self.data=data; self.lock=threading.Lock()
+        self.version=data["version"]; self.encoders=set(data["encoders"])
+        self.filters=set(data["filters"]); self.hwaccels=list(data["hwaccels"])
+
+    def missing_filters(self, names) -> list:
+        return [n for n in names if n not in self.filters]
+
+    def encoder_ok(self, enc_args, probe=True) -> tuple:
+        # (ok, причина); результат проби кешується, невдача перевіряється знову через CAPS_RETRY_S;
+        # probe=False — лише кешований результат, неперевірений кодер вважається робочим
+        name=enc_args[enc_args.index("-c:v")+1]
+        if name not in self.encoders: return False,"немає в цій збірці ffmpeg"
+        with self.lock:
+            t=self.data["tested"].get(name)
+            if t and (t["ok"] or time.time()-t["at"]<CAPS_RETRY_S or not probe): return t["ok"],t["why"]
+            if not probe: return True,""
+            ok,why=_smoke_encoder(enc_args)
+            self.data["tested"][name]={"ok":ok,"why":why,"at":time.time()}
+            _store_caps(self.ident,self.data)
+        return ok,why
+
+_CAPS=None; _caps_lock=threading.Lock()
+def ffmpeg_caps(refresh=False) -> FFmpegCaps | None:
+    # None — ffmpeg/ffprobe немає в PATH або ffmpeg не запускається
+    global _CAPS
+    with _caps_lock:
+        ident=_binary_id()
+        if ident is None: return None
+        if _CAPS is not None and _CAPS.ident==ident and not refresh: return _CAPS
+        data=None
+        if not refresh:
+            try: data=json.loads(CAPS_FILE.read_text(encoding="utf-8")).get(ident)
+            except Exception: pass
+        if data is None:
+            try: data=_scan_ffmpeg()
+            except (OSError,subprocess.SubprocessError): return None
+            _store_caps(ident,data)
+        _CAPS=FFmpegCaps(ident,data)
+        return _CAPS
+
+def cached_caps() -> FFmpegCaps | None:
+    # Лише вже відомі можливості (пам'ять або CAPS_FILE), без запуску ffmpeg
+    global _CAPS
+    with _caps_lock:
+        ident=_binary_id()
+        if ident is None: return None
+        if _CAPS is not None and _CAPS.ident==ident: return _CAPS
+        try: data=json.loads(CAPS_FILE.read_text(encoding="utf-8")).get(ident)
+        except Exception: data=None
+        if data is None: return None
+        _CAPS=FFmpegCaps(ident,data)
+        return _CAPS
+
+# ---------- План потоків ----------
+# Для кожного потоку фіналу (відео кліпів, аудіо кліпів або зовнішнє аудіо) вирішуємо,
+# чи треба його кодувати. Дії: copy — concat без перекодування, mux — зовнішній файл як є,
+# encode — кодування; кожна дія має причину для логу.
+H264_ENCODERS = ("libx264","h264_nvenc","h264_qsv","h264_amf")
+
+def _same_fps(a, b) -> bool:
+    try: return abs(float(a)-float(b))<0.01
+    except (TypeError,ValueError): return False
+
+def plan_streams(sigs, vcodec_args, is_copy, resolution="", fps="", audio_sig=None, use_audio=False) -> dict:
+    # sigs — сигнатури унікальних кліпів (None — не прочитано); resolution/fps — ціль, якщо задана
+    known=bool(sigs) and all(s is not None for s in sigs)
+    diff=lambda idx: [SIG_LABELS[i] for i in idx if any(s[i]!=sigs[0][i] for s in sigs)]
+    enc=vcodec_args[vcodec_args.index("-c:v")+1] if "-c:v" in vcodec_args else "libx264"
+    if is_copy: video=("copy","обрано копіювання")
+    elif not known: video=("encode","сигнатури частини кліпів невідомі")
+    elif diff(range(5)): video=("encode","кліпи різняться: "+", ".join(diff(range(5))))
+    else:
+        vcodec,width,_,pix,vfps=sigs[0][:5]
+        if vcodec is None: video=("encode","у кліпах немає відео")
+        elif enc in H264_ENCODERS and vcodec!="h264": video=("encode",f"кодек {vcodec} ≠ h264")
+        elif pix!="yuv420p": video=("encode",f"pix_fmt {pix} ≠ yuv420p")
+        elif resolution and str(width)!=resolution.split("x")[0]:
+            video=("encode",f"ширина {width} ≠ {resolution.split('x')[0]}")
+        elif fps and not _same_fps(vfps,fps): video=("encode",f"FPS {vfps} ≠ {fps}")
+        else: video=("copy","кліпи однакові й відповідають цілі")
+    if use_audio:
+        if audio_sig is None: audio=("encode","зовнішнє аудіо не прочитано")
+        elif audio_sig[5]!="aac": audio=("encode",f"зовнішнє аудіо {audio_sig[5]} ≠ aac")
+        else: audio=("mux","зовнішнє аудіо вже AAC")
+    elif not known: audio=("encode","сигнатури частини кліпів невідомі")
+    elif diff(range(5,8)): audio=("encode","кліпи різняться: "+", ".join(diff(range(5,8))))
+    elif sigs[0][5] not in ("aac",None): audio=("encode",f"аудіо кліпів {sigs[0][5]} ≠ aac")
+    else: audio=("copy","аудіо кліпів однакове AAC" if sigs[0][5] else "у кліпах немає аудіо")
+    return {"video":video,"audio":audio}
+
+# ---------- Розбиття фіналу на частини ----------
+def plan_segments(durs, n, limit=0.0):
+    # Ділить таймлайн по межах кліпів на ≤n частин близької тривалості.
+    # limit>0 — загальна довжина (-t): кліпи після неї відкидаються, остання частина обрізається.
+    # Повертає [(перший_кліп, кінець_зрізу, початок_с, тривалість_с)]
+    total=0.0; cut=len(durs)
+    for i,d in enumerate(durs):
+        if limit>0 and total+d>=limit: cut=i+1; total+=d; break
+        total+=d
+    if limit>0: total=min(total,limit)
+    n=max(1,min(n,cut)); segs=[]; start=0; acc=0.0
+    for k in range(n):
+        if start>=cut: break
+        goal=total*(k+1)/n; end=start+1; t=acc+durs[start]
+        while end<cut and k<n-1 and t+durs[end]/2<=goal: t+=durs[end]; end+=1
+        if k==n-1: end=cut; t=acc+sum(durs[start:end])
+        segs.append((start,end,acc,min(t,total)-acc)); start=end; acc=t
+    return segs
+
+def segment_frames(segs, fps) -> list:
+    # Кадрів у кожній частині: межі округлюються від початку таймлайну, тож сума частин
+    # дорівнює кадрам одного проходу, а похибка не накопичується від частини до частини
+    return [round((start+dur)*fps)-round(start*fps) for _,_,start,dur in segs]
+
+def count_video_frames(p) -> int | None:
+    # Кадрів у першому відеопотоці (лише демультиплексування, без декодування)
+    try:
+        out=subprocess.check_output(["ffprobe","-v","error","-select_streams","v:0","-count_packets",
+                                     "-show_entries","stream=nb_read_packets","-of","csv=p=0",str(p)], text=True)
+        return int(out.strip().split(",")[0])
+    except (OSError,subprocess.SubprocessError,ValueError):
+        return None
+
+# ---------- Прогрес ----------
+# ffmpeg із "-progress pipe:1" друкує блоки key=value; нас цікавлять out_time, fps, speed.
+# Трекер зводить їх у частку виконання: компіляція → етапи з плановими секундами медіа.
+def parse_progress_line(line, state: dict) -> bool:
+    # True — рядок належить до потоку прогресу (у лог його не пишемо)
+    k,sep,v=line.partition("=")
+    if not sep or not k.islower() or not k.replace("_","").isalnum(): return False
+    v=v.strip()
+    try:
+        if k in ("out_time_us","out_time_ms"): state["out_time"]=max(0.0,int(v)/1e6)
+        elif k=="fps": state["fps"]=float(v)
+        elif k=="speed": state["speed"]=float(v.rstrip("x")) if v not in ("N/A","") else 0.0
+        elif k=="progress": state["end"]=(v=="end")
+    except ValueError:
+        pass
+    return True
+
+class ProgressTracker:
+    def __init__(self, jobs=1):
+        self.jobs=max(1,jobs); self.lock=threading.Lock(); self.t0=time.time()
+        self.stages={}; self.live={}; self.finished=set(); self.seq=0
+
+    def plan(self, job, stage, planned):
+        with self.lock: self.stages[(job,stage)]=[float(planned),0.0]
+
+    def credit(self, job, stage, secs):
+        with self.lock: self.credit_unlocked(job,stage,secs)
+
+    def start(self, job, stage):
+        with self.lock:
+            self.seq+=1; self.live[self.seq]={"job":job,"stage":stage,"out_time":0.0,"speed":0.0,"fps":0.0}
+            return self.seq
+
+    def state(self, key) -> dict: return self.live[key]
+
+    def planned(self, job, stage) -> float:
+        with self.lock: return (self.stages.get((job,stage)) or [0.0])[0]
+
+    def end(self, key, ok=True):
+        with self.lock:
+            st=self.live.pop(key,None)
+            if st and ok: self.credit_unlocked(st["job"],st["stage"],st["out_time"])
+
+    def credit_unlocked(self, job, stage, secs):
+        s=self.stages.get((job,stage))
+        if s: s[1]+=secs
+
+    def finish_job(self, job):
+        with self.lock: self.finished.add(job)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            done={k:v[1] for k,v in self.stages.items()}
+            for st in self.live.values():
+                k=(st["job"],st["stage"])
+                if k in done: done[k]+=st["out_time"]
+            per_job={}
+            for (job,stage),(planned,_) in self.stages.items():
+                if planned<=0: continue
+                a=per_job.setdefault(job,[0.0,0.0]); a[0]+=planned; a[1]+=min(planned,done[(job,stage)])
+            for job in self.finished: per_job[job]=[1.0,1.0]
+            frac=sum(d/p for p,d in per_job.values() if p>0)/self.jobs
+            cur=self.live[max(self.live)] if self.live else None
+            snap={"fraction":min(1.0,frac),"elapsed":time.time()-self.t0,"job":None,"stage":None,
+                  "speed":0.0,"fps":0.0,"stage_eta":None,"eta":None}
+            if cur:
+                k=(cur["job"],cur["stage"]); peers=[s for s in self.live.values() if (s["job"],s["stage"])==k]
+                snap.update(job=cur["job"],stage=cur["stage"],speed=sum(s["speed"] for s in peers),
+                            fps=sum(s["fps"] for s in peers))
+                planned=self.stages.get(k,[0.0])[0]
+                if planned>0 and snap["speed"]>0:
+                    snap["stage_eta"]=max(0.0,planned-done.get(k,0.0))/snap["speed"]
+            if 0.01<=snap["fraction"]<1.0:
+                snap["eta"]=snap["elapsed"]*(1-snap["fraction"])/snap["fraction"]
+            return snap
+
+# ---------- Трасування ----------
+# Інтервали етапів (plan, probe, normalize, final, cleanup…) і кожного ffmpeg-процесу з його
+# CPU-часом. Після запуску — зведена таблиця в лог і trace-event JSON для chrome://tracing / Perfetto.
+TRACE_DIR = LOG_DIR/"traces"
+TRACE_KEEP = 20
+
+def wait_rusage(p) -> tuple:
+    # (код виходу, CPU user с, CPU sys с): wait4 повертає ресурси саме цього процесу
+    if hasattr(os,"wait4") and p.returncode is None:
+        try:
+            _,status,ru=os.wait4(p.pid,0)
+            p.returncode=os.waitstatus_to_exitcode(status)
+            return p.returncode, ru.ru_utime, ru.ru_stime
+        except ChildProcessError:  # процес уже зібрав poll() з іншого потоку
+            pass
+    p.wait()
+    return p.returncode, None, None
+
+class Tracer:
+    def __init__(self):
+        self.t0=time.perf_counter(); self.events=[]; self.threads={}; self.lock=threading.Lock()
+
+    def _tid(self) -> int:
+        ident=threading.get_ident()
+        with self.lock:
+            if ident not in self.threads: self.threads[ident]=(len(self.threads)+1, threading.current_thread().name)
+            return self.threads[ident][0]
+
+    @contextlib.contextmanager
+    def span(self, name, cat="stage", **args):
+        # У тіло віддається словник: ключі, додані в ньому, потрапляють в args події
+        t=time.perf_counter(); extra={}
+        try: yield extra
+        finally: self.add(name, cat, t, time.perf_counter(), {**args, **extra})
+
+    def add(self, name, cat, start, end, args=None):
+        ev={"name":name,"cat":cat,"ph":"X","ts":round((start-self.t0)*1e6),"dur":round((end-start)*1e6),
+            "pid":os.getpid(),"tid":self._tid(),"args":args or {}}
+        with self.lock: self.events.append(ev)
+
+    def summary(self) -> list:
+        # [(назва, к-сть, сумарно с, макс с, CPU с або None)] за спаданням сумарного часу
+        agg={}
+        with self.lock: events=list(self.events)
+        for e in events:
+            a=agg.setdefault(e["name"],[0,0.0,0.0,None]); d=e["dur"]/1e6
+            a[0]+=1; a[1]+=d; a[2]=max(a[2],d)
+            cpu=e["args"].get("cpu")
+            if cpu is not None: a[3]=(a[3] or 0.0)+cpu
+        return sorted(((k,*v) for k,v in agg.items()), key=lambda r: -r[2])
+
+    def summary_text(self) -> str:
+        rows=[f"[ЧАС] {'етап':<24}{'к-сть':>7}{'сумарно':>11}{'макс':>10}{'CPU':>10}"]
+        for name,n,total,mx,cpu in self.summary():
+            rows.append(f"[ЧАС] {name:<24}{n:>7}{total:>10.2f}с{mx:>9.2f}с"+(f"{cpu:>9.2f}с" if cpu is not None else ""))
+        return "\n".join(rows)+"\n"
+
+    def export(self, path: Path) -> Path:
+        with self.lock:
+            meta=[{"name":"thread_name","ph":"M","pid":os.getpid(),"tid":tid,"args":{"name":name}}
+                  for tid,name in self.threads.values()]
+            data={"traceEvents":meta+list(self.events),"displayTimeUnit":"ms"}
+        path.parent.mkdir(parents=True,exist_ok=True)
+        tmp=path.with_suffix(".tmp"); tmp.write_text(json.dumps(data,ensure_ascii=False),encoding="utf-8")
+        os.replace(tmp,path)
+        old=sorted(path.parent.glob("*.trace.json"), key=lambda p: p.stat().st_mtime)
+        for p in old[:-TRACE_KEEP]:
+            try: p.unlink()
+            except OSError: pass
+        return path
+
+STAGE_NAMES = {"norm":"нормалізація","final":"фінал","audio":"аудіо","mux":"склейка"}
+
+def progress_text(snap: dict, jobs: int) -> str:
+    parts=[f"{snap['fraction']*100:.1f}%"]
+    if snap["job"] is not None:
+        parts.append(f"#{snap['job']}/{jobs} {STAGE_NAMES.get(snap['stage'],snap['stage'])}")
+    if snap["speed"]>0: parts.append(f"{snap['speed']:.2f}x")
+    if snap["stage_eta"] is not None: parts.append("етап ~"+fmt_hhmmss(int(snap["stage_eta"])))
+    if snap["eta"] is not None: parts.append("усе ~"+fmt_hhmmss(int(snap["eta"])))
+    return " · ".join(parts)
+
+# ---------- Історія швидкості кодування ----------
+# Після кожного успішного ffmpeg з прогресом запам'ятовуємо швидкість (с медіа за с) і байтрейт
+# виходу за ключем «кодер|висота кадру» — з них план без запуску (--dry-run) оцінює час і розмір.
+THROUGHPUT_FILE = CACHE_DIR/"throughput.json"
+THROUGHPUT_ALPHA = 0.3          # вага нового виміру (ковзне середнє)
+# Швидкість для 720p, поки власних вимірів немає; для іншої висоти — обернено до висоти
+# (грубо: декодування джерела не залежить від розміру виходу, тож площа кадру завищила б різницю)
+DEFAULT_SPEED = {"copy":40.0,"libx264":3.0,"h264_nvenc":12.0,"h264_qsv":8.0,"h264_amf":8.0}
+
+def cmd_encoder(cmd) -> str:
+    if "-c:v" in cmd: return cmd[len(cmd)-1-cmd[::-1].index("-c:v")+1]
+    return "copy" if "-c" in cmd and cmd[cmd.index("-c")+1]=="copy" else "libx264"
+
+def cmd_height(cmd) -> int | None:
+    # Висота кадру виходу: scale=Ш:В із -vf або висота першого входу (concat-список — його перший файл)
+    src=cmd[cmd.index("-i")+1] if "-i" in cmd else None
+    if src and src.endswith(".txt"):
+        try:
+            with open(src,encoding="utf-8") as f: src=f.readline().strip()[5:].strip("'") or None
+        except OSError: src=None
+    e=PROBE_CACHE.peek(src) if src and not src.startswith("pipe:") else None
+    w,h=(e["sig"][1],e["sig"][2]) if e else (None,None)
+    vf=cmd[cmd.index("-vf")+1] if "-vf" in cmd else ""
+    for f in vf.split(","):
+        if f.startswith("scale="):
+            sw,_,sh=f[6:].partition(":")
+            try: sw,sh=int(sw),int(sh.split(":")[0] or 0)
+            except ValueError: return None
+            if sh>0: return sh
+            return round(sw*h/w/2)*2 if w and h else None
+    return h
+
+def out_height(resolution, sig) -> int | None:
+    # Висота виходу так само, як її рахує cmd_height: scale=Ш:-2 зберігає пропорції джерела
+    w,h=(sig[1],sig[2]) if sig else (None,None)
+    if not resolution: return h
+    rw,_,rh=resolution.partition("x")
+    return round(int(rw)*h/w/2)*2 if w and h else int(rh or 0) or None
+
+class ThroughputStats:
+    def __init__(self, path: Path):
+        self.path=path; self.data=None; self.dirty=False; self.lock=threading.Lock()
+
+    def _load(self):
+        if self.data is None:
+            try: self.data=json.loads(self.path.read_text(encoding="utf-8"))
+            except Exception: self.data={}
+        return self.data
+
+    @staticmethod
+    def key(enc, height) -> str:
+        return "copy" if enc=="copy" else f"{enc}|{int(height or 0)}"
+
+    def record(self, enc, height, media_s, wall_s, out_bytes=0):
+        if media_s<=0 or wall_s<=0 or (enc!="copy" and not height): return
+        speed=media_s/wall_s; bps=out_bytes/media_s if out_bytes else None
+        with self.lock:
+            e=self._load().setdefault(self.key(enc,height),{"n":0})
+            a=1.0 if e["n"]==0 else THROUGHPUT_ALPHA
+            e["speed"]=round(a*speed+(1-a)*e.get("speed",speed),4)
+            if bps: e["bps"]=round(a*bps+(1-a)*e.get("bps",bps))
+            e["n"]+=1; self.dirty=True
+
+    def record_cmd(self, cmd, media_s, wall_s):
+        # Лише відео-процеси: аудіо-проходи й канали без висоти кадру не дають порівнянних чисел
+        if "-vn" in cmd: return
+        enc=cmd_encoder(cmd); out=cmd[-1]
+        try: size=os.path.getsize(out) if not out.startswith("pipe:") and out!="-" else 0
+        except OSError: size=0
+        self.record(enc, cmd_height(cmd), media_s, wall_s, size)
+
+    def speed(self, enc, height) -> tuple:
+        # (×реального часу, виміряно?) — точний ключ, інакше та сама модель на іншій висоті, інакше типове
+        with self.lock:
+            data=self._load(); e=data.get(self.key(enc,height))
+            if e and e.get("speed"): return e["speed"],True
+            if enc=="copy": return DEFAULT_SPEED["copy"],False
+            h=height or 720
+            near=[(int(k.split("|")[1]),v["speed"]) for k,v in data.items()
+                  if k.startswith(enc+"|") and v.get("speed") and int(k.split("|")[1])>0]
+            if near:
+                h0,sp=min(near,key=lambda x: abs(x[0]-h)); return sp*h0/h,True
+            return DEFAULT_SPEED.get(enc,DEFAULT_SPEED["libx264"])*720/h,False
+
+    def bitrate(self, enc, height) -> float | None:
+        # Байт/с виходу цього кодера на цій висоті (None — вимірів немає)
+        with self.lock: e=self._load().get(self.key(enc,height))
+        return e.get("bps") if e else None
+
+    def save(self):
+        with self.lock:
+            if not self.dirty: return
+            try:
+                self.path.parent.mkdir(parents=True,exist_ok=True)
+                tmp=self.path.with_suffix(".tmp")
+                tmp.write_text(json.dumps(self.data,ensure_ascii=False,indent=1),encoding="utf-8")
+                os.replace(tmp,self.path); self.dirty=False
+            except OSError:
+                pass
+
+THROUGHPUT=ThroughputStats(THROUGHPUT_FILE)
+atexit.register(THROUGHPUT.save)
+
+# ---------- Шафл ----------
+# Робота йде над цілими id кліпів (шлях інтернується один раз), усі кроки — лінійні
+# або майже лінійні, щоб списки на сотні тисяч позицій не блокували інтерфейс.
+def shuffle_full(items):
+    items=list(items); random.shuffle(items); return items
+
+def intern_ids(items):
+    # (список id, таблиця id → елемент)
+    index={}; table=[]; ids=[]
+    for x in items:
+        i=index.get(x)
+        if i is None: i=index[x]=len(table); table.append(x)
+        ids.append(i)
+    return ids, table
+
+def infer_block_size(items):
+    n=len(items)
+    if n==0: return 0
+    # Найменший період через префікс-функцію (KMP): O(n) без копій списку
+    pi=[0]*n; k=0
+    for i in range(1,n):
+        x=items[i]
+        while k and x!=items[k]: k=pi[k-1]
+        if x==items[k]: k+=1
+        pi[i]=k
+    per=n-pi[-1]
+    if per<n and n%per==0: return per
+    seen=set()
+    for i,x in enumerate(items,1):
+        if x in seen: return i-1 if i>1 else n
+        seen.add(x)
+    return n
+
+def shuffle_blockwise_no_seam(items, bsz):
+    if bsz<=0: return shuffle_full(items)
+    out=[]; prev=None
+    for i in range(0,len(items),bsz):
+        block=items[i:i+bsz]; random.shuffle(block)
+        if prev is not None and block and block[0]==prev:
+            for j in range(1,len(block)):
+                if block[j]!=prev: block[0],block[j]=block[j],block[0]; break
+        out.extend(block); prev = block[-1] if block else None
+    return out
+
+def enforce_no_adjacent_duplicates(seq):
+    # Вказівник пошуку заміни рухається лише вперед: між i та j лишаються тільки
+    # значення, що дорівнюють попередньому, тож повторно їх переглядати не треба
+    seq=list(seq); n=len(seq); j=1
+    for i in range(1,n):
+        prev=seq[i-1]
+        if seq[i]==prev:
+            j=max(j,i+1)
+            while j<n and seq[j]==prev: j+=1
+            if j>=n: break
+            seq[i],seq[j]=seq[j],seq[i]
+    return seq
+
+def _gap_order(ids, k, rng, last, pos0):
+    # Одна мультимножина id (весь список або блок) у порядку, де id не повторюється
+    # ближче ніж через k позицій. last[id] — остання глобальна позиція (перенос між блоками).
+    # Вибір пропорційний залишку (рівномірно з пулу); id, що «остигають», відкидаються;
+    # id з найбільшим залишком (будь-який із рівних) ставиться примусово, коли інакше всі вони
+    # вже не вмістяться: потрібно (top-1)*(k+1)+скільки_їх позицій.
+    counts={}
+    for x in ids: counts[x]=counts.get(x,0)+1
+    by_count={}
+    for x,c in counts.items(): by_count.setdefault(c,set()).add(x)
+    top=max(by_count); pool=list(ids); taken={}; n=len(ids); out=[]
+    cool=collections.deque(); ready=set()
+    for x in sorted(counts, key=lambda x: last.get(x,-k-1)):
+        if x in last and pos0-last[x]<=k: cool.append((last[x]+k+1,x))
+        else: ready.add(x)
+    for pos in range(pos0, pos0+n):
+        while cool and cool[0][0]<=pos:
+            x=cool.popleft()[1]
+            if counts[x]>0: ready.add(x)
+        x=None
+        while top>0 and not by_count.get(top): top-=1
+        if top>1 and (top-1)*(k+1)+len(by_count[top])>=pos0+n-pos:
+            x=next((y for y in by_count[top] if y in ready), None)
+            if x is not None: taken[x]=taken.get(x,0)+1
+        tries=0
+        while x is None and pool and tries<8:
+            r=rng.randrange(len(pool)); y=pool[r]
+            if taken.get(y):
+                taken[y]-=1; pool[r]=pool[-1]; pool.pop(); continue
+            if y in ready: pool[r]=pool[-1]; pool.pop(); x=y
+            else: tries+=1
+        if x is None:
+            if ready:
+                ys=list(ready); x=rng.choices(ys, weights=[counts[y] for y in ys])[0]
+            else:  # усі залишки ще «остигають» — повтор неминучий, беремо найдавніший
+                x=next(y for _,y in cool if counts[y]>0)
+            taken[x]=taken.get(x,0)+1
+        c=counts[x]; counts[x]=c-1; by_count[c].discard(x)
+        if c>1: by_count.setdefault(c-1,set()).add(x)
+        ready.discard(x); cool.append((pos+k+1,x))
+        last[x]=pos; out.append(x)
+    return out
+
+def shuffle_ids(ids, mode="full", block_size=0, min_gap=1, rng=None):
+    # mode: full — увесь список; block — кожен блок окремо, обмеження діє і через шов.
+    # min_gap=K: id не повторюється в межах K попередніх позицій (0 — без обмеження).
+    rng=rng or random.Random(); ids=list(ids)
+    k=max(0,min(int(min_gap), len(set(ids))-1))
+    blocks=[ids] if mode!="block" or block_size<=0 else [ids[i:i+block_size] for i in range(0,len(ids),block_size)]
+    out=[]; last={}
+    for b in blocks:
+        if k==0: rng.shuffle(b); out.extend(b)
+        else: out.extend(_gap_order(b, k, rng, last, len(out)))
+    return out
+
+def shuffle_playlist(items, mode="full", block_size=0, min_gap=1, rng=None):
+    ids,table=intern_ids(items)
+    if mode=="block" and block_size<=0: block_size=infer_block_size(ids)
+    return [table[i] for i in shuffle_ids(ids, mode, block_size, min_gap, rng)]
+
+def gap_violations(seq, k) -> int:
+    # Скільки позицій повторюють елемент, що був менш ніж k+1 позицій тому
+    last={}; bad=0
+    for i,x in enumerate(seq):
+        if i-last.get(x,-k-1)<=k: bad+=1
+        last[x]=i
+    return bad
+
+def job_rng(seed, job_idx) -> random.Random:
+    # Однаковий seed → однаковий порядок кожної компіляції пакета
+    return random.Random(f"{seed}:{job_idx}")
+
+# ---------- Модель списку кліпів ----------
+# Список — масив id (array "I") плюс таблиця унікальних шляхів: дублювання, шафл і
+# перестановка працюють над масивом цілих, а вид показує лише видимі рядки.
+class ClipModel:
+    def __init__(self, paths=()):
+        self.clear(); self.extend(paths)
+
+    def __len__(self): return len(self.ids)
+
+    def clear(self):
+        self.table=[]; self.index={}; self.ids=array("I")
+
+    def intern(self, path) -> int:
+        i=self.index.get(path)
+        if i is None: i=self.index[path]=len(self.table); self.table.append(path)
+        return i
+
+    def extend(self, paths):
+        self.ids.extend(self.intern(str(p)) for p in paths)
+
+    def path(self, i) -> str: return self.table[self.ids[i]]
+
+    def slice(self, a, b) -> list:
+        t=self.table; return [t[i] for i in self.ids[a:b]]
+
+    def files(self) -> list:
+        t=self.table; return [t[i] for i in self.ids]
+
+    def unique(self) -> list:
+        t=self.table; return [t[i] for i in dict.fromkeys(self.ids)]
+
+    def delete(self, indices):
+        drop=set(indices)
+        if len(drop)<64:
+            for i in sorted(drop,reverse=True): del self.ids[i]
+        else:
+            self.ids=array("I",(x for i,x in enumerate(self.ids) if i not in drop))
+
+    def duplicate(self, indices, n):
+        # Вибрані позиції ще n-1 разів у кінець списку
+        seg=array("I",(self.ids[i] for i in sorted(indices)))
+        self.ids.extend(seg*(max(1,n)-1))
+
+    def duplicate_all(self, n):
+        self.ids*=max(1,n)
+
+    def shuffle(self, mode="full", block_size=0, min_gap=1, rng=None):
+        if mode=="block" and block_size<=0: block_size=infer_block_size(self.ids)
+        self.ids=array("I",shuffle_ids(self.ids, mode, block_size, min_gap, rng))
+
+    def move(self, indices, to) -> int:
+        # Переносить вибрані позиції групою на місце to (нумерація без них); повертає початок групи
+        sel=sorted(set(indices))
+        if len(sel)==1:
+            x=self.ids.pop(sel[0]); to=max(0,min(to,len(self.ids))); self.ids.insert(to,x); return to
+        drop=set(sel); picked=array("I",(self.ids[i] for i in sel))
+        rest=array("I",(x for i,x in enumerate(self.ids) if i not in drop))
+        to=max(0,min(to,len(rest))); self.ids=rest[:to]+picked+rest[to:]
+        return to
+
+# ---------- План тривалості ----------
+# Плейлист будується з відомих тривалостей (кеш ffprobe) і префіксних сум так, щоб сума
+# лягла в допуск від цілі без зайвого хвоста: кліпи, які однаково відріже -t, не кодуються.
+def plan_duration(order, durs, target, tol=0.0, min_gap=0, rng=None, fill=True, reshuffle=True, block=0):
+    # order — id після шафлу; durs[id] — тривалість, с (≤0 — невідома).
+    # fill — додавати проходи до цілі (інакше лише відкинути хвіст за ціллю);
+    # reshuffle — кожен наступний прохід перемішується з тим самим обмеженням повторів.
+    # Повертає (плейлист id, запланована тривалість, с)
+    if target<=0: return list(order), sum(max(0.0,durs[i]) for i in order)
+    if not fill:
+        out=[]; total=0.0
+        for i in order:
+            if total>=target: break
+            out.append(i); total+=max(0.0,durs[i])
+        return out, total
+    known=[i for i in order if durs[i]>0]
+    if not known: return list(order), 0.0
+    pass_total=sum(durs[i] for i in known)
+    passes=max(1,math.ceil((target+tol)/pass_total))
+    if passes==1: seq=known
+    elif reshuffle: seq=shuffle_ids(known*passes, "block", block or len(known), min_gap, rng)
+    else: seq=known*passes
+    out=[]; total=0.0; k=min(min_gap, len(set(known))-1)
+    for i in seq:
+        if total+durs[i]>target+tol: break
+        out.append(i); total+=durs[i]
+    # Хвіст: найдовший кліп, що ще вміщується і не повторює останні k позицій
+    cands=sorted(set(known), key=lambda i: durs[i])
+    while target-total>tol:
+        recent=set(out[-k:]) if k>0 else set()
+        room=target+tol-total; pick=None
+        for i in cands:
+            if durs[i]>room: break
+            if i not in recent: pick=i
+        if pick is None and out:
+            # Заміна останнього кліпу довшим, що закриває залишок у межах допуску
+            last=out[-1]; lo=durs[last]+target-tol-total; hi=durs[last]+room
+            near=set(out[-k-1:-1]) if k>0 else set()
+            swap=next((i for i in reversed(cands) if lo<=durs[i]<=hi and i not in near), None)
+            if swap is not None: out[-1]=swap; total+=durs[swap]-durs[last]; continue
+        if pick is None:  # нічого не вміщується — найкоротший дозволений кліп, решту відріже -t
+            pick=next((i for i in cands if i not in recent), cands[0])
+            out.append(pick); total+=durs[pick]; break
+        out.append(pick); total+=durs[pick]
+    return out, total
+
+# ---------- Специфікація завдання ----------
+# Те саме, що задається віджетами інтерфейсу; JSON-файл завдання містить ці ключі
+# (об'єкт або список об'єктів). Відносні шляхи рахуються від теки файлу завдання.
+CODECS = ("x264","copy","nvenc","qsv","amf")
+
+@dataclass
+class JobSpec:
+    files: list = field(default_factory=list)
+    out: str = "output.mp4"
+    duration: str = DEFAULT_DURATION
+    fixed_duration: bool = True
+    autofill: bool = True
+    tolerance: float = 2.0            # допуск автозаповнення від цілі, с (0 — точно, з обрізанням -t)
+    shuffle_mode: str = "full"        # full | block
+    block_size: int = 0               # 0 — визначити автоматично
+    min_gap: int = 1                  # кліп не повторюється в межах стількох попередніх позицій
+    seed: int | None = None           # None — випадковий (друкується в лог для повтору)
+    batch: int = 1
+    batch_shuffle: bool = True
+    parallel: int = 1
+    same_params: bool = False
+    resolution: str = ""              # "" — оригінал, інакше "1920x1080"
+    fps: str = ""                     # "" — оригінал
+    quick_copy: bool = False
+    codec: str = "x264"               # x264 | copy | nvenc | qsv | amf
+    out_mode: str = "copy"            # copy | norm
+    chunked: bool = False
+    stream: bool = False              # norm: кліпи йдуть у фінал каналом MPEG-TS, без проміжних файлів
+    smart_trim: bool = True           # copy з -t: копія до ключового кадру, перекодовується лише хвіст
+    crf: int = DEFAULT_CRF
+    abr: str = DEFAULT_ABR
+    audio: str = ""
+    trim_to_audio: bool = False
+    lufs: float = 0.0                 # ціль гучності EBU R128, LUFS (напр. -16); 0 — без вирівнювання
+    resume: bool = False              # продовжити пакет за маніфестом, пропустивши готові компіляції
+    hw_fallback: bool = True          # недоступний апаратний кодер → libx264 (False — помилка до старту)
+
+    @classmethod
+    def from_dict(cls, d: dict, base_dir: Path | None = None) -> "JobSpec":
+        known={f.name for f in fields(cls)}
+        extra=sorted(set(d)-known)
+        if extra: raise ValueError(f"Невідомі ключі завдання: {', '.join(extra)}")
+        spec=cls(**d)
+        if base_dir is not None:
+            rel=lambda p: str(p) if not p or Path(p).expanduser().is_absolute() else str(base_dir/p)
+            spec.files=[rel(p) for p in spec.files]; spec.out=rel(spec.out); spec.audio=rel(spec.audio)
+        spec.validate()
+        return spec
+
+    def validate(self):
+        if self.codec not in CODECS: raise ValueError(f"codec: очікується одне з {', '.join(CODECS)}")
+        if self.out_mode not in ("copy","norm"): raise ValueError("out_mode: очікується copy або norm")
+        if self.shuffle_mode not in ("full","block"): raise ValueError("shuffle_mode: очікується full або block")
+        if self.resolution and "x" not in self.resolution: raise ValueError("resolution: очікується ШxВ")
+        if int(self.min_gap)<0: raise ValueError("min_gap: очікується ціле ≥ 0")
+        if self.lufs and not -70<=float(self.lufs)<=-5: raise ValueError("lufs: очікується 0 або від -70 до -5")
+        parse_duration(self.duration)
+
+# ---------- Маніфест пакета ----------
+# _vmix_work/<назва>.manifest.json: параметри, seed, плейлист і стан кожної компіляції.
+# Пишеться атомарно після кожної зміни; видаляється, коли весь пакет зібрано без помилок.
+MANIFEST_VOLATILE = ("parallel","seed","resume")  # не впливають на результат компіляцій
+
+def partial_path(out: Path) -> Path:
+    # ffmpeg пише сюди, готовий файл з'являється під своєю назвою лише перейменуванням
+    return out.with_name(f".{out.stem}.part{out.suffix or '.mp4'}")
+
+class BatchManifest:
+    def __init__(self, path: Path, data: dict):
+        self.path=path; self.data=data; self.lock=threading.Lock()
+
+    @staticmethod
+    def path_for(out_file: Path) -> Path:
+        return out_file.parent/"_vmix_work"/f"{out_file.stem}.manifest.json"
+
+    @staticmethod
+    def spec_key(spec: JobSpec) -> dict:
+        return {k:v for k,v in asdict(spec).items() if k not in MANIFEST_VOLATILE}
+
+    @classmethod
+    def create(cls, out_file: Path, spec: JobSpec, seed) -> "BatchManifest":
+        m=cls(cls.path_for(out_file), {"version":1,"created":time.time(),"spec":cls.spec_key(spec),
+                                       "seed":seed,"table":[],"jobs":{}})
+        m.save(); return m
+
+    @classmethod
+    def load(cls, out_file: Path) -> "BatchManifest | None":
+        path=cls.path_for(out_file)
+        try: data=json.loads(path.read_text(encoding="utf-8"))
+        except (OSError,ValueError): return None
+        return cls(path,data) if isinstance(data,dict) and data.get("version")==1 else None
+
+    def matches(self, spec: JobSpec) -> bool:
+        return self.data.get("spec")==json.loads(json.dumps(self.spec_key(spec)))
+
+    def save(self):
+        with self.lock:
+            try:
+                self.path.parent.mkdir(parents=True,exist_ok=True)
+                tmp=self.path.with_suffix(".tmp")
+                tmp.write_text(json.dumps(self.data,ensure_ascii=False),encoding="utf-8")
+                os.replace(tmp,self.path)
+            except OSError:
+                pass
+
+    def job(self, idx) -> dict:
+        with self.lock: return dict(self.data["jobs"].get(str(idx)) or {})
+
+    def playlist(self, idx):
+        ids=self.job(idx).get("ids")
+        if ids is None: return None
+        t=self.data["table"]; return [t[i] for i in ids]
+
+    def set_playlist(self, idx, files, planned):
+        with self.lock:
+            index={p:i for i,p in enumerate(self.data["table"])}; ids=[]
+            for p in files:
+                i=index.get(p)
+                if i is None: i=index[p]=len(self.data["table"]); self.data["table"].append(p)
+                ids.append(i)
+            self.data["jobs"].setdefault(str(idx),{}).update(ids=ids, planned=planned, state="pending")
+        self.save()
+
+    def mark(self, idx, state, out=None):
+        with self.lock:
+            j=self.data["jobs"].setdefault(str(idx),{}); j.update(state=state, at=time.time())
+            if out is not None: j["out"]=str(out)
+        self.save()
+
+    def is_done(self, idx, out: Path) -> bool:
+        j=self.job(idx)
+        try: return j.get("state")=="done" and j.get("out")==str(out) and out.stat().st_size>0
+        except OSError: return False
+
+    def remove(self):
+        try: self.path.unlink()
+        except OSError: pass
+        try: self.path.parent.rmdir()
+        except OSError: pass
+
+def load_specs(path) -> list:
+    path=Path(path)
+    data=json.loads(path.read_text(encoding="utf-8"))
+    items=data if isinstance(data,list) else [data]
+    return [JobSpec.from_dict(d, path.resolve().parent) for d in items]
+
+# ---------- Рушій ----------
+class Engine:
+    # log(str) і status(компіляція, текст) можуть викликатися з робочих потоків
+    def __init__(self, log=None, status=None):
+        self.log=log or (lambda s: (sys.stdout.write(s), sys.stdout.flush()))
+        self.status=status or (lambda job, text: None)
+        self.stop_flag=threading.Event(); self.procs={}; self.procs_lock=threading.Lock()
+        self.tracker=ProgressTracker(); self.tracer=Tracer(); self.hw_failed=set()
+        self.remote=None        # координатор ферми (drymixer_farm): ffmpeg-задачі йдуть воркерам
+        self.policy=ProcPolicy.from_env()
+
+    # ---------- Процеси ----------
+    def run_cmd(self, cmd, abort=None, tag="", prog=None, stdin=None, stdout=None, started=None, budget=True, timeout=None):
+        # abort — подія групи паралельних процесів (напр. нормалізації), що гасить лише їх;
+        # tag — префікс рядків логу, щоб розрізняти паралельні компіляції;
+        # prog — (компіляція, етап) у трекері; ffmpeg завжди звітує через -progress (пульс для нагляду);
+        # stdin/stdout — двійкові канали потокового режиму (лог тоді читається з stderr),
+        # started(p) викликається одразу після запуску; budget=False — поза PROC_BUDGET;
+        # timeout — ліміт часу, с (типово policy.timeout_s). Зависання/ліміт → повтор із затримкою.
+        if cmd[:1]==["ffmpeg"]:
+            cmd=cmd[:1]+["-progress","pipe:2" if stdout else "pipe:1","-nostats"]+cmd[1:]
+        if self.remote is not None and cmd[:1]==["ffmpeg"] and stdin is None and stdout is None:
+            return self._run_remote(cmd, abort, tag, prog)
+        piped=stdin is not None or stdout is not None
+        pol=self.policy; limit=pol.timeout_s if timeout is None else timeout
+        for attempt in range(1, pol.retries+2):
+            rc,why=self._run_once(cmd, abort, tag, prog, stdin, stdout, started, budget, limit, not piped)
+            stopped=self.stop_flag.is_set() or (abort is not None and abort.is_set())
+            if why is None or piped or stopped: return rc
+            if attempt>pol.retries:
+                self.log(tag+f"[НАГЛЯД] {why}; спроби вичерпано.\n"); return rc
+            delay=min(60.0,5.0*2**(attempt-1))
+            self.log(tag+f"[НАГЛЯД] {why} — повтор {attempt+1}/{pol.retries+1} через {delay:.0f} с.\n")
+            if self.stop_flag.wait(delay): return rc
+        return rc
+
+    def _run_once(self, cmd, abort, tag, prog, stdin, stdout, started, budget, limit, watch):
+        # (код, причина примусового завершення або None). Рядки читає окремий потік, тож
+        # стоп, зависання й ліміт перевіряються щочверть секунди, навіть коли ffmpeg мовчить.
+        threads=cmd_threads(cmd) if budget else 0
+        if budget and not PROC_BUDGET.acquire(threads, self.stop_flag): return -1,None
+        key=self.tracker.start(*prog) if prog is not None else None; p=None; why=None
+        name=cmd[0]+(f".{prog[1]}" if prog is not None else "")
+        try:
+            with self.tracer.span(name, "proc", job=prog[0] if prog is not None else None, out=cmd[-1]) as targs:
+                self.log(tag+"$ "+" ".join(cmd)+"\n")
+                argv=self.policy.wrap(cmd); extra=self.policy.popen_kwargs()
+                if stdin is None and stdout is None:
+                    p=subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1,
+                                       errors="replace", **extra)
+                    lines=p.stdout
+                else:
+                    p=subprocess.Popen(argv, stdin=stdin, stdout=stdout or subprocess.PIPE,
+                                       stderr=subprocess.PIPE if stdout else subprocess.STDOUT, **extra)
+                    lines=io.TextIOWrapper(p.stderr if stdout else p.stdout, encoding="utf-8", errors="replace")
+                self.policy.apply(p.pid)
+                with self.procs_lock: self.procs[p]=abort
+                if started: started(p)
+                state=self.tracker.state(key) if key is not None else {}
+                q=queue.Queue()
+                def pump():
+                    try:
+                        for line in lines: q.put(line)  # type: ignore
+                    except (OSError,ValueError): pass
+                    finally: q.put(None)
+                threading.Thread(target=pump, daemon=True).start()
+                t0=moved=checked=time.monotonic(); last=None; size=-1
+                stall=self.policy.stall_s if watch and cmd[:1]==["ffmpeg"] else 0
+                expect=cmd_expected(cmd) if stall else 0.0
+                # Одинокий процес етапу (фінал, мукс): ціль етапу і є його тривалістю
+                if stall and not expect and prog is not None and prog[1] in ("final","mux"): expect=self.tracker.planned(*prog)
+                try:
+                    while True:
+                        try: line=q.get(timeout=0.25)
+                        except queue.Empty: line=""
+                        if line is None: break
+                        if self.stop_flag.is_set() or (abort is not None and abort.is_set()):
+                            self._kill(p)
+                            if self.stop_flag.is_set(): self.log(tag+"[СТОП] Процес перервано користувачем.\n")
+                            break
+                        now=time.monotonic()
+                        if line:
+                            if parse_progress_line(line, state):
+                                if state.get("out_time")!=last:
+                                    last=state.get("out_time"); moved=now
+                                    # Усе закодовано: далі трейлер і перезапис +faststart без оновлень out_time
+                                    if expect and (last or 0.0)>=expect-0.5: stall=0
+                            else: self.log(tag+line)
+                        if stall and now-checked>=1.0:
+                            # Ріст вихідного файлу — теж рух (запис трейлера великого файлу)
+                            checked=now
+                            try: grown=os.stat(cmd[-1]).st_size
+                            except OSError: grown=size
+                            if grown>size: size=grown; moved=now
+                        if stall and now-moved>stall:
+                            why=f"ffmpeg завис: {now-moved:.0f} с без руху прогресу"; self._kill(p); break
+                        if limit and now-t0>limit:
+                            why=f"перевищено ліміт часу {limit:.0f} с"; self._kill(p); break
+                finally:
+                    rc,user,sys_=wait_rusage(p)
+                    with self.procs_lock: self.procs.pop(p,None)
+                    targs.update(rc=rc, cpu=None if user is None else round(user+sys_,3), killed=why)
+                if rc==0 and prog is not None and state.get("out_time"):
+                    THROUGHPUT.record_cmd(cmd, state["out_time"], time.monotonic()-t0)
+            return p.returncode,why
+        finally:
+            if budget: PROC_BUDGET.release(threads)
+            if key is not None: self.tracker.end(key, ok=p is not None and p.returncode==0)
+
+    def _run_remote(self, cmd, abort, tag, prog):
+        # Задача ферми: чекаємо на воркера, прогрес приходить у стан трекера зі звітів
+        key=self.tracker.start(*prog) if prog is not None else None
+        state=self.tracker.state(key) if key is not None else {}
+        task=None
+        try:
+            with self.tracer.span("farm"+(f".{prog[1]}" if prog is not None else ""), "proc",
+                                  job=prog[0] if prog is not None else None, out=cmd[-1]) as targs:
+                task=self.remote.submit(cmd, state)
+                self.log(tag+f"$ [ферма #{task.id}] "+" ".join(cmd)+"\n")
+                while not task.done.wait(0.25):
+                    if self.stop_flag.is_set() or (abort is not None and abort.is_set()):
+                        self.remote.cancel(task)
+                        if self.stop_flag.is_set(): self.log(tag+"[СТОП] Задачу ферми скасовано.\n")
+                        break
+                for line in task.log: self.log(tag+line)
+                targs.update(rc=task.rc, worker=task.worker, attempts=task.attempt)
+            return task.rc if task.rc is not None else -1
+        finally:
+            if key is not None: self.tracker.end(key, ok=task is not None and task.rc==0)
+
+    def encoder_plan(self, family):
+        # (паралельних процесів, аргументи процесу, слоти); на фермі межа — слоти живих воркерів
+        jobs_n,extra=encoder_concurrency(family)
+        if self.remote is not None: return max(jobs_n,self.remote.capacity()),extra,_nullslot
+        return jobs_n,extra,encoder_slots(family)
+
+    def _probe(self, paths, dry=False) -> dict:
+        # dry — лише кеш ffprobe (для плану): непрочитані файли лишаються None
+        if dry: return {p:PROBE_CACHE.peek(p) for p in dict.fromkeys(str(p) for p in paths)}
+        with self.tracer.span("probe", n=len(paths)): return probe_many(paths, stop=self.stop_flag)
+
+    def _loudness(self, paths, tag="") -> dict:
+        # {шлях: вимір R128}; аналізуються лише джерела, яких ще немає в кеші ffprobe
+        uniq=list(dict.fromkeys(str(p) for p in paths))
+        fresh=[p for p in uniq if "loud" not in (PROBE_CACHE.get(p) or {"loud":None})]
+        if fresh: self.log(tag+f"[ГУЧНІСТЬ] Аналіз EBU R128: нових {len(fresh)}, з кешу {len(uniq)-len(fresh)}.\n")
+        with self.tracer.span("loudness", n=len(fresh)): return loudness_many(uniq, stop=self.stop_flag)
+
+    def _kill(self, p):
+        try: p.terminate()
+        except: pass
+        try: p.kill()
+        except: pass
+
+    def _kill_group(self, abort):
+        with self.procs_lock: group=[p for p,a in self.procs.items() if a is abort]
+        for p in group: self._kill(p)
+
+    def stop(self):
+        self.stop_flag.set()
+        with self.procs_lock: procs=list(self.procs)
+        for p in procs: self._kill(p)
+
+    def _run_many(self, tasks, workers):
+        # tasks — функції f(abort); перша помилка гасить решту процесів групи
+        abort=threading.Event(); results=[None]*len(tasks); err=None
+        if not tasks: return results
+        with ThreadPoolExecutor(max_workers=max(1,min(workers,len(tasks)))) as ex:
+            futs={ex.submit(t,abort):i for i,t in enumerate(tasks)}
+            for f in as_completed(futs):
+                try: results[futs[f]]=f.result()
+                except Exception as e:
+                    if err is None:
+                        err=e; abort.set(); self._kill_group(abort)
+        if err is not None: raise err
+        return results
+
+    # ---------- Фільтри/кодек ----------
+    def video_filters_and_rate(self, spec: JobSpec):
+        if spec.same_params: return None,[]
+        vf=[]
+        if spec.resolution:
+            w=spec.resolution.split("x")[0]; vf.append(f"scale={w}:-2")
+        rate=[]
+        if spec.fps:
+            vf.append(f"fps={spec.fps}"); rate=["-r",str(spec.fps),"-vsync","cfr"]
+        return (",".join(vf) if vf else None), rate
+
+    def choose_encoder_args(self, spec: JobSpec, vf, rate, quiet=False):
+        want_copy=spec.quick_copy or spec.codec=="copy"
+        if want_copy and not vf and not rate: return ["-c:v","copy"], True
+        if want_copy and (vf or rate) and not quiet:
+            self.log("[ПОВІДОМЛЕННЯ] Неможливо 'copy': змінюється роздільна або FPS.\n")
+        c=spec.codec
+        if c=="nvenc": return ["-c:v","h264_nvenc","-preset","fast","-b:v","5M"], False
+        if c=="qsv":   return ["-c:v","h264_qsv","-preset","fast","-b:v","5M"], False
+        if c=="amf":   return ["-c:v","h264_amf","-quality","speed","-b:v","5M"], False
+        return self.software_args(spec), False
+
+    def software_args(self, spec: JobSpec) -> list:
+        return ["-c:v","libx264","-preset","veryfast","-crf",str(int(spec.crf))]
+
+    def check_capabilities(self, spec: JobSpec, vf, vcodec_args, is_copy, dry=False) -> list:
+        # До старту: фільтри й кодер мають бути в цій збірці ffmpeg. Апаратний кодер, що не
+        # проходить пробу, замінюється на libx264 (hw_fallback) або зупиняє запуск одразу.
+        # dry — без запуску ffmpeg: лише кешовані можливості й результати проб
+        caps=cached_caps() if dry else ffmpeg_caps()
+        if caps is None and dry:
+            self.log("[ПЛАН] Можливості ffmpeg ще не перевірялися — план без перевірки фільтрів і кодера.\n")
+            return vcodec_args
+        if caps is None: raise ValueError("Не знайдено ffmpeg/ffprobe у PATH.")
+        missing=caps.missing_filters([f.split("=")[0] for f in (vf or "").split(",") if f])
+        if missing: raise ValueError(f"У цій збірці ffmpeg немає фільтрів: {', '.join(missing)}")
+        if is_copy: return vcodec_args
+        enc=vcodec_args[1]
+        if enc not in HW_ENCODERS.values():
+            if enc not in caps.encoders: raise ValueError(f"У цій збірці ffmpeg немає кодера {enc}.")
+            return vcodec_args
+        ok,why=caps.encoder_ok(vcodec_args+["-pix_fmt","yuv420p"], probe=not dry)
+        if ok: return vcodec_args
+        if not spec.hw_fallback: raise ValueError(f"Кодер {enc} недоступний: {why}")
+        self.log(f"[ПЛАН] Кодер {enc} недоступний ({why}) — кодую libx264.\n")
+        return self.software_args(spec)
+
+    def plan_streams(self, ctx, entries, tag="") -> dict:
+        # Рішення копіювати/кодувати за сигнатурами фактичних входів фіналу (після нормалізації —
+        # нормалізованих кліпів), тож ціль роздільної/FPS перевіряємо, а не застосовуємо наосліп
+        spec=ctx["spec"]; audio=[ctx["audio_path"]] if ctx["use_audio"] else []
+        probed=self._probe(list(entries)+audio)
+        sig=lambda p: tuple(probed[str(p)]["sig"]) if probed.get(str(p)) else None
+        uniq=list(dict.fromkeys(str(p) for p in entries))
+        plan=plan_streams([sig(p) for p in uniq], ctx["vcodec_args"], ctx["is_copy"],
+                          "" if spec.same_params else spec.resolution, "" if spec.same_params else spec.fps,
+                          sig(audio[0]) if audio else None, ctx["use_audio"])
+        names={"copy":"копія","mux":"як є","encode":"кодування"}
+        self.log(tag+"[ПЛАН] "+"; ".join(f"{k}: {names[a]} ({why})" for k,(a,why) in
+                                         (("відео",plan["video"]),("аудіо",plan["audio"])))+"\n")
+        return plan
+
+    def plan_to_duration(self, ctx, files, target_s, rng, tag=""):
+        # (плейлист, запланована тривалість) — див. plan_duration
+        with self.tracer.span("autofill"): return self._plan_to_duration(ctx, files, target_s, rng, tag)
+
+    def _plan_to_duration(self, ctx, files, target_s, rng, tag):
+        ids,table=intern_ids(files)
+        probed=self._probe(table, ctx["dry"])
+        durs=[(probed.get(str(p)) or {}).get("duration",0.0) for p in table]
+        unknown=sum(1 for d in durs if d<=0)
+        if unknown and ctx["autofill"] and not ctx["dry"]:
+            self.log(tag+f"[ПОПЕРЕДЖЕННЯ] Не вдалося визначити тривалість {unknown} кліпів — "
+                     +("автозаповнення вимкнено.\n" if unknown==len(durs) else "їх пропущено в автозаповненні.\n"))
+        block=ctx["block_size"] if ctx["shuffle_mode"]=="block" else 0
+        out,total=plan_duration(ids, durs, target_s, ctx["tolerance"], ctx["min_gap"], rng,
+                                fill=ctx["autofill"], reshuffle=ctx["shuffle"], block=block)
+        self.log(tag+f"[ПЛАН] Плейлист: {len(out)} позицій, {fmt_hhmmss(int(total))} "
+                 f"(ціль {fmt_hhmmss(int(target_s))} ±{ctx['tolerance']:g} с).\n")
+        return [table[i] for i in out], total
+
+    def normalize_clips(self, spec: JobSpec, job_files, vf, rate, tag="", job=0, enc=None):
+        # Повертає {джерело: нормалізований файл у кеші}; порядок concat задає виклик,
+        # тож паралельне завершення не впливає на результат
+        enc=enc or self.choose_encoder_args(spec,vf,rate,quiet=True)[0]
+        params,venc,aenc=norm_params(spec, vf, rate, enc)
+        family=encoder_family(enc); jobs_n,extra,slots=self.encoder_plan(family)
+
+        mapped={}; todo=[]; uniq=list(dict.fromkeys(job_files))
+        probed=self._probe(uniq)
+        dur=lambda src: (probed.get(str(src)) or {}).get("duration",0.0)
+        self.tracker.plan(job,"norm",sum(dur(src) for src in uniq))
+        for src in uniq:
+            key=NORM_CACHE.key(src,params)
+            if key is None: raise RuntimeError(f"Файл недоступний: {src}")
+            hit=NORM_CACHE.lookup(key)
+            if hit: mapped[src]=hit; NORM_CACHE.pin([hit]); self.tracker.credit(job,"norm",dur(src))
+            else: todo.append((src,key))
+        self.log(tag+f"[НОРМ] Унікальних {len(uniq)} на {len(job_files)} позицій: з кешу {len(uniq)-len(todo)}, "
+                 f"кодувати {len(todo)} (до {jobs_n} паралельно, {family}).\n")
+        louds=self._loudness([src for src,_ in todo], tag) if spec.lufs else {}
+
+        done=[0]; lock=threading.Lock()
+        def encode(src,key,abort):
+            # Те саме джерело може саме кодуватися в паралельному пакеті — тоді чекаємо його результат
+            out=NORM_CACHE.claim(key, lambda: self.stop_flag.is_set() or abort.is_set())
+            if out: self.tracker.credit(job,"norm",dur(src)); note=" (з паралельного пакета)"
+            else:
+                note=""
+                try:
+                    with slots, self.tracer.span("norm.clip", job=job, src=Path(src).name):
+                        if self.stop_flag.is_set() or abort.is_set(): raise RuntimeError("Зупинено")
+                        tmp=NORM_CACHE.temp_path(key)
+                        cmd=["ffmpeg","-y","-hide_banner","-loglevel","warning",
+                             "-fflags","+genpts","-avoid_negative_ts","make_zero","-i",src]
+                        if vf: cmd+=["-vf",vf]
+                        gain=loudness_gain(louds.get(str(src)), spec.lufs) if spec.lufs else 0.0
+                        if gain: cmd+=["-af",f"volume={gain}dB"]
+                        cmd+=rate+enc+extra+venc+aenc+["-movflags","+faststart","-f","mp4",str(tmp)]
+                        try:
+                            rc=self.run_cmd(cmd,abort,tag,prog=(job,"norm"))
+                            if self.stop_flag.is_set(): raise RuntimeError("Зупинено")
+                            if rc!=0: raise RuntimeError(f"Помилка нормалізації: {Path(src).name}")
+                            out=NORM_CACHE.commit(key,tmp); NORM_CACHE.pin([out])
+                        finally:
+                            try: tmp.unlink()
+                            except OSError: pass
+                finally:
+                    NORM_CACHE.release(key)
+            with lock:
+                mapped[src]=out
+                done[0]+=1; self.log(tag+f"[НОРМ] {done[0]}/{len(todo)} {Path(src).name}{note}\n")
+
+        try:
+            self._run_many([lambda abort,src=src,key=key: encode(src,key,abort) for src,key in todo], jobs_n)
+        except Exception:
+            NORM_CACHE.unpin(mapped.values()); raise
+        return mapped
+
+    def conform_audio(self, ctx) -> Path | None:
+        # Зовнішнє аудіо кодується в AAC 48 кГц стерео один раз — у кеші нормалізованих кліпів,
+        # тож усі компіляції пакета і наступні запуски з тим самим файлом лише копіюють потік.
+        # Повертає закріплений файл кешу (None — джерело вже відповідає або кодування не вдалося)
+        src=ctx["audio_path"]; e=PROBE_CACHE.get(src); lufs=ctx["lufs"]
+        if e and e["sig"][5:]==["aac",2,"48000"] and not lufs: return None
+        key=NORM_CACHE.key(src,["audio",ctx["abr"],48000,2]+([["lufs",lufs]] if lufs else []))
+        if key is None: return None
+        hit=NORM_CACHE.claim(key, self.stop_flag.is_set)
+        if hit is None:
+            self.log(f"[АУДІО] Кодую {Path(src).name} в AAC один раз на пакет.\n")
+            tmp=NORM_CACHE.temp_path(key)
+            try:
+                gain=loudness_gain(self._loudness([src]).get(str(src)), lufs) if lufs else 0.0
+                cmd=["ffmpeg","-y","-hide_banner","-loglevel","warning","-i",src,"-map","0:a:0","-vn"]
+                if gain: cmd+=["-af",f"volume={gain}dB"]
+                cmd+=["-c:a","aac","-b:a",ctx["abr"],"-ar","48000","-ac","2","-movflags","+faststart","-f","mp4",str(tmp)]
+                with self.tracer.span("audio.conform"): rc=self.run_cmd(cmd)
+                if self.stop_flag.is_set(): raise RuntimeError("Зупинено")
+                if rc!=0:
+                    self.log("[ПОПЕРЕДЖЕННЯ] Не вдалося підготувати аудіо — кодуватиму в кожній компіляції.\n")
+                    return None
+                hit=NORM_CACHE.commit(key,tmp); NORM_CACHE.pin([hit])
+            finally:
+                NORM_CACHE.release(key)
+                try: tmp.unlink()
+                except OSError: pass
+        else:
+            self.log(f"[АУДІО] {Path(src).name}: з кешу.\n")
+        PROBE_CACHE.get(hit)
+        ctx["audio_path"]=str(hit)
+        return hit
+
+    # ---------- Пакет ----------
+    def prepare(self, spec: JobSpec, dry=False) -> dict:
+        # Перша підготовка (порядок/аудіо/час) — все, що спільне для компіляцій пакета;
+        # dry — для плану без запуску: нічого не створює на диску, маніфест лише читається
+        if not spec.files: raise ValueError("Список кліпів порожній")
+        self.stop_flag.clear()
+        target=parse_duration(spec.duration) or 3600
+        out_file=Path(spec.out).expanduser().resolve()
+        if not dry: out_file.parent.mkdir(parents=True,exist_ok=True)
+
+        audio_path=(spec.audio or "").strip()
+        use_audio=len(audio_path)>0 and Path(audio_path).exists()
+        if use_audio and dry: audio_dur=(PROBE_CACHE.peek(audio_path) or {}).get("duration",0.0)
+        else: audio_dur=ffprobe_duration(Path(audio_path)) if use_audio else 0.0
+        fixed=spec.fixed_duration; trim=spec.trim_to_audio
+
+        t_args=[]
+        if not fixed and trim and audio_dur>0: t_args=["-t",str(int(audio_dur))]
+        elif fixed and trim and audio_dur>0:    t_args=["-t",str(min(target,int(audio_dur)))]
+        elif fixed:                              t_args=["-t",str(target)]
+        add_shortest=(use_audio and trim and audio_dur>0)
+        if use_audio and trim and audio_dur==0 and not dry:
+            self.log("[ПОПЕРЕДЖЕННЯ] Аудіо 0с/недоступне — ігнорую обрізання.\n")
+
+        vf, rate = self.video_filters_and_rate(spec)
+        vcodec_args, is_copy = self.choose_encoder_args(spec, vf, rate)
+        vcodec_args=self.check_capabilities(spec, vf, vcodec_args, is_copy, dry)
+
+        seed=spec.seed if spec.seed is not None else random.randrange(2**31)
+        manifest=BatchManifest.load(out_file) if spec.resume else None
+        if manifest is not None and not manifest.matches(spec):
+            self.log("[ВІДНОВЛЕННЯ] Параметри змінилися після попереднього запуску — починаю пакет заново.\n")
+            manifest=None
+        if manifest is not None:
+            if spec.seed is None: seed=manifest.data.get("seed",seed)
+            done=sum(1 for j in manifest.data["jobs"].values() if j.get("state")=="done")
+            self.log(f"[ВІДНОВЛЕННЯ] Маніфест {manifest.path.name}: готово {done}, решту буде дозібрано.\n")
+        elif dry:
+            manifest=BatchManifest(BatchManifest.path_for(out_file), {"jobs":{}})
+        else:
+            if spec.resume: self.log("[ВІДНОВЛЕННЯ] Маніфесту немає — звичайний запуск.\n")
+            manifest=BatchManifest.create(out_file, spec, seed)
+        if spec.batch_shuffle: self.log(f"[ШАФЛ] seed={seed}, без повтору в межах {spec.min_gap}.\n")
+        if spec.lufs and not use_audio and (spec.out_mode!="norm" or is_copy):
+            self.log("[ГУЧНІСТЬ] Рівні аудіо кліпів вирівнюються лише в режимі «Нормалізувати кожен» — тут лишаються як є.\n")
+
+        total_jobs=max(1,int(spec.batch or 1))
+        par=max(1,min(int(spec.parallel or 1),total_jobs))
+        return dict(spec=spec, files=list(spec.files), target=target, out_file=out_file, total_jobs=total_jobs,
+                    par=par, audio_path=audio_path, use_audio=use_audio, t_args=t_args, add_shortest=add_shortest,
+                    vf=vf, rate=rate, vcodec_args=vcodec_args, is_copy=is_copy,
+                    shuffle=spec.batch_shuffle, shuffle_mode=spec.shuffle_mode,
+                    block_size=spec.block_size or (infer_block_size(spec.files) if spec.shuffle_mode=="block" else 0),
+                    min_gap=int(spec.min_gap), seed=seed, manifest=manifest,
+                    autofill=spec.autofill, tolerance=max(0.0,float(spec.tolerance)), norm=spec.out_mode=="norm", abr=spec.abr, chunked=spec.chunked,
+                    stream=spec.stream, smart_trim=spec.smart_trim, lufs=float(spec.lufs or 0), dry=dry)
+
+    def run(self, spec: JobSpec) -> list:
+        return self.run_prepared(self.prepare(spec))
+
+    def run_prepared(self, ctx) -> list:
+        # Повертає список готових файлів; RuntimeError("Зупинено") — зупинка користувачем
+        self.tracker=ProgressTracker(ctx["total_jobs"]); self.tracer=Tracer(); self.hw_failed=set()
+        try:
+            with self.tracer.span("batch", jobs=ctx["total_jobs"]):
+                audio=self.conform_audio(ctx) if ctx["use_audio"] else None
+                try:
+                    done=self._run_jobs(ctx)
+                finally:
+                    if audio: NORM_CACHE.unpin([audio])
+            ctx["manifest"].remove()
+            return done
+        finally:
+            self.report_timing(ctx)
+
+    def report_timing(self, ctx):
+        # Зведена таблиця етапів у лог + trace-event JSON для профілювальника
+        self.log("\n"+self.tracer.summary_text())
+        try:
+            path=self.tracer.export(TRACE_DIR/f"{ctx['out_file'].stem}_{time.strftime('%Y%m%d_%H%M%S')}.trace.json")
+            self.log(f"[ЧАС] Трасу записано: {path} (chrome://tracing або ui.perfetto.dev)\n")
+        except OSError as e:
+            self.log(f"[ПОПЕРЕДЖЕННЯ] Не вдалося записати трасу: {e}\n")
+
+    def _run_jobs(self, ctx) -> list:
+        total_jobs, par = ctx["total_jobs"], ctx["par"]
+        done=[]; errors=[]
+        if par==1:
+            for job_idx in range(1, total_jobs + 1):
+                if self.stop_flag.is_set(): raise RuntimeError("Зупинено")
+                if not self._render_job(job_idx, ctx): raise RuntimeError("Зупинено")
+                done.append(self.job_out(ctx, job_idx))
+        else:
+            self.log(f"[ІНФО] Паралельна збірка: до {par} компіляцій одночасно.\n")
+            with ThreadPoolExecutor(max_workers=par) as ex:
+                futs={ex.submit(self._render_job, i, ctx):i for i in range(1, total_jobs + 1)}
+                for f in as_completed(futs):
+                    try:
+                        if f.result(): done.append(self.job_out(ctx, futs[f]))
+                    except Exception as e:
+                        if str(e)!="Зупинено": errors.append(f"#{futs[f]}: {e}")
+            if self.stop_flag.is_set(): raise RuntimeError("Зупинено")
+            if errors: raise RuntimeError("Помилки у компіляціях:\n"+"\n".join(errors))
+        return sorted(done)
+
+    # ---------- План без запуску ----------
+    def estimate(self, spec: JobSpec) -> dict:
+        # Пакет як у run(), але без кодування: ті самі плейлисти (seed, шафл, автозаповнення),
+        # що кодуватиметься і що візьметься з кешу; час — за історією швидкості кодерів
+        # (THROUGHPUT), розмір — за виміряним байтрейтом або байтрейтом джерел, пік диска —
+        # нові файли кешу нормалізації + виходи + частини фіналу в _vmix_work.
+        # ffmpeg/ffprobe не запускаються: можливості й тривалості — лише з кешів
+        ctx=self.prepare(spec, dry=True)
+        vf, rate, enc_args, is_copy = ctx["vf"], ctx["rate"], ctx["vcodec_args"], ctx["is_copy"]
+        enc=cmd_encoder(enc_args); norm=ctx["norm"] and not is_copy
+        jobs_n=1 if is_copy else self.encoder_plan(encoder_family(enc_args))[0]
+        params=norm_params(spec, vf, rate, enc_args)[0] if norm else None
+        probed=self._probe(ctx["files"], dry=True)
+        unprobed=sum(1 for e in probed.values() if e is None)
+        limit=float(ctx["t_args"][1]) if ctx["t_args"] else 0.0
+        a=PROBE_CACHE.peek(ctx["audio_path"]) if ctx["use_audio"] else None
+        guessed=set()
+
+        def speed(name, h):
+            sp,measured=THROUGHPUT.speed(name, h)
+            if not measured: guessed.add(name if name=="copy" else f"{name}@{h or '?'}p")
+            return sp
+        def enc_bps(e, h):
+            # байт/с закодованого виходу: вимір, інакше бітрейт кодера або джерела за площею кадру
+            b=THROUGHPUT.bitrate(enc, h)
+            if b: return b
+            if "-b:v" in enc_args: return rate_bytes(enc_args[enc_args.index("-b:v")+1])+rate_bytes(spec.abr)
+            if not e or not e.get("duration"): return rate_bytes("5M")
+            src_h=e["sig"][2] or h or 1
+            return e.get("size",0)/e["duration"]*((h or src_h)/src_h)**2
+
+        encoded=set(); jobs=[]
+        for i in range(1, ctx["total_jobs"]+1):
+            out=self.job_out(ctx, i); tag=f"[#{i}] " if ctx["total_jobs"]>1 else ""
+            if ctx["manifest"].is_done(i, out): jobs.append({"job":i,"out":str(out),"done":True}); continue
+            files=ctx["manifest"].playlist(i); planned=ctx["manifest"].job(i).get("planned")
+            if files is None: files,planned=self._plan_job(i, ctx, tag)
+            info=[probed.get(str(p)) for p in files]
+            durs=[(e or {}).get("duration",0.0) for e in info]
+            if planned is None: planned=sum(durs)
+            length=min(planned,limit) if limit and planned>0 else (planned or limit)
+            used=[]; acc=0.0          # скільки секунд кожної позиції потрапить у вихід після -t
+            for d in durs: used.append(max(0.0,min(d,length-acc))); acc+=d
+
+            norm_s=0.0; new=0; norm_bytes=0.0
+            if norm:
+                for src,e in zip(files,info):
+                    if src in encoded or not e: continue
+                    encoded.add(src); key=NORM_CACHE.key(src,params)
+                    if key and NORM_CACHE.path(key).exists(): continue
+                    h=out_height(spec.resolution, e["sig"]); new+=1
+                    norm_s+=e["duration"]/speed(enc,h)
+                    if not ctx["stream"]: norm_bytes+=e["duration"]*enc_bps(e,h)
+            # Фінал вирішує план потоків: для norm — за сигнатурами, які матимуть нормалізовані кліпи
+            uniq=[probed.get(str(p)) for p in dict.fromkeys(files)]
+            sigs=[e["sig"] if e else None for e in uniq]
+            if norm:
+                sigs=[["h264", int(spec.resolution.split("x")[0]) if spec.resolution else sg[1], out_height(spec.resolution,sg),
+                       "yuv420p", float(spec.fps) if spec.fps else sg[4], "aac", 2, "48000"] if sg else None for sg in sigs]
+            video="copy" if ctx["stream"] and norm else \
+                  plan_streams(sigs, enc_args, is_copy, spec.resolution, spec.fps, a["sig"] if a else None,
+                               ctx["use_audio"])["video"][0]
+            hs=[out_height(spec.resolution, e["sig"]) for e in info if e]; h=max(hs,default=None)
+            if video=="copy":
+                final_s=length/speed("copy",0)
+                out_bytes=sum(u*(enc_bps(e,out_height(spec.resolution,e["sig"])) if norm else
+                                 e.get("size",0)/e["duration"]) for u,e in zip(used,info) if e and e.get("duration"))
+                work=0.0
+            else:
+                k=jobs_n if ctx["chunked"] else 1
+                final_s=length/(speed(enc,h)*k)
+                ref=max((e for e in info if e), key=lambda e: e["sig"][2] or 0, default=None)
+                out_bytes=length*enc_bps(ref,h); work=out_bytes if k>1 else 0.0
+            jobs.append({"job":i,"out":str(out),"positions":len(files),"unique":len(set(files)),"duration":round(length,3),
+                         "encode":new,"norm_s":round(norm_s,1),"norm_bytes":int(norm_bytes),"video":video,
+                         "final_s":round(final_s,1),"out_bytes":int(out_bytes),"work_bytes":int(work)})
+
+        live=[j for j in jobs if not j.get("done")]; par=ctx["par"]
+        norm_wall=sum(j["norm_s"] for j in live)/jobs_n; final_wall=sum(j["final_s"] for j in live)/par
+        wall=max(norm_wall,final_wall) if ctx["stream"] else norm_wall+final_wall
+        work_peak=sum(sorted((j["work_bytes"] for j in live), reverse=True)[:par])
+        norm_total=sum(j["norm_bytes"] for j in live); out_total=sum(j["out_bytes"] for j in live)
+        root=ctx["out_file"].parent
+        while not root.exists() and root!=root.parent: root=root.parent
+        try: free=shutil.disk_usage(root).free
+        except OSError: free=None
+        return {"encoder":enc, "norm":norm, "stream":ctx["stream"], "parallel":par, "encode_parallel":jobs_n,
+                "seed":ctx["seed"], "unprobed":unprobed, "guessed":sorted(guessed), "jobs":jobs,
+                "total":{"wall_s":round(wall,1), "encode":sum(j["encode"] for j in live), "norm_bytes":int(norm_total),
+                         "out_bytes":int(out_total), "work_peak":int(work_peak),
+                         "disk_peak":int(norm_total+out_total+work_peak), "free":free}}
+
+    # ---------- Компіляції ----------
+    def job_out(self, ctx, job_idx) -> Path:
+        return numbered_out(ctx["out_file"], job_idx) if ctx["total_jobs"]>1 else ctx["out_file"]
+
+    def _render_job(self, job_idx, ctx) -> bool:
+        # Одна компіляція в ізольованому робочому каталозі; False — зупинено користувачем
+        manifest=ctx["manifest"]; out=self.job_out(ctx, job_idx)
+        if manifest.is_done(job_idx, out):
+            self.log(f"[ВІДНОВЛЕННЯ] Компіляція {job_idx} вже готова: {out.name}\n")
+            self.tracker.finish_job(job_idx); self.status(job_idx, "готово (раніше)")
+            return True
+        try:
+            with self.tracer.span("job", job=job_idx): ok=self._render_job_hw(job_idx, ctx)
+            if ok: self.tracker.finish_job(job_idx)
+            manifest.mark(job_idx, "done" if ok else "stopped", out if ok else None)
+            self.status(job_idx, "готово" if ok else "зупинено")
+            return ok
+        except Exception as e:
+            stopped=str(e)=="Зупинено"
+            manifest.mark(job_idx, "stopped" if stopped else "failed")
+            self.status(job_idx, "зупинено" if stopped else "помилка")
+            raise
+
+    def _render_job_hw(self, job_idx, ctx) -> bool:
+        # Апаратний кодер, що пройшов пробу, все ж може впасти (зайняті сесії, драйвер):
+        # компіляція повторюється на libx264, а наступні компіляції пакета одразу йдуть на CPU
+        enc=ctx["vcodec_args"][1] if encoder_family(ctx["vcodec_args"]) in HW_ENCODERS else None
+        if enc is None: return self._render_job_inner(job_idx, ctx)
+        soft=dict(ctx, vcodec_args=self.software_args(ctx["spec"]))
+        if enc in self.hw_failed: return self._render_job_inner(job_idx, soft)
+        try:
+            return self._render_job_inner(job_idx, ctx)
+        except RuntimeError as e:
+            if str(e)=="Зупинено" or self.stop_flag.is_set() or not ctx["spec"].hw_fallback: raise
+            self.hw_failed.add(enc)
+            self.log(f"[ПЛАН] Компіляція {job_idx}: {e} на {enc} — повтор на libx264.\n")
+            return self._render_job_inner(job_idx, soft)
+
+    def _render_job_inner(self, job_idx, ctx) -> bool:
+        total_jobs=ctx["total_jobs"]; t_args=ctx["t_args"]
+        vf, rate, is_copy = ctx["vf"], ctx["rate"], ctx["is_copy"]
+        tag=f"[#{job_idx}] " if ctx["par"]>1 else ""
+
+        self.log(f"\n=== Компіляція {job_idx}/{total_jobs} ===\n")
+        self.status(job_idx, "підготовка")
+
+        # Плейлист: з маніфесту (відновлення) або шафл + план тривалості
+        job_files=ctx["manifest"].playlist(job_idx); planned=ctx["manifest"].job(job_idx).get("planned")
+        if job_files is not None:
+            self.log(tag+f"[ВІДНОВЛЕННЯ] Плейлист компіляції {job_idx} із маніфесту ({len(job_files)} позицій).\n")
+        else:
+            with self.tracer.span("plan", job=job_idx): job_files,planned=self._plan_job(job_idx, ctx, tag)
+            ctx["manifest"].set_playlist(job_idx, job_files, planned)
+
+        # План для прогресу: тривалість виходу з урахуванням -t
+        if planned is None:
+            probed=self._probe(job_files)
+            planned=sum((probed.get(str(p)) or {}).get("duration",0.0) for p in job_files)
+        if t_args: planned=min(planned,float(t_args[1])) if planned>0 else float(t_args[1])
+        self.tracker.plan(job_idx,"final",planned)
+
+        # Робочий каталог — окремий для кожної компіляції; вихід — тимчасова назва до успіху
+        out_file_n=self.job_out(ctx, job_idx); part=partial_path(out_file_n)
+        if ctx["norm"] and not is_copy and ctx["stream"]:
+            try:
+                with self.tracer.span("stream", job=job_idx): ok=self._stream_final(job_idx, ctx, job_files, part, tag)
+                if ok is not None:
+                    if ok: os.replace(part, out_file_n); self.log(f"ГОТОВО → {out_file_n}\n")
+                    return ok
+            finally:
+                try: part.unlink()
+                except OSError: pass
+        work=out_file_n.parent/"_vmix_work"/f"job_{out_file_n.stem}"
+        work.mkdir(parents=True,exist_ok=True)
+        concat=work/"concat.txt"; build_concat(job_files, concat)
+
+        # Нормалізація (якщо обрано) — через кеш, паралельно в межах лімітів кодера
+        used=[]; entries=job_files
+        if ctx["norm"] and not is_copy:
+            if self.stop_flag.is_set(): raise RuntimeError("Зупинено")
+            self.status(job_idx, "нормалізація")
+            with self.tracer.span("normalize", job=job_idx):
+                mapped=self.normalize_clips(ctx["spec"], job_files, vf, rate, tag, job_idx, ctx["vcodec_args"])
+            used=list(mapped.values()); entries=[str(mapped[src]) for src in job_files]
+            build_concat(entries, concat)
+        try:
+            streams=self.plan_streams(ctx, entries, tag)
+            with self.tracer.span("final", job=job_idx) as targs:
+                if ctx["chunked"] and streams["video"][0]!="copy" and \
+                   self._chunked_final(job_idx, ctx, entries, part, work, tag, streams):
+                    self._cleanup_work(work, used); ok=True; targs["chunked"]=True
+                else:
+                    ok=self._final_pass(job_idx, ctx, concat, part, work, used, tag, streams, entries)
+            if ok:
+                os.replace(part, out_file_n); self.log(f"ГОТОВО → {out_file_n}\n")
+            return ok
+        finally:
+            NORM_CACHE.unpin(used)
+            try: part.unlink()
+            except OSError: pass
+
+    def _plan_job(self, job_idx, ctx, tag) -> tuple:
+        # (плейлист, запланована тривалість або None): шафл, автозаповнення, відкидання хвоста
+        base_files=ctx["files"]; t_args=ctx["t_args"]
+        rng=job_rng(ctx["seed"], job_idx)
+        if ctx["shuffle"]:
+            job_files=shuffle_playlist(base_files, ctx["shuffle_mode"], ctx["block_size"], ctx["min_gap"], rng)
+        else:
+            job_files=list(base_files)
+
+        # Автозаповнення / відкидання хвоста за ціллю — за тривалостями з кешу
+        planned=None
+        if ctx["autofill"] or t_args:
+            fill=int(t_args[1]) if t_args else ctx["target"]
+            job_files,planned=self.plan_to_duration(ctx, job_files, fill, rng, tag)
+        if ctx["shuffle"]:
+            bad=gap_violations(job_files, min(ctx["min_gap"], len(set(base_files))-1))
+            if bad: self.log(tag+f"[ШАФЛ] Не вдалося уникнути {bad} близьких повторів (забагато однакових кліпів).\n")
+        return job_files, planned
+
+    def _final_pass(self, job_idx, ctx, concat, out_file_n, work, used, tag, streams, entries=()) -> bool:
+        t_args=ctx["t_args"]; vf, rate, vcodec_args = ctx["vf"], ctx["rate"], ctx["vcodec_args"]
+        use_audio, audio_path = ctx["use_audio"], ctx["audio_path"]
+        is_copy=streams["video"][0]=="copy"
+        if is_copy: vf, rate, vcodec_args = None, [], ["-c:v","copy"]
+        if is_copy and t_args and ctx["smart_trim"] and entries:
+            concat=self._smart_trim(job_idx, ctx, entries, work, tag) or concat
+
+        # Фінальна команда
+        self.status(job_idx, "фінальне кодування")
+        cmd=["ffmpeg","-y","-hide_banner","-loglevel","warning",
+             "-fflags","+genpts","-avoid_negative_ts","make_zero",
+             "-f","concat","-safe","0","-i",str(concat)]
+        if use_audio: cmd+=["-i",audio_path]
+        if vf: cmd+=["-vf",vf]
+        cmd+=rate
+        if use_audio:
+            cmd+=["-map","0:v:0?","-map","1:a:0?"]
+        cmd+=vcodec_args
+        if vcodec_args[:2]==["-c:v","libx264"] and ctx["par"]>1:
+            cmd+=["-threads",str(max(1,(os.cpu_count() or 1)//ctx["par"]))]
+        if not is_copy:
+            if vcodec_args[:2]==["-c:v","libx264"]:
+                cmd+=["-g","60","-sc_threshold","0","-pix_fmt","yuv420p"]
+            else:
+                cmd+=["-g","60","-pix_fmt","yuv420p"]
+        if streams["audio"][0]=="encode": cmd+=["-c:a","aac","-b:a",ctx["abr"],"-ar","48000","-ac","2"]
+        else: cmd+=["-c:a","copy"]
+        cmd+=["-movflags","+faststart"]+t_args
+        if ctx["add_shortest"]: cmd+=["-shortest"]
+        cmd+=[str(out_file_n)]
+
+        rc=self.run_cmd(cmd, tag=tag, prog=(job_idx,"final"))
+
+        # Ретрай без -map
+        if rc!=0 and use_audio and not self.stop_flag.is_set():
+            self.log(tag+"[INFO] Повтор без явного -map (сумісність).\n")
+            cmd_nomap=[]; skip=False
+            for tok in cmd:
+                if skip: skip=False; continue
+                if tok=="-map": skip=True; continue
+                cmd_nomap.append(tok)
+            with self.tracer.span("final.retry_nomap", job=job_idx):
+                rc=self.run_cmd(cmd_nomap, tag=tag, prog=(job_idx,"final"))
+
+        if self.stop_flag.is_set():
+            self.log(tag+"[СТОП] Перервано користувачем.\n")
+            return False
+        elif rc!=0:
+            raise RuntimeError("Помилка фінального збирання")
+
+        self._cleanup_work(work, used)
+        return True
+
+    def _smart_trim(self, job_idx, ctx, entries, work, tag) -> Path | None:
+        # Копія кодує різ лише по ключових кадрах: усе до останнього ключового кадру перед -t
+        # береться копією (outpoint у списку concat), а неповний GOP до точки різу кодується
+        # libx264 з параметрами джерела й дописується в той самий список. Хвіст декодується під avcC
+        # джерела, тож його SPS/PPS мають збігтися байт у байт. None — звичайний -t.
+        entries=[str(p) for p in entries]; cut=float(ctx["t_args"][1]); probed=self._probe(list(dict.fromkeys(entries)))
+        pos=0.0
+        for c,src in enumerate(entries):
+            e=probed.get(src); d=e["duration"] if e else 0.0
+            if d<=0: return None
+            if pos+d>cut+1e-3: break
+            pos+=d
+        else:
+            return None                                 # різ за межами таймлайну — обрізати нічого
+        local=cut-pos; sig=probed[src]["sig"]
+        if sig[0]!="h264":
+            self.log(tag+f"[РІЗ] Точний різ лише для H.264 (тут {sig[0]}) — різ по ключовому кадру.\n"); return None
+        params=x264_tail_params(x264_options(src))
+        if params is None:
+            self.log(tag+"[РІЗ] Джерело закодоване не libx264 (CRF) — SPS/PPS хвоста не збіжуться, різ по ключовому кадру.\n")
+            return None
+        with self.tracer.span("smart_trim", job=job_idx):
+            kf=keyframe_before(src, local)
+            if kf is None:
+                self.log(tag+"[РІЗ] Не знайдено ключового кадру — різ по ключовому кадру.\n"); return None
+            key=kf["key"]; fps=fps_float(sig[4])
+            if local-key<0.5/fps: return None               # різ уже на ключовому кадрі
+            tail=work/"trim_tail.mp4"
+            cmd=["ffmpeg","-y","-hide_banner","-loglevel","warning","-ss",f"{key:.6f}","-i",src,"-t",f"{local-key:.6f}",
+                 "-map","0:v:0","-map","0:a:0?","-c:v","libx264","-preset","veryfast","-x264-params",params,
+                 "-pix_fmt",sig[3] or "yuv420p","-r",f"{fps:g}"]
+            prof=(kf["profile"] or "").lower().replace("constrained ","")
+            if prof in ("baseline","main","high"): cmd+=["-profile:v",prof]
+            if isinstance(kf["level"],int) and kf["level"]>0: cmd+=["-level",f"{kf['level']/10:g}"]
+            if kf["timescale"]: cmd+=["-video_track_timescale",str(kf["timescale"])]
+            if sig[5]: cmd+=["-c:a","aac","-b:a",ctx["abr"],"-ar",str(sig[7] or 48000),"-ac",str(sig[6] or 2)]
+            cmd+=["-movflags","+faststart",str(tail)]
+            rc=self.run_cmd(cmd, tag=tag)
+            if self.stop_flag.is_set(): raise RuntimeError("Зупинено")
+            if rc!=0:
+                self.log(tag+"[РІЗ] Не вдалося закодувати хвіст — різ по ключовому кадру.\n"); return None
+            ref=h264_extradata(src)
+            if ref is None or h264_extradata(tail)!=ref:
+                self.log(tag+"[РІЗ] Параметри H.264 хвоста (SPS/PPS) не збігаються з джерелом — різ по ключовому кадру.\n")
+                return None
+        q=lambda p: Path(p).resolve().as_posix()
+        lst=work/"concat_trim.txt"
+        with open(lst,"w",encoding="utf-8") as f:
+            for p in entries[:c]: f.write(f"file '{q(p)}'\n")
+            if key>0: f.write(f"file '{q(src)}'\noutpoint {key:.6f}\n")
+            f.write(f"file '{q(tail)}'\n")
+        self.log(tag+f"[РІЗ] Точний різ на {cut:g} с: копія до ключового кадру {pos+key:.2f} с, "
+                 f"перекодовано {local-key:.2f} с хвоста.\n")
+        return lst
+
+    def _cleanup_work(self, work, used):
+        # робоча папка містить лише списки concat і частини; нормалізовані кліпи лишаються в кеші
+        with self.tracer.span("cleanup"): self._cleanup_work_inner(work, used)
+
+    def _cleanup_work_inner(self, work, used):
+        try:
+            shutil.rmtree(work, ignore_errors=True)
+            try: work.parent.rmdir()
+            except OSError: pass
+            freed=NORM_CACHE.evict(keep=used)
+            if freed: self.log(f"[КЕШ] Витіснено {freed/1024**2:.0f} МБ зі сховища нормалізованих кліпів.\n")
+        except Exception as e:
+            self.log(f"[ПОПЕРЕДЖЕННЯ] Не вдалося прибрати робочі файли: {e}\n")
+
+    def _chunked_final(self, job_idx, ctx, entries, out_file_n, work, tag, streams) -> bool:
+        # Відео кодується частинами (межі — межі кліпів) паралельно, аудіо кліпів — одним
+        # проходом поруч; потім склейка частин через concat -c copy. False — частини недоречні.
+        vf, rate, vcodec_args = ctx["vf"], ctx["rate"], ctx["vcodec_args"]
+        family=encoder_family(vcodec_args); jobs_n,extra,slots=self.encoder_plan(family)
+        if jobs_n<2:
+            self.log(tag+"[ІНФО] Для кодування частинами бракує паралельних слотів — звичайний прохід.\n")
+            return False
+        probed=self._probe(entries)
+        durs=[(probed.get(str(p)) or {}).get("duration",0.0) for p in entries]
+        if any(d<=0 for d in durs):
+            self.log(tag+"[ПОПЕРЕДЖЕННЯ] Невідома тривалість частини кліпів — звичайний прохід.\n")
+            return False
+        t_args=ctx["t_args"]; limit=float(t_args[1]) if t_args else 0.0
+        segs=plan_segments(durs, jobs_n, limit)
+        if len(segs)<2: return False
+        total=sum(d for *_,d in segs); self.tracker.plan(job_idx,"final",total)
+        self.status(job_idx, f"фінал частинами ({len(segs)})")
+        self.log(tag+f"[ЧАСТИНИ] {len(segs)} частин по ~{total/len(segs):.0f} с, до {jobs_n} паралельно ({family}).\n")
+
+        venc=["-g","60","-sc_threshold","0","-pix_fmt","yuv420p"] if vcodec_args[:2]==["-c:v","libx264"] \
+             else ["-g","60","-pix_fmt","yuv420p"]
+        aenc=["-c:a","aac","-b:a",ctx["abr"],"-ar","48000","-ac","2"] if streams["audio"][0]=="encode" else ["-c:a","copy"]
+        head=["ffmpeg","-y","-hide_banner","-loglevel","warning","-fflags","+genpts","-avoid_negative_ts","make_zero"]
+        # Кожна частина обрізається до своїх кадрів: фільтр fps інакше додає кадр на межі,
+        # і відео відстає від суцільного аудіо на кадр після кожної частини
+        fps=fps_float(ctx["spec"].fps or (PROBE_CACHE.peek(entries[0]) or {"sig":[None]*5})["sig"][4])
+        frames=segment_frames(segs, fps)
+        parts=[]; tasks=[]
+        for k,(a,b,_,dur) in enumerate(segs):
+            lst=work/f"seg_{k:03d}.txt"; build_concat(entries[a:b], lst)
+            part=work/f"seg_{k:03d}.mp4"; parts.append(part)
+            cmd=head+["-f","concat","-safe","0","-i",str(lst)]
+            if vf: cmd+=["-vf",vf]
+            cmd+=rate+["-an"]+vcodec_args+extra+venc+["-avoid_negative_ts","make_zero","-frames:v",str(frames[k])]
+            tasks.append(cmd+[str(part)])
+        if not ctx["use_audio"]:
+            lst=work/"audio.txt"; build_concat(entries[:segs[-1][1]], lst)
+            tasks.append(head+["-f","concat","-safe","0","-i",str(lst),"-vn"]+aenc+["-t",f"{total:.3f}",str(work/"audio.m4a")])
+
+        def run(cmd,abort):
+            video="-an" in cmd
+            with slots if video else _nullslot:
+                if self.stop_flag.is_set() or abort.is_set(): raise RuntimeError("Зупинено")
+                rc=self.run_cmd(cmd,abort,tag,prog=(job_idx,"final" if video else "audio"))
+            if self.stop_flag.is_set(): raise RuntimeError("Зупинено")
+            if rc!=0: raise RuntimeError("Помилка кодування частини фіналу")
+        self._run_many([lambda abort,c=c: run(c,abort) for c in tasks], jobs_n+1)
+
+        # Перевірка кадрів за планом; остання частина може бути коротшою, якщо відео джерел скінчилося
+        got=[count_video_frames(p) for p in parts]
+        bad=[k for k,(n,want) in enumerate(zip(got,frames)) if n is None or n>want or (n<want and k<len(parts)-1)]
+        if bad:
+            self.log(tag+"[ПОПЕРЕДЖЕННЯ] Кадри частин не збігаються з планом ("
+                     +", ".join(f"#{k}: {got[k]}≠{frames[k]}" for k in bad)+") — звичайний прохід.\n")
+            return False
+
+        lst=work/"parts.txt"; build_concat(parts, lst)
+        cmd=head+["-f","concat","-safe","0","-i",str(lst)]
+        if ctx["use_audio"]: cmd+=["-i",ctx["audio_path"]]+["-map","0:v:0","-map","1:a:0?","-c:v","copy"]+aenc
+        else: cmd+=["-i",str(work/"audio.m4a"),"-map","0:v:0","-map","1:a:0?","-c","copy"]
+        cmd+=["-movflags","+faststart"]+t_args
+        if ctx["add_shortest"]: cmd+=["-shortest"]
+        self.status(job_idx, "склейка частин")
+        rc=self.run_cmd(cmd+[str(out_file_n)], tag=tag, prog=(job_idx,"mux"))
+        if self.stop_flag.is_set(): raise RuntimeError("Зупинено")
+        if rc!=0: raise RuntimeError("Помилка склейки частин фіналу")
+        return True
+
+    def _stream_final(self, job_idx, ctx, job_files, out_file_n, tag):
+        # Потоковий norm: кожна позиція кодується в MPEG-TS на stdout, а один фінальний ffmpeg
+        # приймає їх по черзі зі stdin і пише MP4 — без _norm, concat-файлів і повторного читання.
+        # Наперед кодується до jobs_n позицій, у кожної черга не більше STREAM_BUFFER_MB; коли вона
+        # повна, кодер блокується на записі в канал (зворотний тиск). Кліпи з кешу нормалізації
+        # лише перепаковуються. None — режим недоречний (звичайна нормалізація).
+        # Слоти кодера й PROC_BUDGET спільні з іншими компіляціями, а заблокований на черзі кодер
+        # їх не віддає. Тож позиція, яку муксер читає зараз («голова»), запускається без слота:
+        # кожна потокова компіляція завжди просувається, межу перевищує не більш ніж на один процес.
+        spec=ctx["spec"]; vf, rate, enc = ctx["vf"], ctx["rate"], ctx["vcodec_args"]
+        family=encoder_family(enc); jobs_n,extra=encoder_concurrency(family); slots=encoder_slots(family)
+        jobs_n=min(jobs_n, PROC_BUDGET.max_procs)
+        probed=self._probe(list(dict.fromkeys(job_files)))
+        durs=[(probed.get(str(p)) or {}).get("duration",0.0) for p in job_files]
+        if any(d<=0 for d in durs):
+            self.log(tag+"[ПОПЕРЕДЖЕННЯ] Невідома тривалість частини кліпів — нормалізація через файли.\n")
+            return None
+        offs=[0.0]
+        for d in durs[:-1]: offs.append(offs[-1]+d)
+        params,venc,aenc=norm_params(spec, vf, rate, enc)
+        hits={}
+        for src in dict.fromkeys(job_files):
+            key=NORM_CACHE.key(src,params)
+            if key is None: raise RuntimeError(f"Файл недоступний: {src}")
+            hit=NORM_CACHE.lookup(key)
+            if hit: hits[src]=hit
+        NORM_CACHE.pin(hits.values())
+        louds=self._loudness([p for p in dict.fromkeys(job_files) if p not in hits], tag) if spec.lufs else {}
+        depth=max(1,int(STREAM_BUFFER_MB*1024**2//STREAM_CHUNK))
+        self.log(tag+f"[ПОТІК] {len(job_files)} позицій у фінал через канал {STREAM_FORMAT}: з кешу {len(hits)} унікальних, "
+                 f"до {jobs_n} наперед ({family}), буфер ≤{STREAM_BUFFER_MB:.0f} МБ на позицію.\n")
+
+        # Фінальний муксер: відео копією, аудіо — кліпів (вже AAC) або зовнішнє
+        use_audio, audio_path = ctx["use_audio"], ctx["audio_path"]
+        cmd=["ffmpeg","-y","-hide_banner","-loglevel","warning","-f",STREAM_FORMAT,"-i","pipe:0"]
+        if use_audio:
+            e=PROBE_CACHE.get(audio_path); a_copy=bool(e) and e["sig"][5]=="aac"
+            cmd+=["-i",audio_path,"-map","0:v:0","-map","1:a:0?","-c:v","copy"]
+            cmd+=["-c:a","copy"] if a_copy else ["-c:a","aac","-b:a",ctx["abr"],"-ar","48000","-ac","2"]
+        else:
+            cmd+=["-c","copy"]
+        cmd+=["-movflags","+faststart"]+ctx["t_args"]
+        if ctx["add_shortest"]: cmd+=["-shortest"]
+        cmd+=[str(out_file_n)]
+
+        self.status(job_idx, "нормалізація → фінал")
+        abort=threading.Event(); mux_abort=threading.Event(); errs=[]; closed=[False]
+        queues={}; qlock=threading.Lock(); heads=[threading.Event() for _ in job_files]
+        class Waiting:
+            # «стоп» для PROC_BUDGET.acquire: позиція стала головою або збірку перервано
+            def __init__(w, i): w.i=i
+            def is_set(w): return heads[w.i].is_set() or self.stop_flag.is_set() or abort.is_set()
+        def admit(i, threads):
+            # True — отримано слот і токен бюджету; False — голова (без них); None — перервано
+            wait=Waiting(i)
+            while not (self.stop_flag.is_set() or abort.is_set()):
+                if heads[i].is_set(): return False
+                if not slots.acquire(timeout=0.25): continue
+                if PROC_BUDGET.acquire(threads, wait): return True
+                slots.release()
+            return None
+        def q_for(i):
+            with qlock:
+                if i not in queues: queues[i]=queue.Queue(maxsize=depth)
+                return queues[i]
+        def put(q, item):
+            while not (self.stop_flag.is_set() or abort.is_set()):
+                try: q.put(item, timeout=0.25); return True
+                except queue.Full: pass
+            return False
+
+        def produce(i, src):
+            if self.stop_flag.is_set() or abort.is_set(): return
+            hit=hits.get(src); q=q_for(i); readers=[]
+            cmd=["ffmpeg","-hide_banner","-loglevel","warning","-fflags","+genpts","-avoid_negative_ts","make_zero",
+                 "-i",str(hit or src)]
+            if hit: cmd+=["-c","copy"]
+            else:
+                if vf: cmd+=["-vf",vf]
+                gain=loudness_gain(louds.get(str(src)), spec.lufs) if spec.lufs else 0.0
+                if gain: cmd+=["-af",f"volume={gain}dB"]
+                cmd+=rate+enc+extra+venc+aenc
+            cmd+=["-output_ts_offset",f"{offs[i]:.3f}","-muxdelay","0","-muxpreload","0","-f",STREAM_FORMAT,"pipe:1"]
+            def pump(p):
+                def loop():
+                    try:
+                        for chunk in iter(lambda: p.stdout.read(STREAM_CHUNK), b""):
+                            if not put(q, chunk): break
+                    except (OSError,ValueError): pass
+                readers.append(threading.Thread(target=loop, daemon=True)); readers[0].start()
+            threads=cmd_threads(cmd); held=admit(i, threads) if not hit else False
+            if held is None: return
+            try: rc=self.run_cmd(cmd, abort, tag, stdout=subprocess.PIPE, started=pump, budget=False)
+            finally:
+                if held: PROC_BUDGET.release(threads); slots.release()
+            for t in readers: t.join()
+            if rc!=0: raise RuntimeError(f"Помилка нормалізації: {Path(src).name}")
+            put(q, None)
+
+        def task(i, src):
+            try: produce(i, src)
+            except Exception as e:
+                if not abort.is_set(): errs.append(e)
+                abort.set(); mux_abort.set(); self._kill_group(abort); self._kill_group(mux_abort)
+
+        box=[]; ready=threading.Event(); rc_box=[-1]
+        def mux():
+            try: rc_box[0]=self.run_cmd(cmd, mux_abort, tag, prog=(job_idx,"final"), stdin=subprocess.PIPE,
+                                        started=lambda p: (box.append(p), ready.set()), budget=False)
+            finally: ready.set()
+        mt=threading.Thread(target=mux, daemon=True); mt.start(); ready.wait()
+        try:
+            if not box: raise RuntimeError("Зупинено")
+            sink=box[0].stdin
+            with ThreadPoolExecutor(max_workers=jobs_n) as ex:
+                for i,src in enumerate(job_files): ex.submit(task, i, src)
+                try:
+                    for i in range(len(job_files)):
+                        q=q_for(i); heads[i].set()
+                        while True:
+                            try: chunk=q.get(timeout=0.25)
+                            except queue.Empty:
+                                if self.stop_flag.is_set() or abort.is_set(): break
+                                continue
+                            if chunk is None: break
+                            sink.write(chunk)
+                        with qlock: queues.pop(i,None)
+                        if self.stop_flag.is_set() or abort.is_set(): break
+                except (OSError,ValueError):
+                    # муксер закрив вхід (досяг -t або впав) — решта кодерів не потрібна
+                    closed[0]=True; abort.set(); self._kill_group(abort)
+                finally:
+                    try: sink.close()
+                    except (OSError,ValueError): pass
+            mt.join()
+        finally:
+            NORM_CACHE.unpin(hits.values())
+            if mt.is_alive(): mux_abort.set(); self._kill_group(mux_abort); mt.join()
+        if self.stop_flag.is_set():
+            self.log(tag+"[СТОП] Перервано користувачем.\n"); return False
+        if errs and not (closed[0] and rc_box[0]==0): raise errs[0]
+        if rc_box[0]!=0: raise RuntimeError("Помилка фінального збирання")
+        return True
+
+# ---------- Звіт плану ----------
+def estimate_text(est: dict) -> str:
+    lines=[]; t=est["total"]
+    for j in est["jobs"]:
+        name=Path(j["out"]).name
+        if j.get("done"): lines.append(f"[ОЦІНКА] #{j['job']} {name}: вже зібрано, пропускається."); continue
+        norm=f"нормалізація {j['encode']} кліпів ~{fmt_hhmmss(int(j['norm_s']))}, " if est["norm"] else ""
+        lines.append(f"[ОЦІНКА] #{j['job']} {name}: {j['positions']} позицій ({j['unique']} унікальних), "
+                     f"{fmt_hhmmss(int(j['duration']))}; {norm}фінал ({'копія' if j['video']=='copy' else est['encoder']}) "
+                     f"~{fmt_hhmmss(int(j['final_s']))}; вихід ~{fmt_size(j['out_bytes'])}.")
+    lines.append(f"[ОЦІНКА] Разом: ~{fmt_hhmmss(int(t['wall_s']))} ({est['parallel']} компіляцій паралельно, "
+                 f"кодування до {est['encode_parallel']} процесів); кодувати {t['encode']} кліпів.")
+    disk=f"[ОЦІНКА] Диск: виходи ~{fmt_size(t['out_bytes'])}"
+    if est["norm"] and not est["stream"]: disk+=f", нове в кеші нормалізації ~{fmt_size(t['norm_bytes'])}"
+    disk+=f", пік _vmix_work ~{fmt_size(t['work_peak'])}; пік разом ~{fmt_size(t['disk_peak'])}"
+    if t["free"] is not None: disk+=f" (вільно {fmt_size(t['free'])})"
+    lines.append(disk+".")
+    if t["free"] is not None and t["disk_peak"]>t["free"]: lines.append("[ПОПЕРЕДЖЕННЯ] Місця на диску може не вистачити.")
+    if est["guessed"]: lines.append("[ОЦІНКА] Без історії швидкості (типові значення): "+", ".join(est["guessed"])+
+                                    " — оцінка уточниться після першого запуску.")
+    if est["unprobed"]: lines.append(f"[ОЦІНКА] {est['unprobed']} кліпів ще не прочитано ffprobe — їх немає в оцінці; "
+                                     "після першого запуску чи «Перевірити сумісність» план буде повним.")
+    return "\n".join(lines)+"\n"
+
+# ---------- CLI ----------
+def main(argv=None) -> int:
+    ap=argparse.ArgumentParser(prog="python -m drymixer_engine",
+                               description="Dry Mixer: збірка компіляцій без GUI за JSON-завданнями.")
+    ap.add_argument("jobs",nargs="*",help="файли завдань JSON (об'єкт або список об'єктів)")
+    ap.add_argument("--out",help="перевизначити вихідний файл (лише для одного завдання)")
+    ap.add_argument("--batch",type=int,help="перевизначити кількість компіляцій")
+    ap.add_argument("--parallel",type=int,help="перевизначити кількість паралельних компіляцій")
+    ap.add_argument("--resume",action="store_true",help="продовжити перерваний пакет, пропустивши готові компіляції")
+    ap.add_argument("--progress",type=float,metavar="СЕК",help="друкувати прогрес у stderr кожні СЕК секунд")
+    ap.add_argument("--example",action="store_true",help="надрукувати шаблон завдання і вийти")
+    ap.add_argument("--caps",action="store_true",help="перевірити ffmpeg (кодери, hwaccel) наново, показати і вийти")
+    ap.add_argument("--dry-run",action="store_true",help="лише план: що кодуватиметься, оцінка часу, розміру й диска")
+    ap.add_argument("--plan-json",metavar="ФАЙЛ",help="з --dry-run: записати план у JSON")
+    args=ap.parse_args(argv)
+
+    if args.caps:
+        caps=ffmpeg_caps(refresh=True)
+        if caps is None: print("[ПОМИЛКА] Не знайдено ffmpeg/ffprobe у PATH.",file=sys.stderr); return 2
+        print(caps.version); print("hwaccel: "+(", ".join(caps.hwaccels) or "—"))
+        for fam,enc in HW_ENCODERS.items():
+            ok,why=caps.encoder_ok(["-c:v",enc,"-pix_fmt","yuv420p"])
+            print(f"{fam:<6}{enc:<12}{'так' if ok else 'ні: '+why}")
+        return 0
+
+    if args.example:
+        print(json.dumps(asdict(JobSpec(files=["clip1.mp4","clip2.mp4"])),ensure_ascii=False,indent=2)); return 0
+    if not args.jobs: ap.error("потрібен хоча б один файл завдання")
+    try:
+        specs=[s for p in args.jobs for s in load_specs(p)]
+    except (OSError,ValueError,TypeError) as e:
+        print(f"[ПОМИЛКА] {e}",file=sys.stderr); return 2
+    if args.out and len(specs)!=1: ap.error("--out можна задати лише для одного завдання")
+    for s in specs:
+        if args.out: s.out=args.out
+        if args.batch: s.batch=args.batch
+        if args.parallel: s.parallel=args.parallel
+        if args.resume: s.resume=True
+    if not have_ffmpeg(scan=not args.dry_run):
+        print("[ПОМИЛКА] Не знайдено ffmpeg/ffprobe у PATH.",file=sys.stderr); return 2
+
+    disk=session_log()
+    engine=Engine(log=lambda s: (sys.stdout.write(s), sys.stdout.flush(), disk.write(s)))
+    for sig in (signal.SIGINT, getattr(signal,"SIGTERM",None)):
+        if sig is not None: signal.signal(sig, lambda *_: engine.stop())
+    busy=threading.Event()
+    if args.progress:
+        def report():
+            while not busy.wait(args.progress):
+                sys.stderr.write("[ПРОГРЕС] "+progress_text(engine.tracker.snapshot(),engine.tracker.jobs)+"\n")
+        threading.Thread(target=report,daemon=True).start()
+
+    if args.dry_run:
+        plans=[]
+        for spec in specs:
+            try: est=engine.estimate(spec)
+            except (OSError,ValueError) as e:
+                engine.log("[ПОМИЛКА] "+str(e)+"\n"); return 2
+            engine.log(estimate_text(est)); plans.append(est)
+        if args.plan_json:
+            Path(args.plan_json).write_text(json.dumps(plans if len(plans)>1 else plans[0],ensure_ascii=False,indent=2),encoding="utf-8")
+        return 0
+
+    rc=0
+    try:
+        for i,spec in enumerate(specs,1):
+            if len(specs)>1: engine.log(f"\n##### Завдання {i}/{len(specs)}: {spec.out} #####\n")
+            try:
+                engine.run(spec)
+            except RuntimeError as e:
+                if str(e)=="Зупинено":
+                    engine.log("[СТОП] Перервано.\n"); return 130
+                engine.log("[ПОМИЛКА] "+str(e)+"\n"); rc=1
+            except (OSError,ValueError) as e:
+                engine.log("[ПОМИЛКА] "+str(e)+"\n"); rc=1
+    finally:
+        busy.set()
+    return rc
+
+if __name__=="__main__":
+    sys.exit(main())
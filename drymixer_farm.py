@@ -0,0 +1,372 @@
+# Dry Mixer — ферма рендерингу: координатор роздає ffmpeg-задачі (нормалізація, частини фіналу,
+# фінальне збирання) воркерам на інших машинах через HTTP/JSON. Джерела, _vmix_work і кеш
+# нормалізації (DRYMIXER_NORM_CACHE) мають лежати на спільному сховищі, видимому всім вузлам.
+#   python drymixer_farm.py coordinator job.json --port 8765 [--local-workers 3]
+#   python drymixer_farm.py worker --url http://коорд:8765 --slots 2 [--path-map /mnt/share=/data]
+#   python drymixer_farm.py status --url http://коорд:8765
+
+import argparse, collections, ipaddress, json, os, shutil, signal, socket, subprocess, sys, tempfile, threading, time, urllib.error, urllib.request
+from dataclasses import dataclass, field
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from drymixer_engine import Engine, ProcPolicy, have_ffmpeg, load_specs, parse_progress_line, progress_text, session_log
+
+FARM_PORT = 8765
+HEARTBEAT_S = 2.0               # як часто воркер звітує
+LEASE_S = 15.0                  # без звіту довше — задачу повертаємо в чергу
+MAX_ATTEMPTS = 3
+LOG_TAIL = 50                   # рядків логу ffmpeg, що повертаються координатору
+
+# ---------- Координатор ----------
+def attempt_path(out, attempt) -> str:
+    # Кожна спроба пише у власний файл (вихід — останній аргумент ffmpeg): процес «мертвого»
+    # воркера, що ще працює, не зіпсує результат повтору. Розширення лишається для ffmpeg.
+    p=Path(out); return str(p.with_name(f".{p.stem}.a{attempt}{p.suffix}"))
+
+def is_loopback(host) -> bool:
+    if host=="localhost": return True
+    try: return ipaddress.ip_address(host).is_loopback
+    except ValueError: return False
+
+def _unlink(path):
+    try: os.remove(path)
+    except OSError: pass
+
+@dataclass
+class FarmTask:
+    id: int
+    cmd: list
+    state: dict                                   # стан прогресу трекера рушія (оновлюється звітами)
+    attempt: int = 0
+    worker: str | None = None
+    seen: float = 0.0
+    not_before: float = 0.0
+    rc: int | None = None
+    log: list = field(default_factory=list)
+    outputs: list = field(default_factory=list)   # файли спроб, прибираються після завершення
+    done: threading.Event = field(default_factory=threading.Event)
+
+class Coordinator:
+    def __init__(self, host="127.0.0.1", port=FARM_PORT, token="", lease_s=LEASE_S, max_attempts=MAX_ATTEMPTS, log=None):
+        self.token=token; self.lease_s=lease_s; self.max_attempts=max_attempts
+        self.log=log or (lambda s: None)
+        self.lock=threading.Lock(); self.seq=0
+        self.queue=collections.deque(); self.running={}; self.workers={}
+        self.server=ThreadingHTTPServer((host,port), self._handler()); self.server.daemon_threads=True
+        self.port=self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        threading.Thread(target=self._reaper, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown(); self.server.server_close()
+
+    # Рушій: задача блокує потік виклику до завершення (див. Engine.run_cmd)
+    def submit(self, cmd, state) -> FarmTask:
+        with self.lock:
+            self.seq+=1; t=FarmTask(self.seq, list(cmd), state); self.queue.append(t)
+        return t
+
+    def cancel(self, task: FarmTask):
+        with self.lock:
+            if task in self.queue: self.queue.remove(task)
+            task.rc=-1 if task.rc is None else task.rc; task.done.set()
+            for p in task.outputs: _unlink(p)
+
+    def capacity(self) -> int:
+        # Сума слотів живих воркерів (щонайменше 1 — задачі чекають на перший вузол)
+        now=time.time()
+        with self.lock: return max(1,sum(w["slots"] for w in self.workers.values() if now-w["seen"]<self.lease_s))
+
+    def status(self) -> dict:
+        now=time.time()
+        with self.lock:
+            return {"queued":len(self.queue), "running":len(self.running),
+                    "workers":{n:{"slots":w["slots"],"running":w["running"],"done":w["done"],"failed":w["failed"],
+                                  "seen_s":round(now-w["seen"],1)} for n,w in self.workers.items()}}
+
+    def _worker(self, name, slots=None):
+        w=self.workers.setdefault(name,{"slots":1,"running":0,"done":0,"failed":0,"seen":0.0})
+        w["seen"]=time.time()
+        if slots is not None: w["slots"]=max(1,int(slots))
+        return w
+
+    def _requeue(self, t: FarmTask, why):
+        # Під self.lock: повтор із затримкою 2, 4, 8… с або остаточна помилка
+        self.running.pop(t.id,None); t.worker=None
+        if t.done.is_set(): return
+        if t.attempt>=self.max_attempts:
+            t.log.append(f"[ФЕРМА] Задачу #{t.id} не виконано після {t.attempt} спроб: {why}\n")
+            t.rc=t.rc if t.rc not in (None,0) else 1; t.done.set()
+            for p in t.outputs: _unlink(p)
+            return
+        t.not_before=time.time()+min(30.0,2.0**t.attempt)
+        self.log(f"[ФЕРМА] Задача #{t.id}: {why} — повтор {t.attempt+1}/{self.max_attempts}.\n")
+        self.queue.append(t)
+
+    def _reaper(self):
+        while True:
+            time.sleep(1.0); now=time.time()
+            with self.lock:
+                for t in [t for t in self.running.values() if now-t.seen>self.lease_s]:
+                    self.workers.get(t.worker,{}).update(running=max(0,self.workers.get(t.worker,{}).get("running",1)-1))
+                    self._requeue(t, f"воркер {t.worker} мовчить {now-t.seen:.0f} с")
+
+    def lease(self, name, free) -> dict | None:
+        now=time.time()
+        with self.lock:
+            w=self._worker(name)
+            if free<=0: return None
+            for t in self.queue:
+                if t.not_before<=now and not t.done.is_set():
+                    self.queue.remove(t); t.attempt+=1; t.worker=name; t.seen=now
+                    self.running[t.id]=t; w["running"]+=1
+                    out=attempt_path(t.cmd[-1], t.attempt); t.outputs.append(out)
+                    return {"id":t.id, "cmd":t.cmd[:-1]+[out], "attempt":t.attempt}
+        return None
+
+    def heartbeat(self, name, slots, tasks) -> dict:
+        # tasks — {id: стан прогресу}; у відповідь — задачі, які воркер має зупинити
+        now=time.time(); cancel=[]
+        with self.lock:
+            self._worker(name, slots)
+            for tid,state in tasks.items():
+                t=self.running.get(int(tid))
+                if t is None or t.worker!=name or t.done.is_set():
+                    cancel.append(int(tid))
+                    if t is not None and t.worker==name:
+                        self.running.pop(t.id,None); self.workers[name]["running"]=max(0,self.workers[name]["running"]-1)
+                    continue
+                t.seen=now; t.state.update({k:v for k,v in state.items() if k in ("out_time","speed","fps")})
+        return {"cancel":cancel}
+
+    def finish(self, name, tid, rc, log):
+        with self.lock:
+            w=self._worker(name); t=self.running.get(int(tid))
+            if t is None or t.worker!=name: return
+            w["running"]=max(0,w["running"]-1)
+            t.log.extend(log[-LOG_TAIL:]); t.rc=int(rc)
+            if t.rc==0:
+                try: os.replace(t.outputs[-1], t.cmd[-1])
+                except OSError as e: t.log.append(f"[ФЕРМА] Не вдалося перемістити результат: {e}\n"); t.rc=1
+                for p in t.outputs[:-1]: _unlink(p)
+                w["done"]+=1; self.running.pop(t.id,None); t.done.set()
+            else:
+                w["failed"]+=1; self._requeue(t, f"код {rc} на {name}")
+
+    def _handler(self):
+        coord=self
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *a): pass
+
+            def _reply(self, code, obj=None):
+                body=json.dumps(obj,ensure_ascii=False).encode("utf-8") if obj is not None else b""
+                self.send_response(code); self.send_header("Content-Type","application/json")
+                self.send_header("Content-Length",str(len(body))); self.end_headers(); self.wfile.write(body)
+
+            def _authorized(self) -> bool:
+                if coord.token and self.headers.get("X-Farm-Token")!=coord.token:
+                    self._reply(403,{"error":"token"}); return False
+                return True
+
+            def do_GET(self):
+                if not self._authorized(): return
+                if self.path=="/status": self._reply(200,coord.status())
+                else: self._reply(404,{"error":"not found"})
+
+            def do_POST(self):
+                if not self._authorized(): return
+                try:
+                    d=json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                    name=str(d["worker"])
+                    if self.path=="/lease":
+                        t=coord.lease(name, int(d.get("free",1)))
+                        self._reply(200,t) if t else self._reply(204)
+                    elif self.path=="/heartbeat":
+                        self._reply(200,coord.heartbeat(name, d.get("slots"), d.get("tasks") or {}))
+                    elif self.path=="/done":
+                        coord.finish(name, d["id"], d["rc"], d.get("log") or []); self._reply(200,{})
+                    else:
+                        self._reply(404,{"error":"not found"})
+                except (ValueError,KeyError,TypeError) as e:
+                    self._reply(400,{"error":str(e)})
+        return Handler
+
+# ---------- Воркер ----------
+class Worker:
+    def __init__(self, url, name=None, slots=1, token="", path_map=(), log=None):
+        self.url=url.rstrip("/"); self.name=name or f"{socket.gethostname()}:{os.getpid()}"
+        self.slots=max(1,slots); self.token=token; self.path_map=list(path_map)
+        self.log=log or (lambda s: (sys.stdout.write(s), sys.stdout.flush()))
+        self.lock=threading.Lock(); self.tasks={}; self.stop_flag=threading.Event()
+        self.cancelled=set()                # задачі, скасовані координатором: про них не звітуємо
+        self.policy=ProcPolicy.from_env()   # nice/ionice/ядра вузла (DRYMIXER_NICE, …)
+
+    def _post(self, path, obj) -> dict | None:
+        req=urllib.request.Request(self.url+path, data=json.dumps(obj).encode("utf-8"), method="POST",
+                                   headers={"Content-Type":"application/json","X-Farm-Token":self.token})
+        with urllib.request.urlopen(req, timeout=10) as r:
+            body=r.read()
+            return json.loads(body) if r.status==200 and body else None
+
+    def _map(self, arg):
+        for src,dst in self.path_map:
+            if isinstance(arg,str) and arg.startswith(src): return dst+arg[len(src):]
+        return arg
+
+    def _map_lists(self, cmd, tmp) -> list:
+        # Списки concat (частини, сегменти, аудіо) пише координатор його шляхами: воркер читає
+        # переписану копію з тимчасової теки, сам список на спільному сховищі не змінюється
+        out=list(cmd); fmt=None
+        for i,a in enumerate(cmd[:-1]):
+            if a=="-f": fmt=cmd[i+1]
+            elif a=="-i":
+                if fmt=="concat":
+                    src=Path(cmd[i+1]); dst=Path(tmp)/f"{i}_{src.name}"; lines=[]
+                    for line in src.read_text(encoding="utf-8").splitlines():
+                        if line.startswith("file '") and line.endswith("'"): line=f"file '{self._map(line[6:-1])}'"
+                        lines.append(line)
+                    dst.write_text("\n".join(lines)+"\n",encoding="utf-8"); out[i+1]=str(dst)
+                fmt=None
+        return out
+
+    def _run(self, task):
+        tid=task["id"]; cmd=[self._map(a) for a in task["cmd"]]; state={}; tail=collections.deque(maxlen=LOG_TAIL)
+        rc=-1
+        # Воркер запускає лише ffmpeg: довільна команда від координатора (чи підробленого) відхиляється
+        if not cmd or cmd[0]!="ffmpeg" or not all(isinstance(a,str) for a in cmd):
+            self.log(f"[ВОРКЕР] #{tid} відхилено: дозволено лише ffmpeg.\n")
+            try: self._post("/done",{"worker":self.name,"id":tid,"rc":rc,"log":["Воркер виконує лише ffmpeg — задачу відхилено.\n"]})
+            except (OSError,ValueError) as e: self.log(f"[ВОРКЕР] Не вдалося звітувати про #{tid}: {e}\n")
+            return
+        self.log(f"[ВОРКЕР] #{tid} (спроба {task['attempt']}): {' '.join(cmd)}\n")
+        tmp=tempfile.mkdtemp(prefix="drymixer_farm_") if self.path_map else None
+        try:
+            if tmp: cmd=self._map_lists(cmd, tmp)
+            p=subprocess.Popen(self.policy.wrap(cmd), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                               bufsize=1, errors="replace", **self.policy.popen_kwargs())
+            self.policy.apply(p.pid)
+            with self.lock: self.tasks[tid]=(p,state)
+            for line in p.stdout:  # type: ignore
+                if not parse_progress_line(line, state): tail.append(line)
+            rc=p.wait()
+        except OSError as e:
+            tail.append(f"{e}\n")
+        finally:
+            with self.lock:
+                self.tasks.pop(tid,None); cancelled=tid in self.cancelled; self.cancelled.discard(tid)
+            if tmp: shutil.rmtree(tmp, ignore_errors=True)
+        if cancelled: return
+        self.log(f"[ВОРКЕР] #{tid} → код {rc}\n")
+        try: self._post("/done",{"worker":self.name,"id":tid,"rc":rc,"log":list(tail)})
+        except (OSError,ValueError) as e: self.log(f"[ВОРКЕР] Не вдалося звітувати про #{tid}: {e}\n")
+
+    def _heartbeat(self):
+        while not self.stop_flag.wait(HEARTBEAT_S):
+            with self.lock: tasks={tid:{k:st.get(k) for k in ("out_time","speed","fps") if k in st}
+                                   for tid,(p,st) in self.tasks.items()}
+            try: r=self._post("/heartbeat",{"worker":self.name,"slots":self.slots,"tasks":tasks}) or {}
+            except (OSError,ValueError): continue
+            for tid in r.get("cancel",[]):
+                with self.lock:
+                    p=self.tasks.pop(tid,(None,None))[0]
+                    if p: self.cancelled.add(tid)           # _run не звітуватиме про скасовану задачу
+                if p:
+                    self.log(f"[ВОРКЕР] #{tid} скасовано координатором.\n")
+                    try: p.kill()
+                    except OSError: pass
+
+    def serve(self):
+        self.log(f"[ВОРКЕР] {self.name}: {self.slots} слот(и), координатор {self.url}\n")
+        threading.Thread(target=self._heartbeat, daemon=True).start()
+        busy=[]
+        while not self.stop_flag.is_set():
+            busy=[t for t in busy if t.is_alive()]
+            free=self.slots-len(busy)
+            try: task=self._post("/lease",{"worker":self.name,"free":free}) if free>0 else None
+            except (OSError,ValueError):
+                task=None; self.stop_flag.wait(HEARTBEAT_S)
+            if task is None: self.stop_flag.wait(0.5); continue
+            t=threading.Thread(target=self._run, args=(task,), daemon=True); t.start(); busy.append(t)
+        with self.lock: procs=[p for p,_ in self.tasks.values() if p]
+        for p in procs:
+            try: p.kill()
+            except OSError: pass
+
+# ---------- CLI ----------
+def run_coordinator(args) -> int:
+    try: specs=[s for p in args.jobs for s in load_specs(p)]
+    except (OSError,ValueError,TypeError) as e:
+        print(f"[ПОМИЛКА] {e}",file=sys.stderr); return 2
+    if not args.token and not is_loopback(args.host):
+        print(f"[ПОМИЛКА] Прослуховування {args.host} без --token/DRYMIXER_FARM_TOKEN заборонено.",file=sys.stderr); return 2
+    disk=session_log("farm.log")
+    log=lambda s: (sys.stdout.write(s), sys.stdout.flush(), disk.write(s))
+    coord=Coordinator(args.host, args.port, args.token, log=log)
+    log(f"[ФЕРМА] Координатор на порту {coord.port}.\n")
+    engine=Engine(log=log); engine.remote=coord
+    local=[subprocess.Popen([sys.executable, os.path.abspath(__file__), "worker", "--url", f"http://127.0.0.1:{coord.port}",
+                             "--name", f"local{i+1}", "--slots", str(args.slots), "--token", args.token])
+           for i in range(args.local_workers)]
+    for sig in (signal.SIGINT, getattr(signal,"SIGTERM",None)):
+        if sig is not None: signal.signal(sig, lambda *_: engine.stop())
+    busy=threading.Event()
+    def report():
+        while not busy.wait(args.progress):
+            st=coord.status()
+            log(f"[ПРОГРЕС] {progress_text(engine.tracker.snapshot(),engine.tracker.jobs)} | черга {st['queued']}, "
+                f"виконується {st['running']}, воркерів {len(st['workers'])}\n")
+    threading.Thread(target=report, daemon=True).start()
+    rc=0
+    try:
+        for spec in specs:
+            try: engine.run(spec)
+            except RuntimeError as e:
+                if str(e)=="Зупинено": log("[СТОП] Перервано.\n"); return 130
+                log(f"[ПОМИЛКА] {e}\n"); rc=1
+            except (OSError,ValueError) as e:
+                log(f"[ПОМИЛКА] {e}\n"); rc=1
+    finally:
+        busy.set(); coord.close()
+        for p in local: p.terminate()
+        for p in local: p.wait()
+    return rc
+
+def main(argv=None) -> int:
+    ap=argparse.ArgumentParser(description="Dry Mixer: координатор і воркери ферми рендерингу.")
+    sub=ap.add_subparsers(dest="mode", required=True)
+    c=sub.add_parser("coordinator", help="зібрати завдання, роздаючи ffmpeg-задачі воркерам")
+    c.add_argument("jobs", nargs="+", help="файли завдань JSON")
+    c.add_argument("--host", default="127.0.0.1", help="адреса прослуховування; не локальна — лише з --token"); c.add_argument("--port", type=int, default=FARM_PORT)
+    c.add_argument("--local-workers", type=int, default=0, help="запустити N воркерів на цій машині")
+    c.add_argument("--slots", type=int, default=1, help="слотів у кожного локального воркера")
+    c.add_argument("--progress", type=float, default=5.0, metavar="СЕК")
+    w=sub.add_parser("worker", help="брати задачі в координатора й виконувати ffmpeg")
+    w.add_argument("--url", required=True); w.add_argument("--name")
+    w.add_argument("--slots", type=int, default=1, help="скільки задач виконувати одночасно")
+    w.add_argument("--path-map", action="append", default=[], metavar="ЗВІДКИ=КУДИ",
+                   help="переписати префікс шляху в командах (інша точка монтування сховища)")
+    s=sub.add_parser("status", help="стан черги й воркерів")
+    s.add_argument("--url", required=True)
+    for p in (c,w,s): p.add_argument("--token", default=os.environ.get("DRYMIXER_FARM_TOKEN",""), help="спільний секрет")
+    args=ap.parse_args(argv)
+
+    if args.mode=="status":
+        req=urllib.request.Request(args.url.rstrip("/")+"/status", headers={"X-Farm-Token":args.token})
+        try:
+            with urllib.request.urlopen(req, timeout=10) as r: print(json.dumps(json.loads(r.read()),ensure_ascii=False,indent=2))
+        except (OSError,ValueError) as e:
+            print(f"[ПОМИЛКА] {e}",file=sys.stderr); return 2
+        return 0
+    if not have_ffmpeg():
+        print("[ПОМИЛКА] Не знайдено ffmpeg/ffprobe у PATH.",file=sys.stderr); return 2
+    if args.mode=="worker":
+        pm=[tuple(m.split("=",1)) for m in args.path_map if "=" in m]
+        wk=Worker(args.url, args.name, args.slots, args.token, pm)
+        for sig in (signal.SIGINT, getattr(signal,"SIGTERM",None)):
+            if sig is not None: signal.signal(sig, lambda *_: wk.stop_flag.set())
+        wk.serve(); return 0
+    return run_coordinator(args)
+
+if __name__=="__main__":
+    raise SystemExit(main())
@@ -0,0 +1,224 @@
+# Dry Mixer — тека-вхідник: нові кліпи пробуються й нормалізуються у фоні одразу після появи,
+# а щойно матеріалу набирається на цільову тривалість, автоматично збирається компіляція —
+# на момент старту лишається лише фінальне кодування.
+#   python drymixer_watch.py job.json --dir incoming [--settle 5] [--interval 2] [--once]
+# Завдання — звичайний JSON (duration, out, codec, out_mode, …); files у ньому ігнорується.
+# Вихід — out з номером (out_1.mp4, out_2.mp4, …). Стан теки: <тека>/.drymixer_watch.json.
+
+import argparse, json, os, queue, signal, sys, threading, time
+from dataclasses import replace
+from pathlib import Path
+
+from drymixer_engine import (NORM_CACHE, PROBE_CACHE, Engine, Tracer, have_ffmpeg, load_specs, numbered_out,
+                             parse_duration, session_log)
+
+VIDEO_EXTS = (".mp4",".mov",".m4v",".mkv",".ts",".webm",".avi")
+STATE_NAME = ".drymixer_watch.json"
+
+def file_ident(p) -> list | None:
+    try: st=os.stat(p)
+    except OSError: return None
+    return [st.st_size, st.st_mtime_ns]
+
+# ---------- Тека-вхідник ----------
+class Watcher:
+    def __init__(self, spec, folder: Path, settle=5.0, interval=2.0, log=None):
+        self.spec=spec; self.folder=folder; self.settle=settle; self.interval=interval
+        self.log=log or (lambda s: (sys.stdout.write(s), sys.stdout.flush()))
+        self.target=parse_duration(spec.duration) or 3600
+        self.ingest=Engine(log=self.log); self.render=Engine(log=self.log)
+        self.stop_flag=threading.Event(); self.lock=threading.Lock()
+        self.seen={}            # шлях → [розмір, mtime, коли востаннє змінився]
+        self.queued=set()       # стабільні, чекають інжесту
+        self.pool=[]            # (шлях, тривалість) — готові до компіляції, у порядку надходження
+        self.pinned={}          # шлях → закріплений файл кешу нормалізації
+        self.inflight=set()     # віддані поточній компіляції
+        self.todo=queue.Queue(); self.jobs=queue.Queue()
+        self.busy=False; self.blocked=False     # blocked — після невдалої компіляції чекаємо нового матеріалу
+        self.state_path=folder/STATE_NAME; self.state=self._load_state()
+
+        # Параметри кодування ті самі, що й у run(): ключі кешу нормалізації збігаються
+        self.vf,self.rate=self.ingest.video_filters_and_rate(spec)
+        enc,is_copy=self.ingest.choose_encoder_args(spec, self.vf, self.rate)
+        self.enc=self.ingest.check_capabilities(spec, self.vf, enc, is_copy)
+        self.prenorm=spec.out_mode=="norm" and not is_copy
+
+    # ---------- Стан ----------
+    def _load_state(self) -> dict:
+        try: data=json.loads(self.state_path.read_text(encoding="utf-8"))
+        except (OSError,ValueError): data=None
+        if not isinstance(data,dict) or data.get("version")!=1: data={"version":1,"seq":0,"used":{},"bad":{},"outputs":[]}
+        return data
+
+    def _save_state(self):
+        # Викликається під self.lock; атомарно, як маніфест пакета
+        try:
+            tmp=self.state_path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(self.state,ensure_ascii=False),encoding="utf-8")
+            os.replace(tmp,self.state_path)
+        except OSError:
+            pass
+
+    # ---------- Сканування ----------
+    def scan(self):
+        # Файл вважається дописаним, коли розмір і mtime не змінюються settle секунд
+        now=time.monotonic(); outs=set(self.state["outputs"])
+        try: entries=list(os.scandir(self.folder))
+        except OSError as e:
+            self.log(f"[ПОМИЛКА] Тека {self.folder}: {e}\n"); return
+        with self.lock:
+            for e in entries:
+                if e.name.startswith(".") or not e.name.lower().endswith(VIDEO_EXTS): continue
+                p=str(Path(e.path).resolve())
+                if p in outs or p in self.queued or p in self.inflight or p in self.pinned or any(p==q for q,_ in self.pool): continue
+                ident=file_ident(p)
+                if ident is None or ident[0]==0: continue
+                if self.state["used"].get(p)==ident or self.state["bad"].get(p)==ident: continue
+                old=self.seen.get(p)
+                if old is None or old[:2]!=ident: self.seen[p]=ident+[now]; continue
+                if now-old[2]<self.settle: continue
+                del self.seen[p]; self.queued.add(p); self.todo.put(p)
+
+    # ---------- Інжест ----------
+    def _ingest_loop(self):
+        while not self.stop_flag.is_set():
+            try: first=self.todo.get(timeout=0.5)
+            except queue.Empty: continue
+            batch=[first]
+            while True:
+                try: batch.append(self.todo.get_nowait())
+                except queue.Empty: break
+            try: self._ingest(batch)
+            except RuntimeError as e:
+                if str(e)!="Зупинено": self.log(f"[ПОМИЛКА] Інжест: {e}\n")
+            finally:
+                # Запуск компіляції — до зняття позначки «в обробці», щоб --once не вийшов між ними
+                self._maybe_trigger()
+                with self.lock: self.queued.difference_update(batch)
+
+    def _ingest(self, batch):
+        # Пробування (кеш ffprobe) і, для «Нормалізувати кожен», кодування в кеш нормалізації;
+        # готові файли закріплюються до використання в компіляції
+        self.ingest.tracer=Tracer()      # демон живе довго — траса інжесту не накопичується
+        probed=self.ingest._probe(batch); good=[]; bad=[]
+        for p in batch:
+            d=(probed.get(p) or {}).get("duration",0.0)
+            (good if d>0 else bad).append((p,d))
+        mapped={}
+        if good and self.prenorm:
+            try: mapped=self.ingest.normalize_clips(self.spec, [p for p,_ in good], self.vf, self.rate, "[ВХІД] ", 0, self.enc)
+            except RuntimeError as e:
+                if str(e)=="Зупинено": raise
+                # Один зіпсований файл не має блокувати решту — кодуємо поодинці
+                for p,_ in good:
+                    try: mapped.update(self.ingest.normalize_clips(self.spec, [p], self.vf, self.rate, "[ВХІД] ", 0, self.enc))
+                    except RuntimeError as e2:
+                        if str(e2)=="Зупинено": raise
+                bad+=[(p,d) for p,d in good if p not in mapped]; good=[(p,d) for p,d in good if p in mapped]
+        PROBE_CACHE.save()
+        with self.lock:
+            for p,_ in bad:
+                ident=file_ident(p)
+                if ident: self.state["bad"][p]=ident
+                self.log(f"[ВХІД] {Path(p).name}: не вдалося прочитати — пропущено до зміни файлу.\n")
+            for p,d in good:
+                self.pool.append((p,d))
+                if p in mapped: self.pinned[p]=mapped[p]
+            if good: self.blocked=False
+            if bad: self._save_state()
+            have=sum(d for _,d in self.pool)
+        if good:
+            self.log(f"[ВХІД] Готово {len(good)} кліпів" + (" (нормалізовано)" if self.prenorm else "")
+                     + f"; матеріалу {have/60:.1f} хв із {self.target/60:.1f} хв.\n")
+
+    # ---------- Компіляції ----------
+    def _maybe_trigger(self):
+        # Найстаріші кліпи, доки сума не покриє ціль; компіляції йдуть по одній
+        with self.lock:
+            if self.busy or self.blocked or sum(d for _,d in self.pool)<self.target: return
+            take=[]; total=0.0
+            while self.pool and total<self.target:
+                p,d=self.pool.pop(0); take.append((p,d)); total+=d
+            self.inflight={p for p,_ in take}; self.busy=True; self.state["seq"]+=1; seq=self.state["seq"]; self._save_state()
+        self.jobs.put((seq,take))
+
+    def _render_loop(self):
+        while not self.stop_flag.is_set():
+            try: seq,take=self.jobs.get(timeout=0.5)
+            except queue.Empty: continue
+            out=numbered_out(Path(self.spec.out).expanduser().resolve(), seq)
+            spec=replace(self.spec, files=[p for p,_ in take], out=str(out), resume=False)
+            self.log(f"\n[ВХІД] Компіляція №{seq}: {len(take)} кліпів, {sum(d for _,d in take)/60:.1f} хв → {out.name}\n")
+            ok=False
+            try:
+                done=self.render.run(spec); ok=True
+            except RuntimeError as e:
+                if str(e)!="Зупинено": self.log(f"[ПОМИЛКА] Компіляція №{seq}: {e}\n")
+            except (OSError,ValueError) as e:
+                self.log(f"[ПОМИЛКА] Компіляція №{seq}: {e}\n")
+            with self.lock:
+                if ok:
+                    for p,_ in take:
+                        ident=file_ident(p)
+                        if ident: self.state["used"][p]=ident
+                        hit=self.pinned.pop(p,None)
+                        if hit: NORM_CACHE.unpin([hit])
+                    self.state["outputs"]+=[str(Path(d).resolve()) for d in done]
+                else:
+                    # Кліпи повертаються на початок черги; повтор — лише з новим матеріалом
+                    self.pool[:0]=take; self.blocked=not self.stop_flag.is_set()
+                self._save_state(); self.inflight=set(); self.busy=False
+            self._maybe_trigger()
+
+    # ---------- Цикл ----------
+    def stop(self):
+        self.stop_flag.set(); self.ingest.stop(); self.render.stop()
+
+    def idle(self) -> bool:
+        with self.lock: return not (self.seen or self.queued or self.busy) and self.jobs.empty()
+
+    def serve(self, once=False) -> int:
+        self.log(f"[ВХІД] Стежу за {self.folder}: ціль {self.target/60:.1f} хв, "
+                 + ("нормалізація при надходженні" if self.prenorm else "лише пробування") + f", стабільність {self.settle:g} с.\n")
+        threads=[threading.Thread(target=self._ingest_loop,daemon=True), threading.Thread(target=self._render_loop,daemon=True)]
+        for t in threads: t.start()
+        while not self.stop_flag.is_set():
+            self.scan()
+            if once and self.idle(): break
+            self.stop_flag.wait(self.interval)
+        self.stop_flag.set()
+        for t in threads: t.join()
+        with self.lock:
+            NORM_CACHE.unpin(self.pinned.values()); left=sum(d for _,d in self.pool)
+        self.log(f"[ВХІД] Зупинено; у черзі {len(self.pool)} кліпів ({left/60:.1f} хв), зібрано {self.state['seq']}.\n")
+        return 0
+
+def main(argv=None) -> int:
+    ap=argparse.ArgumentParser(description="Dry Mixer: тека-вхідник з автоматичною збіркою компіляцій.")
+    ap.add_argument("job", help="файл завдання JSON (один об'єкт): параметри компіляцій")
+    ap.add_argument("--dir", required=True, help="тека, куди надходять кліпи")
+    ap.add_argument("--settle", type=float, default=5.0, metavar="СЕК", help="файл не змінювався стільки — дописано")
+    ap.add_argument("--interval", type=float, default=2.0, metavar="СЕК", help="період сканування теки")
+    ap.add_argument("--once", action="store_true", help="обробити наявне й вийти (cron)")
+    args=ap.parse_args(argv)
+    try: specs=load_specs(args.job)
+    except (OSError,ValueError,TypeError) as e:
+        print(f"[ПОМИЛКА] {e}",file=sys.stderr); return 2
+    if len(specs)!=1: ap.error("потрібне рівно одне завдання")
+    folder=Path(args.dir).expanduser().resolve()
+    if not folder.is_dir(): print(f"[ПОМИЛКА] Немає теки {folder}",file=sys.stderr); return 2
+    if not have_ffmpeg():
+        print("[ПОМИЛКА] Не знайдено ffmpeg/ffprobe у PATH.",file=sys.stderr); return 2
+
+    disk=session_log("watch.log")
+    log=lambda s: (sys.stdout.write(s), sys.stdout.flush(), disk.write(s))
+    try: w=Watcher(specs[0], folder, args.settle, args.interval, log)
+    except ValueError as e:
+        print(f"[ПОМИЛКА] {e}",file=sys.stderr); return 2
+    if specs[0].files: log("[ВХІД] files у завданні ігнорується — кліпи беруться з теки.\n")
+    for sig in (signal.SIGINT, getattr(signal,"SIGTERM",None)):
+        if sig is not None: signal.signal(sig, lambda *_: w.stop())
+    return w.serve(once=args.once)
+
+if __name__=="__main__":
+    raise SystemExit(main())
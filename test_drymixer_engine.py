@@ -0,0 +1,204 @@
+# Юніт-тести рушія без ffmpeg і мережі: python -m pytest -q
+
+import collections, os, random
+from pathlib import Path
+
+import pytest
+
+import drymixer_engine
+from drymixer_engine import (BatchManifest, ClipModel, Engine, JobSpec, ProbeCache, fps_float, gap_violations,
+                             infer_block_size, parse_hexdump, parse_progress_line, plan_duration, plan_segments,
+                             segment_frames, shuffle_ids, x264_options, x264_tail_params)
+
+# ---------- Шафл ----------
+@pytest.mark.parametrize("clips,rep,k", [(10,100,5),(10,100,7),(10,100,9),(20,50,10),(100,100,50),(100,100,90),(3,5,2)])
+def test_min_gap_uniform_duplicates(clips, rep, k):
+    ids=[i%clips for i in range(clips*rep)]
+    for seed in range(10):
+        out=shuffle_ids(ids, "full", 0, k, random.Random(seed))
+        assert sorted(out)==sorted(ids)
+        assert gap_violations(out, k)==0
+
+def test_min_gap_achievable_random_counts():
+    # Досяжно, коли (top-1)*(k+1)+кількість_рівних_top ≤ n — тоді порушень бути не може
+    r=random.Random(1); checked=0
+    for t in range(300):
+        d=r.randint(2,30); ids=[i for i in range(d) for _ in range(r.randint(1,20))]
+        c=collections.Counter(ids); top=max(c.values()); m=sum(1 for v in c.values() if v==top)
+        k=r.randint(1,d-1)
+        if (top-1)*(k+1)+m>len(ids): continue
+        checked+=1
+        assert gap_violations(shuffle_ids(ids, "full", 0, k, random.Random(t)), k)==0
+    assert checked>50
+
+# ---------- Кеш ffprobe ----------
+@pytest.fixture
+def fake_probe(monkeypatch):
+    # Замість ffprobe — лічильник викликів; запис залежить лише від розміру файлу
+    calls=[]
+    def info(p):
+        calls.append(p); return {"duration":float(os.path.getsize(p)), "sig":["h264",640,360,"yuv420p","25","aac",2,"48000"]}
+    monkeypatch.setattr(drymixer_engine, "ffprobe_info", info)
+    return calls
+
+def test_probe_cache_peek_never_probes(tmp_path, fake_probe):
+    clip=tmp_path/"a.mp4"; clip.write_bytes(b"x"*10); c=ProbeCache(tmp_path/"probe.json")
+    assert c.peek(clip) is None and c.peek(tmp_path/"missing.mp4") is None and not fake_probe
+    assert c.get(clip)["duration"]==10.0 and c.get(clip)["duration"]==10.0 and len(fake_probe)==1
+    assert c.peek(clip)["duration"]==10.0 and len(fake_probe)==1
+
+def test_probe_cache_invalidated_by_size_and_mtime(tmp_path, fake_probe):
+    clip=tmp_path/"a.mp4"; clip.write_bytes(b"x"*10); c=ProbeCache(tmp_path/"probe.json")
+    c.get(clip)
+    clip.write_bytes(b"x"*20)
+    assert c.peek(clip) is None and c.get(clip)["duration"]==20.0 and len(fake_probe)==2
+    st=os.stat(clip); os.utime(clip, ns=(st.st_atime_ns, st.st_mtime_ns+10**9))
+    assert c.peek(clip) is None and c.get(clip) and len(fake_probe)==3
+
+def test_probe_cache_save_load_roundtrip(tmp_path, fake_probe):
+    clip=tmp_path/"a.mp4"; clip.write_bytes(b"x"*10); path=tmp_path/"cache"/"probe.json"
+    c=ProbeCache(path); c.save(); assert not path.exists()           # нічого нового — без запису
+    c.get(clip); c.save()
+    d=ProbeCache(path)
+    assert d.peek(clip)["duration"]==10.0 and d.get(clip)["sig"][1]==640 and len(fake_probe)==1
+
+def test_probe_cache_failed_probe_not_cached(tmp_path, monkeypatch):
+    calls=[]
+    monkeypatch.setattr(drymixer_engine, "ffprobe_info", lambda p: calls.append(p))
+    clip=tmp_path/"bad.mp4"; clip.write_bytes(b"x"); c=ProbeCache(tmp_path/"probe.json")
+    assert c.get(clip) is None and c.get(clip) is None and len(calls)==2 and not c.dirty
+
+# ---------- Частини фіналу ----------
+def test_plan_segments_cover_timeline():
+    durs=[4.0,6.0,5.0,5.0,10.0]
+    segs=plan_segments(durs, 3)
+    assert len(segs)==3 and segs[0][0]==0 and segs[-1][1]==len(durs)
+    assert all(a[1]==b[0] for a,b in zip(segs,segs[1:]))
+    assert sum(d for *_,d in segs)==pytest.approx(sum(durs))
+
+def test_plan_segments_limit_trims_last_part():
+    segs=plan_segments([10.0,10.0,10.0,10.0], 4, limit=25)
+    assert segs[-1][1]==3 and sum(d for *_,d in segs)==pytest.approx(25)
+
+def test_segment_frames_sum_matches_single_pass():
+    segs=plan_segments([3.33,4.17,2.5,6.01], 3)
+    fps=30000/1001
+    assert sum(segment_frames(segs, fps))==round(sum(d for *_,d in segs)*fps)
+
+# ---------- Прогрес ffmpeg ----------
+def test_parse_progress_line():
+    st={}
+    assert parse_progress_line("out_time_us=12500000\n", st) and st["out_time"]==12.5
+    assert parse_progress_line("speed=1.5x\n", st) and st["speed"]==1.5
+    assert parse_progress_line("speed=N/A\n", st) and st["speed"]==0.0
+    assert parse_progress_line("fps=29.97\n", st) and st["fps"]==29.97
+    assert parse_progress_line("progress=end\n", st) and st["end"]
+    assert parse_progress_line("out_time_us=N/A\n", st) and st["out_time"]==12.5
+    assert not parse_progress_line("[mp4 @ 0x1] Starting second pass: moving the moov atom\n", st)
+    assert not parse_progress_line("Duration: 00:00:05.00, start=0\n", st)
+
+def test_shuffle_ids_block_keeps_blocks():
+    ids=[0,1,2,3]*5
+    out=shuffle_ids(ids, "block", 4, 1, random.Random(3))
+    assert all(sorted(out[i:i+4])==[0,1,2,3] for i in range(0,len(out),4))
+    assert gap_violations(out, 1)==0
+
+# ---------- Блоки ----------
+@pytest.mark.parametrize("items,size", [([],0), ([1,2,3,1,2,3,1,2,3],3), ([1,2,1,2,1],2), ([1,2,3,4],4), ([5,5,5],1), ([1,2,3,1,4],3)])
+def test_infer_block_size(items, size):
+    assert infer_block_size(items)==size
+
+# ---------- План тривалості ----------
+def test_plan_duration_fills_within_tolerance():
+    durs=[10.0,7.0,3.0,5.0]
+    out,total=plan_duration([0,1,2,3], durs, 100, tol=1, min_gap=2, rng=random.Random(0))
+    assert abs(total-100)<=1 and total==sum(durs[i] for i in out)
+    assert gap_violations(out, 2)==0
+
+def test_plan_duration_no_fill_drops_tail():
+    out,total=plan_duration([0,1,2], [10.0,10.0,10.0], 15, fill=False)
+    assert out==[0,1] and total==20.0
+
+def test_plan_duration_unknown_and_no_target():
+    assert plan_duration([0,1], [0.0,-1.0], 60)==([0,1],0.0)
+    assert plan_duration([1,0], [2.0,3.0], 0)==([1,0],5.0)
+
+# ---------- Список кліпів ----------
+def test_clip_model_move_single_and_group():
+    m=ClipModel("abcdef")
+    assert m.move([0], 3)==3 and "".join(m.files())=="bcdaef"
+    m=ClipModel("abcdef")
+    assert m.move([1,3], 0)==0 and "".join(m.files())=="bdacef"
+    m=ClipModel("abcdef")
+    assert m.move([0,2,4], 99)==3 and "".join(m.files())=="bdface"
+
+# ---------- Маніфест пакета ----------
+def test_batch_manifest_resume_roundtrip(tmp_path):
+    out=tmp_path/"out.mp4"; spec=JobSpec(files=["a.mp4","b.mp4"], out=str(out), batch=2, seed=7)
+    m=BatchManifest.create(out, spec, 7)
+    m.set_playlist(1, ["b.mp4","a.mp4","b.mp4"], 12.5); m.set_playlist(2, ["a.mp4"], None)
+    done=tmp_path/"out_1.mp4"; done.write_bytes(b"x"); m.mark(1, "done", done)
+
+    r=BatchManifest.load(out)
+    assert r is not None and r.matches(spec) and r.data["seed"]==7
+    assert r.playlist(1)==["b.mp4","a.mp4","b.mp4"] and r.job(1)["planned"]==12.5 and r.playlist(2)==["a.mp4"]
+    assert r.playlist(3) is None
+    assert r.is_done(1, done) and not r.is_done(2, tmp_path/"out_2.mp4")
+    spec.parallel=4; assert r.matches(spec)          # parallel/seed/resume на результат не впливають
+    spec.duration="00:10:00"; assert not r.matches(spec)
+    r.remove(); assert BatchManifest.load(out) is None
+
+# ---------- FPS джерела ----------
+@pytest.mark.parametrize("v,want", [("30000/1001",30000/1001), ("25",25.0), (50,50.0), ("0/0",25.0), (None,25.0), ("nan",25.0), ("abc",25.0)])
+def test_fps_float(v, want):
+    assert fps_float(v)==pytest.approx(want)
+
+# ---------- Точний різ ----------
+SEI=(b"\x06\x05\xff\xffx264 - core 164 r3106 eaa68fa - H.264/MPEG-4 AVC codec - Copyleft 2003-2023 - "
+     b"http://www.videolan.org/x264.html - options: cabac=0 ref=5 deblock=1:0:0 analyse=0x1:0x111 me=umh subme=8 "
+     b"psy=1 psy_rd=1.00:0.00 trellis=1 8x8dct=0 chroma_qp_offset=-2 bframes=0 weightp=0 keyint=50 rc=crf mbtree=1 "
+     b"crf=30.0 qcomp=0.60\x00\x80")
+
+def test_x264_tail_params_from_sei(tmp_path):
+    src=tmp_path/"b.mp4"; src.write_bytes(b"\0"*1000+SEI+b"\0"*1000)
+    o=x264_options(src); assert o["crf"]=="30.0" and o["deblock"]=="1:0:0"
+    assert x264_tail_params(o)==("cabac=0:ref=5:8x8dct=0:bframes=0:weightp=0:keyint=50:crf=30.0:trellis=1:psy=1:"
+                                 "psy-rd=1.00,0.00:subme=8")    # chroma_qp_offset libx264 виводить сам
+    assert x264_tail_params({**o, "rc":"abr"}) is None
+
+def test_parse_hexdump():
+    text=("\"\n00000000: 0164 000d ffe1 0019 6764 000d acd9 4141  .d......gd....AA\n"
+          "00000010: 6001 0006 68eb e3cb 22c0                 `...h...\".\n\"\n")
+    assert parse_hexdump(text)==bytes.fromhex("0164000dffe100196764000dacd9414160010006" "68ebe3cb22c0")
+
+@pytest.fixture
+def trim_engine(tmp_path, monkeypatch):
+    # Рушій із підміненими ffprobe/ffmpeg: два кліпи по 6 с, різ на 9 с посеред GOP другого
+    a,b=tmp_path/"a.mp4",tmp_path/"b.mp4"; a.write_bytes(SEI); b.write_bytes(SEI)
+    sig=["h264",320,240,"yuv420p","25/1","aac",2,48000]
+    log=[]; eng=Engine(log=log.append); eng.cmds=[]; eng.log_lines=log
+    eng._probe=lambda paths, dry=False: {p:{"duration":6.0,"sig":sig} for p in paths}
+    monkeypatch.setattr(drymixer_engine, "keyframe_before", lambda p, t: {"key":2.0,"profile":"High","level":30,"timescale":12800})
+    eng.run_cmd=lambda cmd, **k: eng.cmds.append(cmd) or 0
+    eng.extradata={}
+    monkeypatch.setattr(drymixer_engine, "h264_extradata", lambda p: eng.extradata.get(Path(p).name, b"\x01src"))
+    ctx={"t_args":["-t","9"], "abr":"192k"}; work=tmp_path/"work"; work.mkdir()
+    eng.trim=lambda: eng._smart_trim(0, ctx, [a,b], work, "")
+    return eng
+
+def test_smart_trim_matching_sps_pps(trim_engine):
+    lst=trim_engine.trim()
+    assert lst is not None and "outpoint 2.000000" in lst.read_text(encoding="utf-8")
+    cmd=trim_engine.cmds[0]; assert cmd[cmd.index("-x264-params")+1].startswith("cabac=0:ref=5:")
+
+def test_smart_trim_other_encoder_falls_back(trim_engine, tmp_path):
+    # H.264 не від libx264 (інший кодер, без SEI x264) — хвіст не кодується взагалі
+    (tmp_path/"b.mp4").write_bytes(b"\0"*4096)
+    assert trim_engine.trim() is None and not trim_engine.cmds
+    assert any("не libx264" in s for s in trim_engine.log_lines)
+
+def test_smart_trim_sps_pps_mismatch_falls_back(trim_engine):
+    # інший профіль/параметри: avcC хвоста відрізняється від джерела — копія без хвоста
+    trim_engine.extradata["trim_tail.mp4"]=b"\x01tail"
+    assert trim_engine.trim() is None and trim_engine.cmds
+    assert any("SPS/PPS" in s for s in trim_engine.log_lines)
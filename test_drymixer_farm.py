@@ -0,0 +1,42 @@
+# Юніт-тести воркера ферми (без ffmpeg і мережі): python -m pytest -q
+
+import subprocess
+
+from drymixer_farm import Worker
+
+def _worker(**kw):
+    w=Worker("http://127.0.0.1:9", "w1", log=lambda s: None, **kw); w.sent=[]
+    w._post=lambda path, obj: w.sent.append((path,obj))
+    return w
+
+# ---------- Звіти ----------
+def test_popen_error_is_reported(monkeypatch):
+    def boom(*a, **k): raise OSError("немає такого файлу")
+    monkeypatch.setattr(subprocess, "Popen", boom)
+    w=_worker(); w._run({"id":7, "cmd":["ffmpeg","-i","a.mp4","b.mp4"], "attempt":1})
+    [(path,obj)]=w.sent
+    assert path=="/done" and obj["id"]==7 and obj["rc"]==-1 and "немає такого файлу" in "".join(obj["log"])
+    assert not w.tasks and not w.cancelled
+
+def test_non_ffmpeg_task_is_rejected():
+    w=_worker(); w._run({"id":3, "cmd":["sh","-c","true"], "attempt":1})
+    [(path,obj)]=w.sent
+    assert path=="/done" and obj["rc"]==-1
+
+# ---------- Інша точка монтування ----------
+def test_path_map_rewrites_concat_lists(tmp_path, monkeypatch):
+    lst=tmp_path/"seg_000.txt"
+    lst.write_text("file '/mnt/share/a.mp4'\nfile '/mnt/share/b.mp4'\noutpoint 1.500000\nfile '/elsewhere/c.mp4'\n", encoding="utf-8")
+    seen={}
+    class Proc:
+        pid=0; stdout=iter(())
+        def wait(self): return 0
+    def popen(argv, **k):
+        i=argv.index("-i"); seen["argv"]=argv; seen["list"]=open(argv[i+1],encoding="utf-8").read(); return Proc()
+    monkeypatch.setattr(subprocess, "Popen", popen)
+    w=_worker(path_map=[("/mnt/share","/data")])
+    w._run({"id":1, "cmd":["ffmpeg","-f","concat","-safe","0","-i",str(lst),"-c","copy","-f","mp4","/mnt/share/out.mp4"], "attempt":1})
+    assert seen["list"]=="file '/data/a.mp4'\nfile '/data/b.mp4'\noutpoint 1.500000\nfile '/elsewhere/c.mp4'\n"
+    assert seen["argv"][-1]=="/data/out.mp4" and seen["argv"][seen["argv"].index("-i")+1]!=str(lst)
+    assert lst.read_text(encoding="utf-8").startswith("file '/mnt/share/a.mp4'")     # спільний список не змінено
+    assert w.sent[0][1]["rc"]==0